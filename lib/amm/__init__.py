@@ -0,0 +1,29 @@
+from lib.amm import constant_product, fixed_point
+from lib.amm.constant_product import (
+    NO_FEE,
+    UNIV2_FEE,
+    amount_out_given_in,
+    price_given_in,
+    amount_in_give_out,
+    max_in_before_price_limit,
+    max_in_before_price_limit_sqrt,
+    spot_price,
+    ConstantProductPool,
+)
+from lib.amm.concentrated import ConcentratedPool
+
+## pool_type -> class, both take the same reserves, see make_pool
+POOL_TYPES = {"v2": ConstantProductPool, "v3": ConcentratedPool.from_reserves}
+
+
+def backend(exact=False):
+    ## Float math (constant_product) or the integer, Solidity rounding one (fixed_point), same function names
+    return fixed_point if exact else constant_product
+
+
+def make_pool(pool_type, reserve_in, reserve_out, fee=NO_FEE, **params):
+    """
+      "v2" -> x * y = k on the reserves
+      "v3" -> the same reserves concentrated around the current price, params go to ConcentratedPool.from_reserves
+    """
+    return POOL_TYPES[pool_type](reserve_in, reserve_out, fee=fee, **params)
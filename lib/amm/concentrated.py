@@ -0,0 +1,254 @@
+import math
+
+import numpy as np
+
+from lib.amm import constant_product
+from lib.amm.constant_product import NO_FEE
+
+"""
+  Concentrated liquidity (UniV3 like) pool, float math
+
+  Liquidity sits in tick ranges, price = TICK_BASE ** tick = token1 per token0
+  Same orientation as the constant product functions: token1 is reserve_in, token0 is reserve_out
+  So the sims' "pay in, buy out" is token1 in, price goes up (zero_for_one=False)
+
+  Index, built once from the positions:
+  - boundaries -> sorted sqrt prices of every initialised tick
+  - liquidity[i] -> active liquidity between boundaries[i] and boundaries[i + 1], prefix sum of liquidity_net
+  - cum0 / cum1[i] -> token0 / token1 locked between boundaries[0] and boundaries[i], prefix sums
+
+  Token amounts are then closed form at any sqrt price s in segment i:
+    F1(s) = cum1[i] + L[i] * (s - b[i])
+    F0(s) = cum0[i] + L[i] * (1 / b[i] - 1 / s)
+  Moving the price from s_a to s_b swaps |F0(s_b) - F0(s_a)| token0 for |F1(s_b) - F1(s_a)| token1
+  So every query is a binary search over the ticks, not a tick by tick swap loop, and broadcasts over arrays
+
+  fee is what's left of amount_in after the fee, same as lib/amm/constant_product.py
+  Past the last initialised tick there is no liquidity, swaps stop there (partial fill)
+"""
+
+TICK_BASE = 1.0001
+MIN_TICK = -887_272
+MAX_TICK = 887_272
+
+## 0.3% tier
+DEFAULT_TICK_SPACING = 60
+
+## from_reserves puts all the liquidity in price / (1 + range) .. price * (1 + range)
+DEFAULT_RANGE_BPS = 1_000
+MAX_BPS = 10_000
+
+
+def price_at_tick(tick):
+    return TICK_BASE ** np.asarray(tick, dtype=np.float64)
+
+
+def sqrt_price_at_tick(tick):
+    return TICK_BASE ** (np.asarray(tick, dtype=np.float64) / 2)
+
+
+def tick_at_price(price, tick_spacing=1):
+    ## Highest initialisable tick at or below price
+    tick = np.floor(np.log(price) / math.log(TICK_BASE) / tick_spacing) * tick_spacing
+    return np.clip(tick, MIN_TICK, MAX_TICK).astype(np.int64)
+
+
+def liquidity_for_amounts(sqrt_price, sqrt_lower, sqrt_upper, amount0, amount1):
+    ## LiquidityAmounts.getLiquidityForAmounts, most liquidity both amounts can back
+    if sqrt_price <= sqrt_lower:
+        return amount0 / (1 / sqrt_lower - 1 / sqrt_upper)
+    if sqrt_price >= sqrt_upper:
+        return amount1 / (sqrt_upper - sqrt_lower)
+    return min(amount0 / (1 / sqrt_price - 1 / sqrt_upper), amount1 / (sqrt_price - sqrt_lower))
+
+
+def _scalar(value):
+    ## 0-d arrays back to NumPy scalars
+    return value[()] if isinstance(value, np.ndarray) and value.ndim == 0 else value
+
+
+class ConcentratedPool():
+    def __init__(self, positions, price, fee=NO_FEE):
+        """
+          positions -> (tick_lower, tick_upper, liquidity) tuples, overlapping is fine
+          price -> current price, token1 per token0
+        """
+        net = {}
+        for (tick_lower, tick_upper, liquidity) in positions:
+            assert tick_lower < tick_upper
+            net[tick_lower] = net.get(tick_lower, 0) + liquidity
+            net[tick_upper] = net.get(tick_upper, 0) - liquidity
+
+        assert len(net) >= 2, "Need at least one position"
+        self.ticks = np.array(sorted(net), dtype=np.int64)
+        self.liquidity_net = np.array([net[tick] for tick in self.ticks.tolist()], dtype=np.float64)
+        self.boundaries = sqrt_price_at_tick(self.ticks)
+
+        ## Active liquidity of each segment, last entry is past the top tick (0)
+        self.liquidity = np.cumsum(self.liquidity_net)[:-1]
+
+        self.cum0 = np.concatenate(([0.0], np.cumsum(self.liquidity * (1 / self.boundaries[:-1] - 1 / self.boundaries[1:]))))
+        self.cum1 = np.concatenate(([0.0], np.cumsum(self.liquidity * (self.boundaries[1:] - self.boundaries[:-1]))))
+
+        self.sqrt_price = math.sqrt(price)
+        self.fee = fee
+
+    @classmethod
+    def from_reserves(cls, reserve_in, reserve_out, range_bps=DEFAULT_RANGE_BPS, tick_spacing=DEFAULT_TICK_SPACING, fee=NO_FEE):
+        """
+          One position around price = reserve_in / reserve_out, holding (up to) the same reserves
+          Same capital as a UniV2 pool of those reserves, concentrated in the range
+        """
+        price = reserve_in / reserve_out
+        tick_lower = int(tick_at_price(price / (1 + range_bps / MAX_BPS), tick_spacing))
+        tick_upper = int(tick_at_price(price * (1 + range_bps / MAX_BPS), tick_spacing)) + tick_spacing
+
+        liquidity = liquidity_for_amounts(
+            math.sqrt(price), float(sqrt_price_at_tick(tick_lower)), float(sqrt_price_at_tick(tick_upper)),
+            reserve_out, reserve_in
+        )
+        return cls([(tick_lower, tick_upper, liquidity)], price, fee)
+
+    def _segment(self, sqrt_price):
+        i = np.searchsorted(self.boundaries, sqrt_price, side='right') - 1
+        return np.clip(i, 0, len(self.liquidity) - 1)
+
+    def _clip(self, sqrt_price):
+        return np.clip(sqrt_price, self.boundaries[0], self.boundaries[-1])
+
+    def sqrt_price_at_amount1(self, amount1):
+        ## Inverse of F1, the lowest price holding amount1, a swap going up stops before an empty range
+        target = np.clip(np.asarray(amount1, dtype=np.float64), 0, self.cum1[-1])
+        i = np.clip(np.searchsorted(self.cum1, target, side='left') - 1, 0, len(self.liquidity) - 1)
+        liquidity = self.liquidity[i]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            s = self.boundaries[i] + (target - self.cum1[i]) / liquidity
+        return np.where(liquidity > 0, s, self.boundaries[i + 1])
+
+    def sqrt_price_at_amount0(self, amount0):
+        ## Inverse of F0, the highest price holding amount0, a swap going down stops before an empty range
+        target = np.clip(np.asarray(amount0, dtype=np.float64), 0, self.cum0[-1])
+        i = np.clip(np.searchsorted(self.cum0, target, side='right') - 1, 0, len(self.liquidity) - 1)
+        liquidity = self.liquidity[i]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            s = 1 / (1 / self.boundaries[i] - (target - self.cum0[i]) / liquidity)
+        return np.where(liquidity > 0, s, self.boundaries[i + 1])
+
+    def amount1_between(self, sqrt_low, sqrt_high):
+        ## token1 locked between two sqrt prices, sqrt_low <= sqrt_high
+        ## F1(high) - F1(low) term by term, so small moves don't cancel against big prefix sums
+        (low, high) = (self._clip(sqrt_low), self._clip(sqrt_high))
+        (i, j) = (self._segment(low), self._segment(high))
+        inside = self.liquidity[i] * (high - low)
+        across = self.liquidity[i] * (self.boundaries[i + 1] - low) + (self.cum1[j] - self.cum1[np.minimum(i + 1, j)]) + self.liquidity[j] * (high - self.boundaries[j])
+        return np.where(i == j, inside, across)
+
+    def amount0_between(self, sqrt_low, sqrt_high):
+        ## token0 locked between two sqrt prices, 1 / a - 1 / b as (b - a) / (a * b) for the same reason
+        (low, high) = (self._clip(sqrt_low), self._clip(sqrt_high))
+        (i, j) = (self._segment(low), self._segment(high))
+        inside = self.liquidity[i] * (high - low) / (low * high)
+        bottom = self.boundaries[i + 1]
+        top = self.boundaries[j]
+        across = (
+            self.liquidity[i] * (bottom - low) / (low * bottom)
+            + (self.cum0[j] - self.cum0[np.minimum(i + 1, j)])
+            + self.liquidity[j] * (high - top) / (top * high)
+        )
+        return np.where(i == j, inside, across)
+
+    @property
+    def reserve_in(self):
+        ## token1 in the pool
+        return float(self.amount1_between(self.boundaries[0], self.sqrt_price))
+
+    @property
+    def reserve_out(self):
+        ## token0 in the pool
+        return float(self.amount0_between(self.sqrt_price, self.boundaries[-1]))
+
+    def active_liquidity(self):
+        return float(self.liquidity[self._segment(self.sqrt_price)]) if self.boundaries[0] <= self.sqrt_price < self.boundaries[-1] else 0.0
+
+    def spot_price(self, zero_for_one=False):
+        ## Marginal price of the first unit, in per out, fee included
+        price = self.sqrt_price ** 2
+        return 1 / (price * self.fee) if zero_for_one else price / self.fee
+
+    def _swap_to(self, amount_in, zero_for_one):
+        ## (sqrt price after, whether it stays in the current range, amount_in after the fee)
+        ## Closed form inside the current range, binary search on the prefix sums past it
+        amount_in = np.asarray(amount_in, dtype=np.float64) * self.fee
+        current = float(self._clip(self.sqrt_price))
+        i = int(self._segment(current))
+        liquidity = self.liquidity[i]
+
+        if zero_for_one:
+            room = liquidity * (current - self.boundaries[i]) / (current * self.boundaries[i])
+            with np.errstate(divide='ignore', invalid='ignore'):
+                inside = current * liquidity / (liquidity + amount_in * current)
+            past = self.sqrt_price_at_amount0(self.cum0[i] - (amount_in - room))
+        else:
+            room = liquidity * (self.boundaries[i + 1] - current)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                inside = current + amount_in / liquidity
+            past = self.sqrt_price_at_amount1(self.cum1[i + 1] + (amount_in - room))
+
+        is_inside = amount_in <= room
+        return (np.where(is_inside, inside, past), is_inside, amount_in)
+
+    def sqrt_price_after(self, amount_in, zero_for_one=False):
+        return _scalar(self._swap_to(amount_in, zero_for_one)[0])
+
+    def amount_out_given_in(self, amount_in, zero_for_one=False):
+        """
+          Partial fill if amount_in is more than the liquidity up to the last tick
+          Inside the current range the out amount comes straight from amount_in
+          (L * (1 / a - 1 / b) == amount_in / (a * b)), tiny trades on deep pools don't round to 0
+        """
+        (after, is_inside, amount_in) = self._swap_to(amount_in, zero_for_one)
+        current = float(self._clip(self.sqrt_price))
+        if zero_for_one:
+            out = np.where(is_inside, amount_in * current * after, self.amount1_between(after, current))
+        else:
+            out = np.where(is_inside, amount_in / (current * after), self.amount0_between(current, after))
+        return _scalar(out)
+
+    def price_given_in(self, amount_in, zero_for_one=False):
+        return amount_in / self.amount_out_given_in(amount_in, zero_for_one)
+
+    def max_in_before_price_limit_sqrt(self, price_limit, zero_for_one=False):
+        """
+          Exact max amount_in before the marginal price (in per out, fee included) reaches price_limit
+          Capped at the liquidity up to the last tick, negative when already past price_limit
+        """
+        price_limit = np.asarray(price_limit, dtype=np.float64)
+        if zero_for_one:
+            limit = np.sqrt(1 / (price_limit * self.fee))
+            amount = np.where(
+                limit <= self.sqrt_price,
+                self.amount0_between(np.minimum(limit, self.sqrt_price), self.sqrt_price),
+                -self.amount0_between(self.sqrt_price, np.maximum(limit, self.sqrt_price))
+            )
+            return _scalar(amount / self.fee)
+
+        limit = np.sqrt(price_limit * self.fee)
+        amount = np.where(
+            limit >= self.sqrt_price,
+            self.amount1_between(self.sqrt_price, np.maximum(limit, self.sqrt_price)),
+            -self.amount1_between(np.minimum(limit, self.sqrt_price), self.sqrt_price)
+        )
+        return _scalar(amount / self.fee)
+
+    def max_in_before_price_limit(self, price_limit, zero_for_one=False):
+        ## Linear approximation on the virtual reserves of the active range, like the constant product one
+        liquidity = self.active_liquidity()
+        (virtual_1, virtual_0) = (liquidity * self.sqrt_price, liquidity / self.sqrt_price)
+        if zero_for_one:
+            return constant_product.max_in_before_price_limit(price_limit, virtual_0, virtual_1, self.fee)
+        return constant_product.max_in_before_price_limit(price_limit, virtual_1, virtual_0, self.fee)
+
+    def swap(self, amount_in, zero_for_one=False):
+        amount_out = self.amount_out_given_in(amount_in, zero_for_one)
+        self.sqrt_price = float(self.sqrt_price_after(amount_in, zero_for_one))
+        return amount_out
@@ -0,0 +1,88 @@
+import numpy as np
+
+"""
+  Constant product (UniV2 like) AMM math, shared by the amm_price_impact / liquidation scripts
+
+  Every function takes scalars or NumPy arrays and broadcasts like a ufunc
+  e.g. amount_out_given_in(np.linspace(1, 100, 1_000), x, y) sizes 1k trades in one call
+  Scalars in -> scalars out (np.float64 for the sqrt ones, which is a float)
+
+  fee is what's left of amount_in after the fee, 1 -> no fee, UNIV2_FEE -> 0.3%
+  Same convention as lib/arbitrage.py, only fee * amount_in moves the curve:
+    amount_out = reserve_out * fee * amount_in / (reserve_in + fee * amount_in)
+  With fee=1 (the default) every result is bit for bit the no fee formula the scripts used
+"""
+
+NO_FEE = 1
+UNIV2_FEE = 997 / 1000
+
+
+def amount_out_given_in(amount_in, reserve_in, reserve_out, fee=NO_FEE):
+    amount_in = amount_in * fee
+    amount_out = reserve_out * amount_in / (reserve_in + amount_in)
+    return amount_out
+
+
+def price_given_in(amount_in, reserve_in, reserve_out, fee=NO_FEE):
+    ## Average price paid, reserve_in per reserve_out, fee included
+    out = amount_out_given_in(amount_in, reserve_in, reserve_out, fee)
+    return amount_in / out
+
+
+"""
+  Derived by the above
+"""
+def amount_in_give_out(amount_out, reserve_in, reserve_out, fee=NO_FEE):
+    amount_in = reserve_in * amount_out / (reserve_out - amount_out)
+    return amount_in / fee
+
+
+def max_in_before_price_limit(price_limit, reserve_in, reserve_out, fee=NO_FEE):
+    ## Linear approximation: (reserve_in + amount_in) / reserve_out <= price_limit
+    return (reserve_out * price_limit * fee - reserve_in) / fee
+
+
+def max_in_before_price_limit_sqrt(price_limit, reserve_in, reserve_out, fee=NO_FEE):
+    """
+      Max amount_in before the marginal price (reserve_in per reserve_out, fee included) reaches price_limit
+      marginal(amount_in) = (reserve_in + fee * amount_in) ** 2 / (fee * reserve_in * reserve_out)
+      Negative when the pool is already past price_limit
+    """
+    return (np.sqrt(reserve_out * reserve_in * price_limit * fee) - reserve_in) / fee
+
+
+def spot_price(reserve_in, reserve_out, fee=NO_FEE):
+    ## Marginal price of the first unit, reserve_in per reserve_out
+    return reserve_in / (reserve_out * fee)
+
+
+class ConstantProductPool():
+    """
+      The functions above bound to one pool's reserves, same interface as concentrated.ConcentratedPool
+      So a sim can take either pool type, only pays in reserve_in
+    """
+    def __init__(self, reserve_in, reserve_out, fee=NO_FEE):
+        self.reserve_in = reserve_in
+        self.reserve_out = reserve_out
+        self.fee = fee
+
+    def spot_price(self):
+        return spot_price(self.reserve_in, self.reserve_out, self.fee)
+
+    def amount_out_given_in(self, amount_in):
+        return amount_out_given_in(amount_in, self.reserve_in, self.reserve_out, self.fee)
+
+    def price_given_in(self, amount_in):
+        return price_given_in(amount_in, self.reserve_in, self.reserve_out, self.fee)
+
+    def max_in_before_price_limit(self, price_limit):
+        return max_in_before_price_limit(price_limit, self.reserve_in, self.reserve_out, self.fee)
+
+    def max_in_before_price_limit_sqrt(self, price_limit):
+        return max_in_before_price_limit_sqrt(price_limit, self.reserve_in, self.reserve_out, self.fee)
+
+    def swap(self, amount_in):
+        amount_out = self.amount_out_given_in(amount_in)
+        self.reserve_in += amount_in
+        self.reserve_out -= amount_out
+        return amount_out
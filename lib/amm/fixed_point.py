@@ -0,0 +1,208 @@
+import math
+from decimal import Decimal
+
+import numpy as np
+
+"""
+  Integer fixed point backend, rounds like the contracts do
+
+  Same functions as lib/amm/constant_product.py, but on integer token units (wei / satoshi)
+  - Every division floors (Solidity uint division), amount_in_give_out adds 1 like UniV2's getAmountIn
+  - Prices / ratios are WAD scaled (1e18 = 1), in raw units: reserve_in wei per reserve_out unit
+  - fee is fee_numerator / FEE_DENOMINATOR (997 for UniV2), defaults to no fee
+
+  Scalars are Python ints (arbitrary precision, no overflow)
+  Arrays run as int64 when every intermediate product fits, else as object arrays of Python ints
+  Object arrays are still vectorized NumPy calls, far cheaper than Decimal everywhere
+
+  Float inputs are rejected, convert with to_units first so nothing rounds silently
+
+  Usage:
+    amm = lib.amm.backend(exact=True)
+    amount_out = amm.amount_out_given_in(to_units(1, ETH_DECIMALS), reserve_eth, reserve_btc)
+"""
+
+WAD = 10 ** 18  ## DECIMAL_PRECISION in the contracts
+MAX_BPS = 10_000
+
+ETH_DECIMALS = 18
+BTC_DECIMALS = 8
+
+FEE_DENOMINATOR = 1_000
+UNIV2_FEE_NUMERATOR = 997
+NO_FEE = FEE_DENOMINATOR
+
+## LiquityMath._computeCR returns this when there is no debt
+MAX_UINT256 = 2 ** 256 - 1
+
+## int64 math below this, leaves room to add / subtract a few results without overflowing
+INT64_SAFE = np.iinfo(np.int64).max // 4
+
+
+def to_units(amount, decimals):
+    ## Human amount -> integer units, floored, via Decimal(str()) so 0.1 ETH is exactly 10 ** 17 wei
+    scale = 10 ** decimals
+    if isinstance(amount, np.ndarray):
+        return np.array([int(Decimal(str(value)) * scale) for value in amount.tolist()], dtype=object)
+    return int(Decimal(str(amount)) * scale)
+
+
+def from_units(amount, decimals):
+    ## Integer units -> float, for logging / plots only
+    if isinstance(amount, np.ndarray):
+        return amount.astype(np.float64) / 10 ** decimals
+    return amount / 10 ** decimals
+
+
+def rescale(amount, from_decimals, to_decimals):
+    ## e.g. satoshi -> 18 decimals, floors when going down
+    if to_decimals >= from_decimals:
+        return amount * 10 ** (to_decimals - from_decimals)
+    return amount // 10 ** (from_decimals - to_decimals)
+
+
+def _is_int(value):
+    return isinstance(value, (int, np.integer)) and not isinstance(value, bool)
+
+
+def _as_int(value):
+    ## Python int, or an integer / object array
+    if isinstance(value, np.ndarray):
+        assert value.dtype == object or np.issubdtype(value.dtype, np.integer), f"{value.dtype} is not an integer array"
+        return value
+    if isinstance(value, (list, tuple)):
+        return np.array([int(v) for v in value], dtype=object)
+    assert _is_int(value), f"{value!r} is not an integer, use to_units"
+    return int(value)
+
+
+def _max_abs(value):
+    if isinstance(value, np.ndarray):
+        if value.size == 0:
+            return 0
+        return max(abs(int(value.max())), abs(int(value.min())))
+    return abs(value)
+
+
+def _align(*values, bound=None):
+    """
+      Arrays as int64 if bound (default: the largest value) leaves room for a few adds, else as object arrays
+      Scalars are left as Python ints, they mix with both
+    """
+    values = [_as_int(value) for value in values]
+    arrays = [value for value in values if isinstance(value, np.ndarray)]
+    if len(arrays) == 0:
+        return values
+
+    if bound is None:
+        bound = max(_max_abs(value) for value in values)
+    fits = all(array.dtype != object for array in arrays) and bound <= INT64_SAFE
+    dtype = np.int64 if fits else object
+    return [value.astype(dtype) if isinstance(value, np.ndarray) else value for value in values]
+
+
+def mul(a, b):
+    (a, b) = (_as_int(a), _as_int(b))
+    (bound_a, bound_b) = (_max_abs(a), _max_abs(b))
+    (a, b) = _align(a, b, bound=max(bound_a * bound_b, bound_a, bound_b))
+    return a * b
+
+
+def mul_div(a, b, denominator, round_up=False):
+    ## floor(a * b / denominator), or ceil, a * b never overflows (FullMath.mulDiv)
+    (product, denominator) = _align(mul(a, b), denominator)
+    if round_up:
+        return -(-product // denominator)
+    return product // denominator
+
+
+def isqrt(value):
+    ## floor(sqrt(value)), Babylonian sqrt in the contracts
+    if isinstance(value, np.ndarray):
+        return np.frompyfunc(math.isqrt, 1, 1)(value.astype(object))
+    return math.isqrt(value)
+
+
+def amount_out_given_in(amount_in, reserve_in, reserve_out, fee_numerator=NO_FEE):
+    ## UniswapV2Library.getAmountOut
+    amount_in_with_fee = mul(amount_in, fee_numerator)
+    numerator = mul(amount_in_with_fee, reserve_out)
+    (denominator, amount_in_with_fee) = _align(mul(reserve_in, FEE_DENOMINATOR), amount_in_with_fee)
+    (numerator, denominator) = _align(numerator, denominator + amount_in_with_fee)
+    return numerator // denominator
+
+
+def price_given_in(amount_in, reserve_in, reserve_out, fee_numerator=NO_FEE):
+    ## Average price paid, WAD scaled reserve_in per reserve_out
+    out = amount_out_given_in(amount_in, reserve_in, reserve_out, fee_numerator)
+    return mul_div(amount_in, WAD, out)
+
+
+"""
+  Derived by the above
+"""
+def amount_in_give_out(amount_out, reserve_in, reserve_out, fee_numerator=NO_FEE):
+    ## UniswapV2Library.getAmountIn, rounds up by adding 1
+    numerator = mul(reserve_in, mul(amount_out, FEE_DENOMINATOR))
+    (reserve_out, amount_out) = _align(reserve_out, amount_out)
+    denominator = mul(reserve_out - amount_out, fee_numerator)
+    (numerator, denominator) = _align(numerator, denominator)
+    return numerator // denominator + 1
+
+
+def max_in_before_price_limit(price_limit, reserve_in, reserve_out, fee_numerator=NO_FEE):
+    ## Linear approximation, price_limit is WAD scaled
+    limit_in = mul_div(reserve_out, mul(price_limit, fee_numerator), WAD * FEE_DENOMINATOR)
+    (limit_in, reserve_in) = _align(limit_in, reserve_in)
+    return mul_div(limit_in - reserve_in, FEE_DENOMINATOR, fee_numerator)
+
+
+def max_in_before_price_limit_sqrt(price_limit, reserve_in, reserve_out, fee_numerator=NO_FEE):
+    ## Max amount_in before the marginal price reaches price_limit (WAD scaled), negative when already past it
+    k = mul(reserve_out, reserve_in)
+    root = isqrt(mul_div(k, mul(price_limit, fee_numerator), WAD * FEE_DENOMINATOR))
+    (root, reserve_in) = _align(root, reserve_in)
+    return mul_div(root - reserve_in, FEE_DENOMINATOR, fee_numerator)
+
+
+def spot_price(reserve_in, reserve_out, fee_numerator=NO_FEE):
+    ## Marginal price of the first unit, WAD scaled
+    return mul_div(reserve_in, WAD * FEE_DENOMINATOR, mul(reserve_out, fee_numerator))
+
+
+"""
+  CR math, prices are WAD scaled debt units per collateral unit
+"""
+def calculate_max_debt(collateral, price, max_ltv):
+    ## Collateral value first, then the LTV, both floored like the contracts
+    value = mul_div(collateral, price, WAD)
+    return mul_div(value, max_ltv, MAX_BPS)
+
+
+def calculate_is_solvent(debt, collateral, price, max_ltv):
+    (max_debt, debt) = _align(calculate_max_debt(collateral, price, max_ltv), debt)
+    return max_debt > debt
+
+
+def compute_cr(collateral, debt, price):
+    ## LiquityMath._computeCR, WAD scaled (1.1e18 -> 110%), MAX_UINT256 without debt
+    debt = _as_int(debt)
+    if isinstance(debt, np.ndarray):
+        has_debt = debt > 0
+        cr = mul_div(collateral, price, np.where(has_debt, debt, 1).astype(debt.dtype))
+        return np.where(has_debt, cr.astype(object), MAX_UINT256)
+    if debt == 0:
+        return MAX_UINT256
+    return mul_div(collateral, price, debt)
+
+
+def calculate_collateral_ratio(collateral, price, debt):
+    ## Same as fee_sim (debt / collateral value), WAD scaled, 0 without collateral
+    value = mul_div(collateral, price, WAD)
+    if isinstance(value, np.ndarray):
+        has_value = value > 0
+        ratio = mul_div(debt, WAD, np.where(has_value, value, 1).astype(value.dtype))
+        return np.where(has_value, ratio, 0)
+    if value == 0:
+        return 0
+    return mul_div(debt, WAD, value)
@@ -0,0 +1,62 @@
+import numpy as np
+
+from lib.amm import UNIV2_FEE
+
+"""
+  Closed form arbitrage against a constant product pool
+
+  Pool holds reserve_x / reserve_y, the oracle says 1 x is worth `price` y
+  fee is what's left of amount_in after the fee (997 / 1000 for UniV2)
+
+  Buy x (pay dy):  profit(dy) = price * fee * dy * x / (y + fee * dy) - dy
+    profit'(dy) = 0 -> y + fee * dy = sqrt(price * fee * x * y)
+    dy = (sqrt(price * fee * x * y) - y) / fee, only if y / x < price * fee
+
+  Sell x (pay dx): profit(dx) = fee * dx * y / (x + fee * dx) - price * dx
+    profit'(dx) = 0 -> x + fee * dx = sqrt(fee * x * y / price)
+    dx = (sqrt(fee * x * y / price) - x) / fee, only if y / x > price / fee
+
+  Everything broadcasts, pass arrays of reserves / prices to size many pools or paths at once
+  Profit is in y
+"""
+
+
+def optimal_buy_x(reserve_x, reserve_y, price, fee=UNIV2_FEE):
+    ## Amount of y to pay in, 0 if buying x doesn't pay
+    amount_in = (np.sqrt(price * fee * reserve_x * reserve_y) - reserve_y) / fee
+    return np.maximum(amount_in, 0)
+
+
+def optimal_sell_x(reserve_x, reserve_y, price, fee=UNIV2_FEE):
+    ## Amount of x to pay in, 0 if selling x doesn't pay
+    amount_in = (np.sqrt(fee * reserve_x * reserve_y / price) - reserve_x) / fee
+    return np.maximum(amount_in, 0)
+
+
+def buy_x_profit(amount_in, reserve_x, reserve_y, price, fee=UNIV2_FEE):
+    amount_out = fee * amount_in * reserve_x / (reserve_y + fee * amount_in)
+    return price * amount_out - amount_in
+
+
+def sell_x_profit(amount_in, reserve_x, reserve_y, price, fee=UNIV2_FEE):
+    amount_out = fee * amount_in * reserve_y / (reserve_x + fee * amount_in)
+    return amount_out - price * amount_in
+
+
+def optimal_arbitrage(reserve_x, reserve_y, price, fee=UNIV2_FEE):
+    """
+      Best trade in either direction
+      Returns (is_x, amount_in, profit), is_x -> sell x into the pool, else buy x with y
+      At most one side is ever > 0, amount_in == 0 means the pool is within the fee of the price
+    """
+    buy = optimal_buy_x(reserve_x, reserve_y, price, fee)
+    sell = optimal_sell_x(reserve_x, reserve_y, price, fee)
+
+    is_x = sell > 0
+    amount_in = np.where(is_x, sell, buy)
+    profit = np.where(
+        is_x,
+        sell_x_profit(sell, reserve_x, reserve_y, price, fee),
+        buy_x_profit(buy, reserve_x, reserve_y, price, fee)
+    )
+    return (is_x, amount_in, profit)
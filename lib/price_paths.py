@@ -0,0 +1,169 @@
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+from lib.rng import make_rng
+
+"""
+  Price paths for the sims
+
+  Every generator returns the whole path as a NumPy array, no RNG call per turn
+  - steps prices, shape (steps,), or (paths, steps) if paths is set
+  - path[t] is the price after turn t, the start price is not included
+  - rng is a seed or a Generator (see lib/rng.py), same seed -> same path
+
+  Generators:
+  - swing_path -> fee_sim's flat +- random() * max_swing coin flip
+  - gbm -> Geometric Brownian Motion
+  - jump_diffusion -> GBM + Poisson jumps (Merton)
+  - regime_switching -> GBM whose drift / vol follow a Markov chain of regimes
+  - block_bootstrap -> Blocks of historical log returns (see load_prices)
+
+  mu / sigma are per step, use per_step() to convert from annual
+
+  Consumers:
+    fee_sim.main(price_path=gbm(MAX_STEPS, INITIAL_PRICE, 0, 0.01, rng=1))
+    fee_sim_batch.run_batch(seeds, price_paths=gbm(MAX_STEPS, INITIAL_PRICE, 0, 0.01, paths=len(seeds)))
+    cdp_sim.Scheduler.schedule_price_path(path, interval)
+    for price in iterate(path): system.set_feed(price)
+"""
+
+SECONDS_PER_YEAR = 365 * 24 * 60 * 60
+
+
+def per_step(annual_mu, annual_sigma, step_seconds):
+    ## Annual drift / vol to per step
+    dt = step_seconds / SECONDS_PER_YEAR
+    return (annual_mu * dt, annual_sigma * np.sqrt(dt))
+
+
+def shape_of(steps, paths):
+    return (steps,) if paths is None else (paths, steps)
+
+
+def from_log_returns(start, log_returns):
+    return start * np.exp(np.cumsum(log_returns, axis=-1))
+
+
+def iterate(path):
+    ## Python floats, cheaper than indexing the array every turn
+    return iter(np.asarray(path).tolist())
+
+
+def swing_path(steps, start, max_swing, paths=None, rng=None):
+    ## Same model as fee_sim: 50 / 50 up or down by random() * max_swing, absolute
+    rng = make_rng(rng)
+    shape = shape_of(steps, paths)
+    goes_down = (rng.random(shape) * 100).astype(np.int64) % 2 == 0
+    swing = rng.random(shape) * max_swing
+    return start + np.cumsum(np.where(goes_down, -swing, swing), axis=-1)
+
+
+def gbm(steps, start, mu, sigma, paths=None, rng=None):
+    rng = make_rng(rng)
+    shocks = rng.standard_normal(shape_of(steps, paths))
+    return from_log_returns(start, (mu - sigma ** 2 / 2) + sigma * shocks)
+
+
+def jump_diffusion(steps, start, mu, sigma, jump_rate, jump_mean, jump_std, paths=None, rng=None):
+    """
+      jump_rate -> expected jumps per step
+      jump_mean / jump_std -> of the log size of each jump, e.g. jump_mean=-0.2 for 20% crashes
+    """
+    rng = make_rng(rng)
+    shape = shape_of(steps, paths)
+    shocks = rng.standard_normal(shape)
+    jumps = rng.poisson(jump_rate, shape)
+
+    ## Sum of n normal jumps is normal(n * mean, sqrt(n) * std)
+    jump_sizes = jumps * jump_mean + np.sqrt(jumps) * jump_std * rng.standard_normal(shape)
+    return from_log_returns(start, (mu - sigma ** 2 / 2) + sigma * shocks + jump_sizes)
+
+
+def regime_switching(steps, start, mus, sigmas, transition, initial_regime=0, paths=None, rng=None):
+    """
+      transition[i][j] -> probability of going from regime i to regime j in one step, rows sum to 1
+      e.g. calm / crash: mus=[0, -0.001], sigmas=[0.005, 0.03], transition=[[0.999, 0.001], [0.01, 0.99]]
+      NOTE: The regime chain is one vectorized op per step (across paths), the returns are fully vectorized
+    """
+    rng = make_rng(rng)
+    mus = np.asarray(mus, dtype=np.float64)
+    sigmas = np.asarray(sigmas, dtype=np.float64)
+    cumulative = np.cumsum(np.asarray(transition, dtype=np.float64), axis=1)
+
+    shape = shape_of(steps, paths)
+    uniforms = rng.random(shape)
+    regimes = np.empty(shape, dtype=np.int64)
+    regime = np.full(shape[:-1], initial_regime, dtype=np.int64)
+    for step in range(steps):
+        ## First j where cumulative[regime, j] > u
+        regime = (uniforms[..., step, None] >= cumulative[regime]).sum(axis=-1)
+        regimes[..., step] = regime
+
+    shocks = rng.standard_normal(shape)
+    sigma = sigmas[regimes]
+    return from_log_returns(start, (mus[regimes] - sigma ** 2 / 2) + sigma * shocks)
+
+
+def load_prices(path, column="close"):
+    ## Historical prices from a local CSV, oldest first
+    return pd.read_csv(path, usecols=[column])[column].to_numpy(dtype=np.float64)
+
+
+def block_bootstrap(prices, steps, block_size, start=None, paths=None, rng=None):
+    """
+      Resample blocks of block_size consecutive log returns from historical prices
+      Keeps the short term autocorrelation / vol clustering of the data, unlike iid returns
+      prices -> array or a CSV path (see load_prices), start defaults to the first price
+    """
+    rng = make_rng(rng)
+    if isinstance(prices, str):
+        prices = load_prices(prices)
+
+    log_returns = np.diff(np.log(prices))
+    assert len(log_returns) >= block_size
+
+    shape = shape_of(steps, paths)
+    blocks = -(-steps // block_size)
+    block_starts = rng.integers(0, len(log_returns) - block_size + 1, size=shape[:-1] + (blocks,))
+
+    ## Index of every return we take, (..., blocks, block_size) -> (..., steps)
+    indexes = (block_starts[..., None] + np.arange(block_size)).reshape(shape[:-1] + (blocks * block_size,))
+    sampled = log_returns[indexes[..., :steps]]
+    return from_log_returns(prices[0] if start is None else start, sampled)
+
+
+def cache_key(name, params):
+    ## Arrays by dtype, shape and bytes, their repr elides the middle so two arrays could share a key
+    digest = hashlib.sha1(name.encode())
+    for (param, value) in sorted(params.items()):
+        digest.update(param.encode())
+        if isinstance(value, np.ndarray):
+            value = np.ascontiguousarray(value)
+            digest.update(f'{value.dtype}{value.shape}'.encode())
+            digest.update(value.tobytes())
+        else:
+            digest.update(repr(value).encode())
+    return digest.hexdigest()[:16]
+
+
+def cached(generator, cache_dir='logs/price_paths/', **params):
+    """
+      Generate once, load from disk after
+      Only for int seeds (rng=123), None or a Generator would give a different path for the same key
+      The key is the generator name and params, see cache_key
+    """
+    rng = params.get("rng")
+    assert isinstance(rng, (int, np.integer)) and not isinstance(rng, bool), f"cached needs an int seed, got rng={rng!r}"
+
+    key = cache_key(generator.__name__, params)
+    filename = f'{cache_dir}{generator.__name__}_{key}.npy'
+    if os.path.exists(filename):
+        return np.load(filename, mmap_mode='r')
+
+    path = generator(**params)
+    os.makedirs(cache_dir, exist_ok=True)
+    np.save(filename, path)
+    return path
@@ -0,0 +1,66 @@
+import random
+
+import numpy as np
+
+"""
+  Randomness for the sims
+
+  Every sim takes a seed or an explicit generator instead of calling the global `random`
+  - NumPy sims use np.random.Generator (make_rng)
+  - Object / agent sims use random.Random (make_random)
+
+  Both accept:
+  - None -> fresh entropy, not reproducible
+  - int -> same int, same run
+  - np.random.SeedSequence -> from spawn_seeds, for independent streams per worker / path
+  - An existing generator -> returned as is, so callers can share one stream
+
+  Sharding:
+      seeds = spawn_seeds(SEED, workers)  ## one independent stream per worker
+      path_seed(SEED, i) == seeds[i]  ## rebuild any one of them later, with the same sim parameters it replays that path bit for bit
+"""
+
+
+def make_rng(seed=None):
+    if isinstance(seed, np.random.Generator):
+        return seed
+
+    return np.random.default_rng(seed)
+
+
+def make_random(seed=None):
+    if isinstance(seed, random.Random):
+        return seed
+
+    if isinstance(seed, np.random.SeedSequence):
+        ## random.Random takes an int, use 128 bits of the sequence
+        state = seed.generate_state(4, np.uint32)
+        seed = int.from_bytes(state.tobytes(), "little")
+
+    return random.Random(seed)
+
+
+def spawn_seeds(seed, n):
+    """
+      n independent child seeds, child i depends only on (seed, i)
+    """
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+
+    return seed.spawn(n)
+
+
+def path_seed(seed, *indexes):
+    """
+      Rebuild a spawned child without spawning its siblings
+      path_seed(seed, i, j) == spawn_seeds(spawn_seeds(seed, n)[i], m)[j]
+    """
+    return np.random.SeedSequence(seed, spawn_key=indexes)
+
+
+def spawn_rngs(seed, n):
+    return [make_rng(child) for child in spawn_seeds(seed, n)]
+
+
+def spawn_randoms(seed, n):
+    return [make_random(child) for child in spawn_seeds(seed, n)]
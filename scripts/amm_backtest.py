@@ -0,0 +1,196 @@
+import argparse
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+
+try:
+  import pyarrow.parquet as pq
+except ImportError:
+  pq = None
+
+from lib.amm import amount_out_given_in, max_in_before_price_limit_sqrt
+from scripts.amm_price_impact_crv_math import MAX_BPS, MIN_PROFIT, MAX_PROFIT
+
+"""
+  Historical backtest of amm_price_impact_crv_math
+
+  Replays a block by block price / liquidity series instead of the hardcoded price_ratio and CRV_BASE
+  One file per asset, one row per block, oldest first:
+  - block
+  - price -> Oracle price, reserve_in per 1 reserve_out (e.g. USDC per CRV)
+  - reserve_in -> Pool side the liquidator pays in (USDC)
+  - reserve_out -> Pool side the liquidator buys to repay the debt (CRV)
+  - at_risk_debt (optional) -> Outstanding debt at risk that block, in reserve_out units
+    Without the column the at_risk_debt param is used for every block
+
+  Capacity is how much reserve_out a liquidator can buy before the pool's marginal price
+  goes past oracle price + premium, worst case (MIN_PROFIT) and best case (MAX_PROFIT)
+
+  Files are read in chunks of chunk_rows and never fully loaded:
+  - .parquet -> memory-mapped, one batch per chunk (needs pyarrow)
+  - .npy -> Structured array, memory-mapped with mmap_mode='r'
+  - .csv -> memory-mapped while parsing, pd.read_csv(chunksize=...)
+
+  Per block results are appended to logs/backtests/{now}/{asset}.csv as each chunk is done
+  The per asset summary is saved next to them as summary.csv
+
+  Usage:
+    brownie run amm_backtest  ## Every file in data/backtests/
+    python -m scripts.amm_backtest data/crv.parquet data/eth.csv --at-risk-debt 54838710
+"""
+
+DATA_DIR = 'data/backtests/'
+EXTENSIONS = [".parquet", ".npy", ".csv"]
+
+COLUMNS = ["block", "price", "reserve_in", "reserve_out"]
+AT_RISK_COLUMN = "at_risk_debt"
+
+CHUNK_ROWS = 1_000_000
+
+
+def read_chunks(path, chunk_rows=CHUNK_ROWS):
+  ## Yields DataFrames of at most chunk_rows rows, with COLUMNS and at_risk_debt if the file has it
+  wanted = COLUMNS + [AT_RISK_COLUMN]
+
+  if path.endswith(".parquet"):
+    if pq is None:
+      raise ImportError("Parquet backtests need pyarrow, convert to csv / npy or pip install pyarrow")
+    file = pq.ParquetFile(path, memory_map=True)
+    columns = [name for name in wanted if name in file.schema_arrow.names]
+    for batch in file.iter_batches(batch_size=chunk_rows, columns=columns):
+      yield batch.to_pandas()
+
+  elif path.endswith(".npy"):
+    data = np.load(path, mmap_mode='r')
+    columns = [name for name in wanted if name in data.dtype.names]
+    for start in range(0, len(data), chunk_rows):
+      chunk = data[start:start + chunk_rows]
+      yield pd.DataFrame({name: np.asarray(chunk[name]) for name in columns})
+
+  else:
+    for chunk in pd.read_csv(path, chunksize=chunk_rows, memory_map=True, usecols=lambda name: name in wanted):
+      yield chunk
+
+
+def capacity(price, reserve_in, reserve_out, premium):
+  ## Max reserve_out a liquidator can buy while the marginal price stays under price + premium
+  max_price = price * (MAX_BPS + premium) / MAX_BPS
+
+  ## Negative when the pool is already past the limit, nothing can be liquidated at a profit
+  max_in = np.maximum(max_in_before_price_limit_sqrt(max_price, reserve_in, reserve_out), 0)
+  return amount_out_given_in(max_in, reserve_in, reserve_out)
+
+
+def backtest_chunk(chunk, at_risk_debt=None):
+  price = chunk["price"].to_numpy(dtype=np.float64)
+  reserve_in = chunk["reserve_in"].to_numpy(dtype=np.float64)
+  reserve_out = chunk["reserve_out"].to_numpy(dtype=np.float64)
+
+  if AT_RISK_COLUMN in chunk:
+    debt = chunk[AT_RISK_COLUMN].to_numpy(dtype=np.float64)
+  else:
+    assert at_risk_debt is not None, f"No {AT_RISK_COLUMN} column, pass at_risk_debt"
+    debt = np.full(len(chunk), at_risk_debt, dtype=np.float64)
+
+  worst = capacity(price, reserve_in, reserve_out, MIN_PROFIT)
+  best = capacity(price, reserve_in, reserve_out, MAX_PROFIT)
+
+  ## inf when nothing is at risk
+  with np.errstate(divide='ignore', invalid='ignore'):
+    coverage = np.where(debt > 0, worst / debt, np.inf)
+
+  return pd.DataFrame({
+    "block": chunk["block"].to_numpy(),
+    "price": price,
+    "spot_price": reserve_in / reserve_out,
+    "capacity_worst": worst,
+    "capacity_best": best,
+    AT_RISK_COLUMN: debt,
+    "coverage_worst": coverage,
+    "shortfall_worst": np.maximum(debt - worst, 0),
+    "shortfall_best": np.maximum(debt - best, 0),
+  })
+
+
+def asset_name(path):
+  return os.path.splitext(os.path.basename(path))[0]
+
+
+def backtest(path, out_path=None, at_risk_debt=None, chunk_rows=CHUNK_ROWS):
+  """
+    Replay one asset's file, appends per block results to out_path if given
+    Returns the summary dict, aggregated chunk by chunk
+  """
+  summary = {
+    "asset": asset_name(path),
+    "blocks": 0,
+    "blocks_short_worst": 0,
+    "blocks_short_best": 0,
+    "min_coverage_worst": np.inf,
+    "worst_block": None,
+    "max_shortfall_worst": 0.0,
+    "min_capacity_worst": np.inf,
+  }
+
+  for chunk in read_chunks(path, chunk_rows):
+    result = backtest_chunk(chunk, at_risk_debt)
+    if len(result) == 0:
+      continue
+
+    if out_path is not None:
+      result.to_csv(out_path, mode='a', header=(summary["blocks"] == 0), index=False)
+
+    summary["blocks"] += len(result)
+    summary["blocks_short_worst"] += int((result["shortfall_worst"] > 0).sum())
+    summary["blocks_short_best"] += int((result["shortfall_best"] > 0).sum())
+    summary["max_shortfall_worst"] = max(summary["max_shortfall_worst"], float(result["shortfall_worst"].max()))
+    summary["min_capacity_worst"] = min(summary["min_capacity_worst"], float(result["capacity_worst"].min()))
+
+    i = int(result["coverage_worst"].to_numpy().argmin())
+    if result["coverage_worst"].iat[i] < summary["min_coverage_worst"]:
+      summary["min_coverage_worst"] = float(result["coverage_worst"].iat[i])
+      summary["worst_block"] = result["block"].iat[i]
+
+  return summary
+
+
+def find_files(data_dir=DATA_DIR):
+  return sorted(path for path in glob.glob(f'{data_dir}*') if os.path.splitext(path)[1] in EXTENSIONS)
+
+
+def main(paths=None, at_risk_debt=None, chunk_rows=CHUNK_ROWS):
+  if paths is None:
+    paths = find_files()
+
+  if len(paths) == 0:
+    print("No price series found in", DATA_DIR, "pass paths or add", EXTENSIONS, "files with columns", COLUMNS)
+    return None
+
+  out_dir = f'logs/backtests/{pd.Timestamp.now()}/'
+  os.makedirs(out_dir, exist_ok=True)
+
+  print("Given premium BPS between", MIN_PROFIT, MAX_PROFIT)
+
+  summaries = []
+  for path in paths:
+    out_path = f'{out_dir}{asset_name(path)}.csv'
+    summary = backtest(path, out_path, at_risk_debt, chunk_rows)
+    print(summary["asset"], summary["blocks"], "blocks", summary["blocks_short_worst"], "short in the worst case, saved to", out_path)
+    summaries.append(summary)
+
+  df = pd.DataFrame(summaries)
+  df.to_csv(f'{out_dir}summary.csv', index=False)
+  print(df)
+  return df
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Replay historical price / reserves through the liquidation capacity math")
+  parser.add_argument("paths", nargs="*", help=f"One file per asset, defaults to every file in {DATA_DIR}")
+  parser.add_argument("--at-risk-debt", type=float, default=None, help=f"For files without an {AT_RISK_COLUMN} column")
+  parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+  args = parser.parse_args()
+
+  main(args.paths or None, args.at_risk_debt, args.chunk_rows)
@@ -0,0 +1,126 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from lib.amm import (
+    UNIV2_FEE,
+    amount_out_given_in,
+    price_given_in,
+    amount_in_give_out,
+    max_in_before_price_limit,
+    max_in_before_price_limit_sqrt,
+)
+from lib.rng import make_rng
+
+"""
+  Throughput of lib/amm, a Python loop of scalar calls vs one call on arrays
+
+  Every function is checked first: the array result must match the scalar loop element for element
+  within CHECK_RTOL, with and without the fee (see tests/test_amm_math_benchmark.py)
+  Then both are timed, the loop on LOOP_SIZE inputs, arrays on ARRAY_SIZE, reported as calls per second
+
+  Usage:
+    brownie run amm_math_benchmark
+    python -m scripts.amm_math_benchmark --array-size 10000000
+"""
+
+SEED = 123
+LOOP_SIZE = 100_000
+ARRAY_SIZE = 1_000_000
+REPEATS = 3
+
+## Same IEEE ops either way, the tolerance only absorbs a different but equivalent op order
+CHECK_RTOL = 1e-12
+
+
+def random_inputs(n, rng):
+    reserve_in = rng.uniform(1e3, 1e7, n)
+    reserve_out = reserve_in / rng.uniform(5, 20, n)
+    return {
+        "amount": reserve_out * rng.uniform(0, 0.5, n),
+        "price_limit": reserve_in / reserve_out * rng.uniform(1, 1.5, n),
+        "reserve_in": reserve_in,
+        "reserve_out": reserve_out,
+    }
+
+
+## (name, function, first argument)
+CASES = [
+    ("amount_out_given_in", amount_out_given_in, "amount"),
+    ("price_given_in", price_given_in, "amount"),
+    ("amount_in_give_out", amount_in_give_out, "amount"),
+    ("max_in_before_price_limit", max_in_before_price_limit, "price_limit"),
+    ("max_in_before_price_limit_sqrt", max_in_before_price_limit_sqrt, "price_limit"),
+]
+
+
+def run_loop(fn, first, reserve_in, reserve_out, fee):
+    return [fn(a, x, y, fee) for (a, x, y) in zip(first.tolist(), reserve_in.tolist(), reserve_out.tolist())]
+
+
+def best_time(fn, *args):
+    ## Min of REPEATS, the least noisy estimate
+    times = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        fn(*args)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def check_case(fn, first, fee, loop_size=1_000, seed=SEED, rtol=CHECK_RTOL):
+    ## Scalar and array paths of one function must agree, raises AssertionError otherwise
+    inputs = random_inputs(loop_size, make_rng(seed))
+    looped = np.array(run_loop(fn, inputs[first], inputs["reserve_in"], inputs["reserve_out"], fee), dtype=np.float64)
+    vectorized = fn(inputs[first], inputs["reserve_in"], inputs["reserve_out"], fee)
+    np.testing.assert_allclose(vectorized, looped, rtol=rtol, atol=0, err_msg=f"{fn.__name__} fee={fee}")
+
+
+def check(loop_size=1_000, seed=SEED):
+    for (_, fn, first) in CASES:
+        for fee in [1, UNIV2_FEE]:
+            check_case(fn, first, fee, loop_size, seed)
+
+
+def benchmark(loop_size=LOOP_SIZE, array_size=ARRAY_SIZE, fee=UNIV2_FEE, seed=SEED):
+    rng = make_rng(seed)
+    small = random_inputs(loop_size, rng)
+    large = random_inputs(array_size, rng)
+
+    rows = []
+    for (name, fn, first) in CASES:
+        loop_time = best_time(run_loop, fn, small[first], small["reserve_in"], small["reserve_out"], fee)
+        array_time = best_time(fn, large[first], large["reserve_in"], large["reserve_out"], fee)
+
+        loop_rate = loop_size / loop_time
+        array_rate = array_size / array_time
+        rows.append({
+            "function": name,
+            "loop_per_second": loop_rate,
+            "array_per_second": array_rate,
+            "speedup": array_rate / loop_rate,
+        })
+
+    return pd.DataFrame(rows)
+
+
+def main(loop_size=LOOP_SIZE, array_size=ARRAY_SIZE, seed=SEED):
+    check(seed=seed)
+    print("Scalar and array results match")
+
+    df = benchmark(loop_size, array_size, seed=seed)
+    with pd.option_context("display.float_format", "{:,.0f}".format):
+        print(df)
+    return df
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Loop vs array throughput of lib/amm")
+    parser.add_argument("--loop-size", type=int, default=LOOP_SIZE)
+    parser.add_argument("--array-size", type=int, default=ARRAY_SIZE)
+    parser.add_argument("--seed", type=int, default=SEED)
+    args = parser.parse_args()
+
+    main(args.loop_size, args.array_size, args.seed)
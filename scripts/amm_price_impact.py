@@ -1,9 +1,10 @@
-from random import random
-
 import matplotlib.pyplot as plt
 import pandas as pd
 import seaborn as sns
 
+from lib.amm import price_given_in, amount_out_given_in, amount_in_give_out, max_in_before_price_limit, make_pool
+from lib.amm import fixed_point
+from lib.rng import make_random
 from scripts.loggers.amm_price_impact_logger import AmmPriceImpactLogger, AmmPriceImpactEntry, AmmBruteForceLogger, AMMBruteForceEntry
 
 sns.set_style('whitegrid')
@@ -19,24 +20,6 @@ plt.rcParams['figure.figsize'] = 15, 30
   
 """
 
-def price_given_in(amount_in, reserve_in, reserve_out):
-  out = amount_out_given_in(amount_in, reserve_in, reserve_out)
-  return amount_in / out
-
-def amount_out_given_in(amount_in, reserve_in, reserve_out):
-  amount_out = reserve_out * amount_in / (reserve_in + amount_in)
-  return amount_out
-
-
-"""
-  Derived by the above
-"""
-def amount_in_give_out(amount_out, reserve_in, reserve_out):
-  amount_in = reserve_in * amount_out / (reserve_out - amount_out)
-  return amount_in
-
-def max_in_before_price_limit(price_limit, reserve_in, reserve_out):
-  return reserve_out * price_limit - reserve_in
 
 """
   New math to test out
@@ -66,6 +49,9 @@ MAX_BPS = 10_000
 SETTING_MAX_LTV = 8_500 ## 85% LTV
 SETTING_MAX_LP_BPS = MAX_BPS
 
+## Assume 13 ETH = 1 BTC to KIS
+PRICE_RATIO = 13
+
 ## At risk BTC -> Needs to be liquidated
 ## Available in AMM BTC -> Can be bought at price impact before thinking about taking debt
 """
@@ -99,7 +85,7 @@ MORE_RISK = False
 """
 
 
-def sim(run, MAX_LTV, MAX_LP_BPS, LIQUIDATABLE_BPS, AT_RISK_LTV) -> SimResult:
+def sim(run, MAX_LTV, MAX_LP_BPS, LIQUIDATABLE_BPS, AT_RISK_LTV, rng=None, pool_type="v2") -> SimResult:
   """
     Variables to fix / linearly test
     - MAX_LTV (5_000 <= MAX_LTV <= 9_998) // Between 50% and 9_998 LTV || 200% - 100.020004001% CR
@@ -118,8 +104,10 @@ def sim(run, MAX_LTV, MAX_LP_BPS, LIQUIDATABLE_BPS, AT_RISK_LTV) -> SimResult:
     LIQUIDATABLE_BPS -> 0 -> MAX_LP_BPS
   """
 
+  rng = make_random(rng)
+
   ## TODO: Do we need this?
-  AVG_LTV = random() * MAX_LTV
+  AVG_LTV = rng.random() * MAX_LTV
 
   LP_BPS = MAX_LP_BPS
   LIQUIDATABLE_BPS = LIQUIDATABLE_BPS
@@ -129,16 +117,15 @@ def sim(run, MAX_LTV, MAX_LP_BPS, LIQUIDATABLE_BPS, AT_RISK_LTV) -> SimResult:
   ## As this is more interesting for the Exponential AMM Math
   if MORE_RISK:
     ## Of the whole thing vs of the LP %
-    LIQUIDATABLE_BPS = random() * MAX_BPS
+    LIQUIDATABLE_BPS = rng.random() * MAX_BPS
 
   ## Always greater than MAX_LTV
   ## But smaller than 100%
   ## At 100% + 1 we have no economic incentive to save
   ## TODO: Do we need this? I Think we need to also pass this as this is the profitability %
 
-  ## Assume 13 ETH = 1 BTC to KIS
-  ## NOTE: Assume LP value is 1/1 which technically is naive, but for sim purposes should be sufficient
-  price_ratio = 13
+  ## NOTE: Assume LP value is 1/1 which technically is naive, but for sim purposes should be sufficient
+  price_ratio = PRICE_RATIO
 
   ## NOTE: No extra decimals cause Python handles them
   deposited_eth = AMT_ETH
@@ -162,8 +149,11 @@ def sim(run, MAX_LTV, MAX_LP_BPS, LIQUIDATABLE_BPS, AT_RISK_LTV) -> SimResult:
   reserve_btc = btc_in_amm
   reserve_eth = eth_in_amm
 
-  print("price_given_in(1, reserve_btc, reserve_eth", price_given_in(1, reserve_eth, reserve_btc))
-  initial_price = price_given_in(1, reserve_eth, reserve_btc)
+  ## "v2" -> x * y = k, "v3" -> same reserves concentrated around the price, see lib/amm
+  pool = make_pool(pool_type, reserve_eth, reserve_btc)
+
+  print("price_given_in(1, reserve_btc, reserve_eth", pool.price_given_in(1))
+  initial_price = pool.price_given_in(1)
   
   ## Price makes sense
   ## NOTE: I have times where I get a initial price of 152, etc..
@@ -206,7 +196,9 @@ def sim(run, MAX_LTV, MAX_LP_BPS, LIQUIDATABLE_BPS, AT_RISK_LTV) -> SimResult:
   print("max_price", max_price)
 
   ## Check amount we can buy
-  max_amount = max_in_before_price_limit(max_price, reserve_eth, reserve_btc)
+  ## Linear approximation for both pool types, same metric as scripts/amm_price_impact_grid.py
+  ## NOTE: v3 takes it on the virtual reserves of the active range, see ConcentratedPool.max_in_before_price_limit
+  max_amount = pool.max_in_before_price_limit(max_price)
   print("max_amount", max_amount)
 
 
@@ -238,10 +230,102 @@ def sim(run, MAX_LTV, MAX_LP_BPS, LIQUIDATABLE_BPS, AT_RISK_LTV) -> SimResult:
     
     return SimResult(is_solvent=False, log_entry=log_entry)
   
+def sim_exact(run, MAX_LTV, MAX_LP_BPS, LIQUIDATABLE_BPS, AT_RISK_LTV, rng=None, pool_type="v2") -> SimResult:
+  """
+    sim() in integer units (wei / satoshi) with Solidity rounding, see lib/amm/fixed_point.py
+    Same draws and steps as sim(), AVG_LTV is floored to a whole BPS
+    Prices are WAD scaled ETH per BTC, the log entry gets them back as floats
+    Only x * y = k pools, the concentrated liquidity model is float only
+  """
+  assert pool_type == "v2", "sim_exact only supports v2 pools"
+  fp = fixed_point
+  rng = make_random(rng)
+
+  AVG_LTV = int(rng.random() * MAX_LTV)
+
+  LP_BPS = MAX_LP_BPS
+
+  if MORE_RISK:
+    LIQUIDATABLE_BPS = int(rng.random() * MAX_BPS)
+
+  price_ratio = PRICE_RATIO
+
+  deposited_eth = fp.to_units(AMT_ETH, ETH_DECIMALS)
+  print("deposited_eth", deposited_eth)
+  ## wei -> satoshi at price_ratio ETH per BTC, then the LTV, one floor
+  borrowed_btc = fp.mul_div(deposited_eth, AVG_LTV * 10 ** BTC_DECIMALS, price_ratio * MAX_BPS * 10 ** ETH_DECIMALS)
+  print("borrowed_btc", borrowed_btc)
+
+  max_liquidatable = fp.mul_div(borrowed_btc, LIQUIDATABLE_BPS, MAX_BPS)
+
+  print("max_liquidatable", max_liquidatable)
+  print("as percent", LIQUIDATABLE_BPS)
+
+  ## Floored on the way down so it can only be under by less than 1 BPS, rounding back up gives it back exactly
+  if borrowed_btc >= MAX_BPS:
+    assert LIQUIDATABLE_BPS == fp.mul_div(max_liquidatable, MAX_BPS, borrowed_btc, round_up=True)
+
+  btc_in_amm = fp.mul_div(LP_BPS, borrowed_btc, MAX_BPS)
+  print("btc_in_amm", btc_in_amm)
+  eth_in_amm = fp.rescale(btc_in_amm * price_ratio, BTC_DECIMALS, ETH_DECIMALS)
+  print("as_eth", eth_in_amm)
+
+  reserve_btc = btc_in_amm
+  reserve_eth = eth_in_amm
+
+  ## wei per satoshi -> ETH per BTC
+  initial_price = fp.rescale(fp.price_given_in(10 ** ETH_DECIMALS, reserve_eth, reserve_btc), ETH_DECIMALS, BTC_DECIMALS)
+  print("initial_price", initial_price)
+
+  assert initial_price >= 12 * fp.WAD and initial_price <= 15 * fp.WAD
+
+  liquidatable_debt = max_liquidatable
+  print("liquidatable_debt", liquidatable_debt)
+  liquidatable_collateral = fp.mul_div(fp.rescale(liquidatable_debt * price_ratio, BTC_DECIMALS, ETH_DECIMALS), MAX_BPS, AT_RISK_LTV)
+  print("liquidatable_collateral", liquidatable_collateral)
+
+  profitability_bps = MAX_BPS - AT_RISK_LTV
+  print("profitability_bps", profitability_bps)
+
+  current_price = price_ratio * fp.WAD
+
+  max_price = fp.mul_div(current_price, MAX_BPS + profitability_bps - 1, MAX_BPS)
+  print("max_price", max_price)
+
+  ## The AMM math takes raw units, wei per satoshi
+  max_amount = fp.max_in_before_price_limit(fp.rescale(max_price, BTC_DECIMALS, ETH_DECIMALS), reserve_eth, reserve_btc)
+  print("max_amount", max_amount)
+
+  log_entry = AmmPriceImpactEntry(
+    run,
+    deposited_eth=fp.from_units(deposited_eth, ETH_DECIMALS),
+    borrowed_btc=fp.from_units(borrowed_btc, BTC_DECIMALS),
+    max_liquidatable=fp.from_units(max_liquidatable, BTC_DECIMALS),
+    reserve_btc=fp.from_units(reserve_btc, BTC_DECIMALS),
+    reserve_eth=fp.from_units(reserve_eth, ETH_DECIMALS),
+    initial_price=fp.from_units(initial_price, ETH_DECIMALS),
+    liquidatable_collateral=fp.from_units(liquidatable_collateral, ETH_DECIMALS),
+    profitability_bps=profitability_bps,
+    max_price=fp.from_units(max_price, ETH_DECIMALS),
+    max_amount=fp.from_units(max_amount, ETH_DECIMALS)
+  )
+
+  ## Same comparison as sim(), in whole token amounts
+  if fp.rescale(max_amount, ETH_DECIMALS, BTC_DECIMALS) > liquidatable_debt:
+    print("We can safely liquidate")
+    return SimResult(is_solvent=True, log_entry=log_entry)
+  else:
+    print("----- We are capped -----")
+    print("liquidatable_debt - max_amount", liquidatable_debt - fp.rescale(max_amount, ETH_DECIMALS, BTC_DECIMALS))
+    return SimResult(is_solvent=False, log_entry=log_entry)
+
+
 RUNS = 10_000
 LOG = True
 
-def random_run():
+def random_run(seed=None, exact=False, pool_type="v2"):
+  rng = make_random(seed)
+  run_sim = sim_exact if exact else sim
   counter = 0
   exc = 0
   insolvent = 0
@@ -250,7 +334,7 @@ def random_run():
 
   for i in range(RUNS):
     try:
-      sim_result = sim(i)
+      sim_result = run_sim(i, rng=rng, pool_type=pool_type)
       if sim_result.is_solvent:
         print("")
         print("")
@@ -269,7 +353,11 @@ def random_run():
   if(LOG):
     logger.to_csv()
 
-def main():
+def main(seed=None, exact=False, pool_type="v2"):
+  ## exact -> integer wei / satoshi math with Solidity rounding (sim_exact)
+  ## pool_type -> "v2" or "v3" (concentrated liquidity), see lib/amm
+  rng = make_random(seed)
+  run_sim = sim_exact if exact else sim
   counter = 0
   exc = 0
   insolvent = 0
@@ -300,7 +388,7 @@ def main():
       for liquidatable_bps in RANGE_LIQUIDATABLE_BPS:
         runs += 1
         try:
-          sim_result = sim(runs, max_ltv, max_lp_bps, liquidatable_bps, at_risk_ltv)
+          sim_result = run_sim(runs, max_ltv, max_lp_bps, liquidatable_bps, at_risk_ltv, rng, pool_type)
           if sim_result.is_solvent:
             print("")
             print("")
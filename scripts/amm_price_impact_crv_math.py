@@ -1,10 +1,8 @@
-from random import random
-
 import matplotlib.pyplot as plt
 import pandas as pd
 import seaborn as sns
-from math import sqrt
 
+from lib.amm import price_given_in, amount_out_given_in, amount_in_give_out, max_in_before_price_limit, max_in_before_price_limit_sqrt
 from scripts.loggers.amm_price_impact_logger import AmmPriceImpactLogger, AmmPriceImpactEntry, AmmBruteForceLogger, AMMBruteForceEntry
 
 sns.set_style('whitegrid')
@@ -24,29 +22,6 @@ plt.rcParams['figure.figsize'] = 15, 30
   https://twitter.com/AaveAave/status/1595168982541209611
 """
 
-def price_given_in(amount_in, reserve_in, reserve_out):
-  out = amount_out_given_in(amount_in, reserve_in, reserve_out)
-  return amount_in / out
-
-def amount_out_given_in(amount_in, reserve_in, reserve_out):
-  amount_out = reserve_out * amount_in / (reserve_in + amount_in)
-  return amount_out
-
-
-"""
-  Derived by the above
-"""
-def amount_in_give_out(amount_out, reserve_in, reserve_out):
-  amount_in = reserve_in * amount_out / (reserve_out - amount_out)
-  return amount_in
-
-def max_in_before_price_limit(price_limit, reserve_in, reserve_out):
-  return reserve_out * price_limit - reserve_in
-
-def max_in_before_price_limit_sqrt(price_limit, reserve_in, reserve_out):
-  return sqrt(reserve_out * reserve_in * price_limit) - reserve_in
-
-
 
 LTV = 8_500 ## 85%
 MAX_BPS = 10_000
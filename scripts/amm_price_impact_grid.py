@@ -0,0 +1,255 @@
+import numpy as np
+import pandas as pd
+
+from scripts.amm_price_impact import (
+  AMT_ETH,
+  MAX_BPS,
+  SETTING_MAX_LTV,
+  PRICE_RATIO,
+)
+from scripts.loggers.amm_price_impact_logger import AmmBruteForceLogger
+from lib.amm import price_given_in, max_in_before_price_limit
+from lib.rng import make_rng
+
+"""
+  Batched Brute Force of amm_price_impact.sim
+
+  Instead of calling sim() once per (max_lp_bps, at_risk_ltv, liquidatable_bps)
+  We compute every value of sim() for the whole cube as broadcast arrays:
+  - axis 0 -> max_lp_bps
+  - axis 1 -> at_risk_ltv
+  - axis 2 -> liquidatable_bps
+
+  Then the first insolvent liquidatable_bps for each (max_lp_bps, at_risk_ltv) row is an argmax along axis 2
+
+  Frontier mode (solvency_frontier) skips the cube entirely
+  Solvency is monotone in liquidatable_bps for a fixed row, so we binary search (or solve) the boundary
+  O(log n) evaluations per row instead of n, which is what makes 1 BPS on all 3 axes practical
+
+  Cells where sim() would raise (0 liquidity, initial price outside of 12 - 15) are flagged as not valid
+  and skipped, same as the bare try / except in amm_price_impact.main
+
+  NOTE: MORE_RISK is not supported, LIQUIDATABLE_BPS is always the grid value
+"""
+
+## Cells evaluated at once, caps memory at 1 BPS resolution
+CHUNK_CELLS = 2_000_000
+
+## Returned when a row never goes insolvent
+NEVER_INSOLVENT = -1
+
+
+def evaluate_grid(max_lp_bps, at_risk_ltv, liquidatable_bps, max_ltv=SETTING_MAX_LTV, avg_ltv=None, rng=None):
+  """
+    All of sim() for the cube max_lp_bps x at_risk_ltv x liquidatable_bps
+    avg_ltv: None to draw random() * max_ltv per cell like sim(), else anything that broadcasts to the cube
+  """
+  lp_bps = np.asarray(max_lp_bps, dtype=np.float64)[:, None, None]
+  at_risk_ltv = np.asarray(at_risk_ltv, dtype=np.float64)[None, :, None]
+  liquidatable_bps = np.asarray(liquidatable_bps, dtype=np.float64)[None, None, :]
+  shape = (lp_bps.shape[0], at_risk_ltv.shape[1], liquidatable_bps.shape[2])
+
+  if avg_ltv is None:
+    rng = make_rng(rng)
+    avg_ltv = rng.random(shape) * max_ltv
+
+  return evaluate_cells(lp_bps, at_risk_ltv, liquidatable_bps, avg_ltv)
+
+
+def evaluate_cells(lp_bps, at_risk_ltv, liquidatable_bps, avg_ltv):
+  """
+    sim() for any set of cells, all inputs broadcast together
+  """
+  shape = np.broadcast_shapes(np.shape(lp_bps), np.shape(at_risk_ltv), np.shape(liquidatable_bps), np.shape(avg_ltv))
+
+  price_ratio = PRICE_RATIO
+  deposited_eth = AMT_ETH
+
+  with np.errstate(divide='ignore', invalid='ignore'):
+    borrowed_btc = (deposited_eth / price_ratio) * (avg_ltv / MAX_BPS)
+    max_liquidatable = borrowed_btc * liquidatable_bps / MAX_BPS
+
+    btc_in_amm = lp_bps * borrowed_btc / MAX_BPS
+    eth_in_amm = btc_in_amm * price_ratio
+
+    reserve_btc = btc_in_amm
+    reserve_eth = eth_in_amm
+
+    initial_price = price_given_in(1, reserve_eth, reserve_btc)
+
+    liquidatable_debt = max_liquidatable
+    liquidatable_collateral = liquidatable_debt * price_ratio / at_risk_ltv * MAX_BPS
+
+    profitability_bps = MAX_BPS - at_risk_ltv
+
+    current_price = price_ratio
+    max_price = current_price * (MAX_BPS + profitability_bps - 1) / MAX_BPS
+
+    max_amount = max_in_before_price_limit(max_price, reserve_eth, reserve_btc)
+
+  ## Same as the assert in sim(), NaN / inf fail both comparisons
+  is_valid = (initial_price >= 12) & (initial_price <= 15)
+
+  return {
+    "borrowed_btc": np.broadcast_to(borrowed_btc, shape),
+    "max_liquidatable": np.broadcast_to(max_liquidatable, shape),
+    "reserve_btc": np.broadcast_to(reserve_btc, shape),
+    "reserve_eth": np.broadcast_to(reserve_eth, shape),
+    "initial_price": np.broadcast_to(initial_price, shape),
+    "liquidatable_collateral": np.broadcast_to(liquidatable_collateral, shape),
+    "profitability_bps": np.broadcast_to(profitability_bps, shape),
+    "max_price": np.broadcast_to(max_price, shape),
+    "max_amount": np.broadcast_to(max_amount, shape),
+    "is_valid": np.broadcast_to(is_valid, shape),
+    "is_solvent": np.broadcast_to(max_amount > liquidatable_debt, shape),
+  }
+
+
+def first_insolvent(max_lp_bps, at_risk_ltv, liquidatable_bps, max_ltv=SETTING_MAX_LTV, avg_ltv=None, rng=None, chunk_cells=CHUNK_CELLS):
+  """
+    First insolvent liquidatable_bps for each (max_lp_bps, at_risk_ltv), shape (len(max_lp_bps), len(at_risk_ltv))
+    NEVER_INSOLVENT if the row is solvent (or not valid) all the way
+  """
+  max_lp_bps = np.asarray(max_lp_bps)
+  at_risk_ltv = np.asarray(at_risk_ltv)
+  liquidatable_bps = np.asarray(liquidatable_bps)
+  rng = make_rng(rng)
+
+  ## Whole liquidatable_bps axis per block, as many (lp, ltv) rows as fit in chunk_cells
+  ltv_chunk = max(1, min(len(at_risk_ltv), chunk_cells // len(liquidatable_bps)))
+  lp_chunk = max(1, chunk_cells // (ltv_chunk * len(liquidatable_bps)))
+
+  frontier = np.full((len(max_lp_bps), len(at_risk_ltv)), NEVER_INSOLVENT, dtype=np.int64)
+  for lp_start in range(0, len(max_lp_bps), lp_chunk):
+    lp_block = slice(lp_start, lp_start + lp_chunk)
+    for ltv_start in range(0, len(at_risk_ltv), ltv_chunk):
+      ltv_block = slice(ltv_start, ltv_start + ltv_chunk)
+
+      block_avg_ltv = avg_ltv
+      if np.ndim(avg_ltv) == 3:
+        block_avg_ltv = avg_ltv[lp_block, ltv_block]
+
+      cube = evaluate_grid(max_lp_bps[lp_block], at_risk_ltv[ltv_block], liquidatable_bps, max_ltv, block_avg_ltv, rng)
+      insolvent = cube["is_valid"] & ~cube["is_solvent"]
+
+      first = np.argmax(insolvent, axis=2)
+      found = insolvent.any(axis=2)
+      frontier[lp_block, ltv_block] = np.where(found, liquidatable_bps[first], NEVER_INSOLVENT)
+
+  return frontier
+
+
+def solvency_frontier(max_lp_bps, at_risk_ltv, liquidatable_bps, max_ltv=SETTING_MAX_LTV, avg_ltv=None, rng=None, method="bisect", chunk_cells=CHUNK_CELLS):
+  """
+    Same table as first_insolvent, without evaluating the cube
+    liquidatable_bps must be sorted ascending
+
+    NOTE: One AVG_LTV per (max_lp_bps, at_risk_ltv) row, shape (len(max_lp_bps), len(at_risk_ltv))
+    A fresh draw per cell (like sim()) can flip validity mid row and breaks the monotonicity we rely on
+
+    method:
+    - "bisect" -> binary search on liquidatable_bps, ~log2(n) evaluations per row
+    - "closed_form" -> solve max_amount == liquidatable_debt, then 1 step of correction for float rounding
+  """
+  max_lp_bps = np.asarray(max_lp_bps)
+  at_risk_ltv = np.asarray(at_risk_ltv)
+  liquidatable_bps = np.asarray(liquidatable_bps)
+  shape = (len(max_lp_bps), len(at_risk_ltv))
+
+  if avg_ltv is None:
+    rng = make_rng(rng)
+    avg_ltv = rng.random(shape) * max_ltv
+  avg_ltv = np.broadcast_to(avg_ltv, shape)
+
+  lp_grid, ltv_grid = np.meshgrid(max_lp_bps, at_risk_ltv, indexing='ij')
+  lp_grid = lp_grid.ravel()
+  ltv_grid = ltv_grid.ravel()
+  avg_ltv = avg_ltv.ravel()
+
+  frontier = np.full(lp_grid.shape, NEVER_INSOLVENT, dtype=np.int64)
+  for start in range(0, len(lp_grid), chunk_cells):
+    block = slice(start, start + chunk_cells)
+    frontier[block] = _frontier_block(lp_grid[block], ltv_grid[block], avg_ltv[block], liquidatable_bps, method)
+
+  return frontier.reshape(shape)
+
+
+def _frontier_block(lp_bps, at_risk_ltv, avg_ltv, liquidatable_bps, method):
+  n = len(liquidatable_bps)
+
+  def insolvent_at(index):
+    ## index == n means past the end of the range, never insolvent there
+    cells = evaluate_cells(lp_bps, at_risk_ltv, liquidatable_bps[np.minimum(index, n - 1)], avg_ltv)
+    return cells["is_valid"] & ~cells["is_solvent"] & (index < n)
+
+  if method == "bisect":
+    ## Invariant: solvent below lo, insolvent at hi (or hi == n)
+    lo = np.zeros(len(lp_bps), dtype=np.int64)
+    hi = np.full(len(lp_bps), n, dtype=np.int64)
+    while np.any(lo < hi):
+      active = lo < hi
+      mid = (lo + hi) // 2
+      insolvent = insolvent_at(mid)
+      hi = np.where(active & insolvent, mid, hi)
+      lo = np.where(active & ~insolvent, mid + 1, lo)
+    index = lo
+  elif method == "closed_form":
+    ## max_amount = btc_in_amm * (max_price - PRICE_RATIO) and liquidatable_debt = borrowed_btc * bps / MAX_BPS
+    ## So we're insolvent from bps >= lp_bps * (max_price - PRICE_RATIO), borrowed_btc cancels out
+    max_price = PRICE_RATIO * (MAX_BPS + (MAX_BPS - at_risk_ltv) - 1) / MAX_BPS
+    boundary = lp_bps * (max_price - PRICE_RATIO)
+    index = np.searchsorted(liquidatable_bps, boundary)
+
+    index = np.where((index < n) & ~insolvent_at(index), index + 1, index)
+    index = np.where((index > 0) & insolvent_at(index - 1), index - 1, index)
+  else:
+    raise ValueError(f"Unknown method {method}")
+
+  found = insolvent_at(index)
+  return np.where(found, liquidatable_bps[np.minimum(index, n - 1)], NEVER_INSOLVENT)
+
+
+def to_frame(max_lp_bps, at_risk_ltv, frontier, max_ltv=SETTING_MAX_LTV):
+  ## Same columns as AMMBruteForceEntry, one row per insolvent (max_lp_bps, at_risk_ltv)
+  lp_grid, ltv_grid = np.meshgrid(max_lp_bps, at_risk_ltv, indexing='ij')
+  insolvent = frontier != NEVER_INSOLVENT
+
+  df = pd.DataFrame({
+    "max_ltv": max_ltv,
+    "max_lp_bps": lp_grid[insolvent],
+    "liquidatable_bps": frontier[insolvent],
+    "at_risk_ltv": ltv_grid[insolvent],
+  })
+  df.insert(0, "run", np.arange(1, len(df) + 1))
+  return df
+
+
+def main(lp_step=100, ltv_step=500, liquidatable_step=100, seed=None, frontier_mode=False):
+  """
+    Defaults are the ranges of amm_price_impact.main, use 1 for 1 BPS resolution
+    frontier_mode -> solvency_frontier instead of the full cube
+  """
+  ## Must be non-zero as 0 liquidty means a revert
+  RANGE_MAX_LP_BPS = np.arange(100, 10_000, lp_step)[::-1]
+  AT_RISK_LTV_RANGE = np.arange(SETTING_MAX_LTV + 1, MAX_BPS - 1, ltv_step)
+  RANGE_LIQUIDATABLE_BPS = np.arange(0, MAX_BPS, liquidatable_step)
+
+  rng = make_rng(seed)
+  if frontier_mode:
+    frontier = solvency_frontier(RANGE_MAX_LP_BPS, AT_RISK_LTV_RANGE, RANGE_LIQUIDATABLE_BPS, rng=rng)
+  else:
+    frontier = first_insolvent(RANGE_MAX_LP_BPS, AT_RISK_LTV_RANGE, RANGE_LIQUIDATABLE_BPS, rng=rng)
+
+  cells = len(RANGE_MAX_LP_BPS) * len(AT_RISK_LTV_RANGE) * len(RANGE_LIQUIDATABLE_BPS)
+  print("Cells", cells)
+  print("Rows", frontier.size, "of which insolvent", (frontier != NEVER_INSOLVENT).sum())
+
+  logger = AmmBruteForceLogger()
+  df = to_frame(RANGE_MAX_LP_BPS, AT_RISK_LTV_RANGE, frontier)
+  filename = f'{logger.path}/{pd.Timestamp.now()}.csv'
+  df.to_csv(filename, columns=logger.headers, index=False)
+  print("Saved to", filename)
+
+
+if __name__ == '__main__':
+  main()
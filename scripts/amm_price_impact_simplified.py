@@ -1,10 +1,9 @@
-from random import random
-
 import matplotlib.pyplot as plt
 import pandas as pd
 import seaborn as sns
-from math import sqrt
 
+from lib.amm import make_pool
+from lib.rng import make_random
 from scripts.loggers.amm_price_impact_logger import AmmPriceImpactLogger, AmmPriceImpactEntry, AmmBruteForceLogger, AMMBruteForceEntry
 
 sns.set_style('whitegrid')
@@ -12,32 +11,9 @@ plt.rcParams['figure.figsize'] = 15, 30
 
 """
   Basic sim, that given a target LTV shows the maximum amounts liquidatable
-  Is cognizant of price impact on UniV2 Like AMM
+  Is cognizant of price impact on UniV2 Like AMM, or UniV3 like with pool_type="v3"
 """
 
-def price_given_in(amount_in, reserve_in, reserve_out):
-  out = amount_out_given_in(amount_in, reserve_in, reserve_out)
-  return amount_in / out
-
-def amount_out_given_in(amount_in, reserve_in, reserve_out):
-  amount_out = reserve_out * amount_in / (reserve_in + amount_in)
-  return amount_out
-
-
-"""
-  Derived by the above
-"""
-def amount_in_give_out(amount_out, reserve_in, reserve_out):
-  amount_in = reserve_in * amount_out / (reserve_out - amount_out)
-  return amount_in
-
-def max_in_before_price_limit(price_limit, reserve_in, reserve_out):
-  return reserve_out * price_limit - reserve_in
-
-def max_in_before_price_limit_sqrt(price_limit, reserve_in, reserve_out):
-  return sqrt(reserve_out * reserve_in * price_limit) - reserve_in
-
-
 
 LTV = 8_500 ## 85%
 MAX_BPS = 10_000
@@ -53,7 +29,10 @@ MIN_PROFIT = 70
 MAX_PROFIT = MAX_BPS - LTV
 
 
-def main():
+def main(seed=None, pool_type="v2"):
+  ## pool_type -> "v2" (x * y = k) or "v3" (same reserves, concentrated liquidity), see lib/amm
+  rng = make_random(seed)
+
   ## From 5% to 95%
   RANGE_LIQUIDITY = reversed(range(500, MAX_LIQUIDITY, 500))
 
@@ -61,7 +40,7 @@ def main():
   ETH_BASE = 1000e18
 
   ## We need this to start the sim, this value is necessary for relative math
-  AVG_LTV = random() * LTV
+  AVG_LTV = rng.random() * LTV
 
   BTC_BASE = ETH_BASE * AVG_LTV / MAX_BPS
 
@@ -77,11 +56,12 @@ def main():
 
     x = BTC_BASE * liquidity / MAX_BPS
     y = x / price_ratio ## 13 times more ETH than BTC
+    pool = make_pool(pool_type, x, y)
 
     print("### === CASE LIQUIDITY BPS === ###", liquidity)
     print("Given premium BPS betweem", MIN_PROFIT, MAX_PROFIT)
 
-    spot_price = price_given_in(1, x, y)
+    spot_price = pool.price_given_in(1)
     print("spot_price", spot_price)
 
     ### === BEST CASE SCENARIO === ###
@@ -90,10 +70,10 @@ def main():
     max_price = spot_price * (MAX_BPS + MAX_PROFIT) / MAX_BPS
     print("max_price", max_price)
 
-    max_eth_before_insolvent = max_in_before_price_limit(max_price, x, y)
-    max_eth_before_insolvent_sqrt = max_in_before_price_limit_sqrt(max_price, x, y)
-    max_btc_liquidatable = amount_out_given_in(max_eth_before_insolvent, x, y)
-    max_btc_liquidatable_sqrt = amount_out_given_in(max_eth_before_insolvent_sqrt, x, y)
+    max_eth_before_insolvent = pool.max_in_before_price_limit(max_price)
+    max_eth_before_insolvent_sqrt = pool.max_in_before_price_limit_sqrt(max_price)
+    max_btc_liquidatable = pool.amount_out_given_in(max_eth_before_insolvent)
+    max_btc_liquidatable_sqrt = pool.amount_out_given_in(max_eth_before_insolvent_sqrt)
 
     print("You can liquidate at most", max_btc_liquidatable)
     print("As portion of Total Supply BPS", max_btc_liquidatable / BTC_BASE * MAX_BPS)
@@ -109,8 +89,8 @@ def main():
       print("")
       print("")
       print("DEBUG")
-      print("price_given_in(normal)", price_given_in(max_eth_before_insolvent, x, y))
-      print("price_given_in(sqrt)", price_given_in(max_eth_before_insolvent_sqrt, x, y))
+      print("price_given_in(normal)", pool.price_given_in(max_eth_before_insolvent))
+      print("price_given_in(sqrt)", pool.price_given_in(max_eth_before_insolvent_sqrt))
 
       print("")
       print("")
@@ -123,10 +103,10 @@ def main():
     min_price = spot_price * (MAX_BPS + MIN_PROFIT) / MAX_BPS
     print("min_price", min_price)
     
-    min_max_eth_before_insolvent = max_in_before_price_limit(min_price, x, y)
-    min_max_eth_before_insolvent_sqrt = max_in_before_price_limit_sqrt(min_price, x, y)
-    min_max_btc_liquidatable = amount_out_given_in(min_max_eth_before_insolvent, x, y)
-    min_max_btc_liquidatable_sqrt = amount_out_given_in(min_max_eth_before_insolvent_sqrt, x, y)
+    min_max_eth_before_insolvent = pool.max_in_before_price_limit(min_price)
+    min_max_eth_before_insolvent_sqrt = pool.max_in_before_price_limit_sqrt(min_price)
+    min_max_btc_liquidatable = pool.amount_out_given_in(min_max_eth_before_insolvent)
+    min_max_btc_liquidatable_sqrt = pool.amount_out_given_in(min_max_eth_before_insolvent_sqrt)
 
 
     print("You can liquidate at worst", min_max_btc_liquidatable)
@@ -147,10 +127,10 @@ def main():
     max_price_recovery = spot_price * (MAX_BPS + MAX_PROFIT + RECOVERY_MODE_BUFFER) / MAX_BPS
     print("max_price_recovery", max_price_recovery)
 
-    recovery_max_eth_before_insolvent = max_in_before_price_limit(max_price_recovery, x, y)
-    recovery_max_eth_before_insolvent_sqrt = max_in_before_price_limit_sqrt(max_price_recovery, x, y)
-    recovery_max_btc_liquidatable = amount_out_given_in(recovery_max_eth_before_insolvent, x, y)
-    recovery_max_btc_liquidatable_sqrt = amount_out_given_in(recovery_max_eth_before_insolvent_sqrt, x, y)
+    recovery_max_eth_before_insolvent = pool.max_in_before_price_limit(max_price_recovery)
+    recovery_max_eth_before_insolvent_sqrt = pool.max_in_before_price_limit_sqrt(max_price_recovery)
+    recovery_max_btc_liquidatable = pool.amount_out_given_in(recovery_max_eth_before_insolvent)
+    recovery_max_btc_liquidatable_sqrt = pool.amount_out_given_in(recovery_max_eth_before_insolvent_sqrt)
 
     print("You can liquidate at most", recovery_max_btc_liquidatable)
     print("As portion of Total Supply BPS", recovery_max_btc_liquidatable / BTC_BASE * MAX_BPS)
@@ -1,10 +1,9 @@
-from random import random
-
 import matplotlib.pyplot as plt
 import pandas as pd
 import seaborn as sns
-from math import sqrt
 
+from lib.amm import price_given_in, amount_out_given_in, amount_in_give_out, max_in_before_price_limit, max_in_before_price_limit_sqrt
+from lib.rng import make_random
 from scripts.loggers.amm_price_impact_logger import AmmPriceImpactLogger, AmmPriceImpactEntry, AmmBruteForceLogger, AMMBruteForceEntry
 
 sns.set_style('whitegrid')
@@ -19,29 +18,6 @@ plt.rcParams['figure.figsize'] = 15, 30
   - With TCR at 150% (slightly above Recovery Mode)
 """
 
-def price_given_in(amount_in, reserve_in, reserve_out):
-  out = amount_out_given_in(amount_in, reserve_in, reserve_out)
-  return amount_in / out
-
-def amount_out_given_in(amount_in, reserve_in, reserve_out):
-  amount_out = reserve_out * amount_in / (reserve_in + amount_in)
-  return amount_out
-
-
-"""
-  Derived by the above
-"""
-def amount_in_give_out(amount_out, reserve_in, reserve_out):
-  amount_in = reserve_in * amount_out / (reserve_out - amount_out)
-  return amount_in
-
-def max_in_before_price_limit(price_limit, reserve_in, reserve_out):
-  return reserve_out * price_limit - reserve_in
-
-def max_in_before_price_limit_sqrt(price_limit, reserve_in, reserve_out):
-  return sqrt(reserve_out * reserve_in * price_limit) - reserve_in
-
-
 
 LTV = 8_500 ## 85%
 
@@ -62,7 +38,9 @@ MIN_PROFIT = 0
 MAX_PROFIT = MAX_BPS - LTV
 
 
-def main():
+def main(seed=None):
+  rng = make_random(seed)
+
   ## TODO: Can add Liquidity to show what could be redeemed immediately
   RANGE_LIQUIDITY = range(0, 0)
 
@@ -90,7 +68,7 @@ def main():
   higher_bound_profit = MAX_BPS - LTV
 
   ## Between 50 and 99.999999999%
-  liquidation_percent = random() * 5_000 + 5_000
+  liquidation_percent = rng.random() * 5_000 + 5_000
   print("Assuming CDP Whale is", liquidation_percent, "percent of all debt")
 
   liquidation_debt_amount = TOTAL_BTC_DEBT * liquidation_percent / MAX_BPS
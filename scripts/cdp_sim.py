@@ -29,10 +29,18 @@
 
   Liquidate
 """
+import heapq
 import math
-import random
+from bisect import bisect_left, bisect_right, insort
+from enum import IntEnum
+from operator import attrgetter, is_
+import numpy as np
 from rich.pretty import pprint
+from lib.amm import UNIV2_FEE
 from lib.names import name_list
+from lib.arbitrage import optimal_arbitrage, optimal_buy_x, optimal_sell_x
+from lib.price_paths import iterate
+from lib.rng import make_random, make_rng
 
 
 MAX_BPS = 10_000
@@ -40,15 +48,18 @@ SECONDS_SINCE_DEPLOY = 0
 SECONDS_PER_TURN = 12 ## One block in POS
 INITIAL_FEED = 1000
 SPEED_RANGE = 10
+SECONDS_PER_YEAR = 365 * 24 * 60 * 60
 
 ## TODO: CHANGE
 MAX_LTV = 8500
 
+## Borrower ignores gaps to its target smaller than this (relative), avoids re-borrowing float dust
+BORROW_TOLERANCE = 1e-9
+
 ## Randomness seed for multiple runs
+## NOTE: Each Ebtc owns its own random.Random, users and the default turn order draw from system.rng
 SEED = 123
 
-random.seed(SEED)
-
 ### ARCHITECURE ###
 """
     Ultimately we're loosely OOP, because OOP can become a mess follow these rules:
@@ -72,7 +83,44 @@ random.seed(SEED)
 """
 
 
+class Label(IntEnum):
+    DEPOSIT = 0
+    WITHDRAW = 1
+    BORROW = 2
+    REPAY = 3
+    LIQUIDATE = 4
+    CLOSE = 5
+    SPENT_DEBT = 6
+    SPENT_COLLATERAL = 7
+    RECEIVE_DEBT = 8
+    RECEIVE_COLLATERAL = 9
+    BALANCE_OF_COLLATERAL = 10
+    BALANCE_OF_DEBT = 11
+    INTEREST = 12
+
+## Text of each Label, as it shows up in a Move
+LABEL_NAMES = [
+    "Deposit",
+    "Withdraw",
+    "Borrow",
+    "Repay",
+    "Liquidate",
+    "Close",
+    "Spent Debt",
+    "Spent Collateral",
+    "Receive Debt",
+    "Receive Collateral",
+    "Balance of Collateral",
+    "Balance of Debt",
+    "Interest",
+]
+
+LOGGER_CAPACITY = 4096
+
+
 class Move:
+    __slots__ = ("time", "actor", "label", "values")
+
     def __init__(self, time, actor, label, values):
         self.time = time
         self.actor = actor
@@ -80,22 +128,263 @@ class Move:
         self.values = values ## []
     
     def __repr__(self):
-        return str(self.__dict__)
+        return str({name: getattr(self, name) for name in self.__slots__})
 
 class Logger:
-    def __init__(self):
-        self.moves = []
-    
+    """
+        Append only event log, one row of (time, actor_id, label, value) per move
+        ~21 bytes per event instead of a Move object, Moves are only built when you read logger.moves
+
+        Actors register once (register_actor) and log with the returned id
+
+        With a sink (see scripts/loggers/cdp_event_sink.py) every full batch of `capacity` events
+        is streamed to disk and dropped, so memory stays constant. Call close() at the end
+        NOTE: Then moves only has the events not yet flushed
+    """
+    def __init__(self, capacity=LOGGER_CAPACITY, sink=None):
+        self.length = 0
+        self.flushed = 0
+        self.sink = sink
+        self.actor_names = []
+        self.time = np.zeros(capacity, dtype=np.int64)
+        self.actor = np.zeros(capacity, dtype=np.int32)
+        self.label = np.zeros(capacity, dtype=np.int8)
+        self.value = np.zeros(capacity, dtype=np.float64)
+
+    def register_actor(self, name):
+        ## One id per actor, even if two actors share a name
+        self.actor_names.append(name)
+        return len(self.actor_names) - 1
+
     def add_move(self, time, actor, label, values):
-        move = Move(time, actor, label, values)
-        self.moves.append(move)
-    
+        ## actor from register_actor, label a Label
+        if self.length == len(self.time):
+            if self.sink is None:
+                self.grow()
+            else:
+                self.flush()
+
+        self.time[self.length] = time
+        self.actor[self.length] = actor
+        self.label[self.length] = label
+        self.value[self.length] = values
+        self.length += 1
+
+    def grow(self):
+        ## Double the capacity, amortized O(1) per move
+        self.time = np.concatenate([self.time, np.zeros_like(self.time)])
+        self.actor = np.concatenate([self.actor, np.zeros_like(self.actor)])
+        self.label = np.concatenate([self.label, np.zeros_like(self.label)])
+        self.value = np.concatenate([self.value, np.zeros_like(self.value)])
+
+    def flush(self):
+        if self.sink is None or self.length == 0:
+            return
+
+        self.sink.write({
+            "time": self.time[:self.length],
+            "actor": self.actor[:self.length],
+            "label": self.label[:self.length],
+            "value": self.value[:self.length]
+        })
+        self.flushed += self.length
+        self.length = 0
+
+    def close(self):
+        ## Flush the last batch and write the actor names
+        if self.sink is None:
+            return
+
+        self.flush()
+        self.sink.close(self.actor_names)
+
+    def __len__(self):
+        ## All events, flushed or not
+        return self.flushed + self.length
+
+    def move(self, index):
+        return Move(
+            self.time[index].item(),
+            self.actor_names[self.actor[index]],
+            LABEL_NAMES[self.label[index]],
+            self.value[index].item()
+        )
+
+    @property
+    def moves(self):
+        ## Materialized on demand, O(n) objects so avoid on big runs
+        return [self.move(index) for index in range(self.length)]
+
     def __repr__(self):
-        return str(self.__dict__)
+        return str({"moves": self.moves})
+
+
+NO_OWNER = -1
+TROVE_BOOK_CAPACITY = 1024
+
+class TroveBook:
+    """
+        Every trove of the system as NumPy columns, one row per trove
+        Trove is a view over one row, the vectorized checks run over all of them at once
+
+        Rows are never reused, so the row is the trove id
+        Closed troves keep their row with 0 deposits / debt and owner NO_OWNER
+    """
+    def __init__(self, capacity=TROVE_BOOK_CAPACITY):
+        self.size = 0
+        self.deposits = np.zeros(capacity, dtype=np.float64)
+        self.debt = np.zeros(capacity, dtype=np.float64)
+        self.last_update = np.zeros(capacity, dtype=np.int64)
+        self.owner = np.full(capacity, NO_OWNER, dtype=np.int64)
+        ## Ebtc.interest_index when the debt was last realised
+        self.index_snapshot = np.zeros(capacity, dtype=np.float64)
+
+    def __len__(self):
+        return self.size
+
+    def __repr__(self):
+        return f"TroveBook(size={self.size}, open={self.open_count()})"
+
+    def grow(self):
+        ## Double the capacity, amortized O(1) per open
+        capacity = len(self.deposits) * 2
+        for column in ["deposits", "debt", "last_update", "owner", "index_snapshot"]:
+            old = getattr(self, column)
+            new = np.full(capacity, NO_OWNER if column == "owner" else 0, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, column, new)
+
+    def open(self, owner_id, time, index):
+        if self.size == len(self.deposits):
+            self.grow()
+
+        row = self.size
+        self.owner[row] = owner_id
+        self.last_update[row] = time
+        self.index_snapshot[row] = index
+        self.size += 1
+        return row
+
+    def close(self, row):
+        assert self.debt[row] == 0 and self.deposits[row] == 0
+        self.owner[row] = NO_OWNER
+
+    ## Vectorized, one value per row (closed rows are 0 and solvent)
+    def open_rows(self):
+        return self.owner[:self.size] != NO_OWNER
+
+    def open_count(self):
+        return int(self.open_rows().sum())
+
+    def max_borrow(self, feed):
+        return self.deposits[:self.size] * feed * MAX_LTV / MAX_BPS
+
+    def accrued_debt(self, index=1):
+        ## Debt including the interest not realised yet, index is Ebtc.interest_index
+        debt = self.debt[:self.size]
+        if index == 1:
+            return debt
+
+        accrued = debt.copy()
+        np.divide(debt * index, self.index_snapshot[:self.size], out=accrued, where=debt != 0)
+        return accrued
+
+    def is_solvent(self, feed, index=1):
+        ## Same as Trove.is_solvent
+        debt = self.accrued_debt(index)
+        return (debt == 0) | (debt < self.max_borrow(feed))
+
+    def current_ltv(self, feed, index=1):
+        deposits_value = self.deposits[:self.size] * feed
+        ltv = np.zeros(self.size)
+        np.divide(self.accrued_debt(index), deposits_value, out=ltv, where=deposits_value != 0)
+        return ltv
+
+    ## Aggregates
+    def total_deposits(self):
+        return self.deposits[:self.size].sum()
+
+    def total_debt(self):
+        return self.debt[:self.size].sum()
+
+    def total_max_borrow(self, feed):
+        return self.max_borrow(feed).sum()
+
+    def total_accrued_debt(self, index=1):
+        return self.accrued_debt(index).sum()
+
+    def insolvent_rows(self, feed, index=1):
+        return np.flatnonzero(~self.is_solvent(feed, index))
+
+    def all_solvent(self, feed, index=1):
+        return bool(self.is_solvent(feed, index).all())
+
+
+## Ordering Policies, set Ebtc.ordering
+## Each takes the Ebtc and a Roster, returns the order (indexes into the roster) users act in
+## NOTE: "speed" draws from system.rng like the original sort, the others from system.np_rng, so same seed -> same order
+
+class Roster:
+    """
+        The users of a turn as arrays, so policies are a few vectorized ops
+        Ebtc.sort_users keeps it across turns and permutes it along with the list
+        so we don't gather every user's attributes again each turn
+    """
+    def __init__(self, users):
+        self.source = users
+        self.users = np.empty(len(users), dtype=object)
+        self.users[:] = users
+        self.speed = np.fromiter(map(attrgetter("speed"), users), dtype=np.float64, count=len(users))
+        self.priority = np.fromiter(map(attrgetter("priority"), users), dtype=np.int64, count=len(users))
+        self.mev = np.fromiter(map(attrgetter("mev"), users), dtype=bool, count=len(users))
+
+    def __len__(self):
+        return len(self.users)
+
+    def matches(self, users):
+        ## Same list, same users in the same order, else Ebtc.sort_users rebuilds the roster
+        return self.source is users and len(users) == len(self.users) and all(map(is_, users, self.users))
+
+    def take(self, order):
+        for name in ["users", "speed", "priority", "mev"]:
+            setattr(self, name, getattr(self, name)[order])
+
+def order_by_speed(system, roster):
+    ## Original ordering, ascending speed * random, same draws as the old users.sort so runs reproduce
+    draws = np.fromiter((system.rng.random() for _ in range(len(roster))), dtype=np.float64, count=len(roster))
+    return np.argsort(roster.speed * draws, kind="stable")
+
+def weighted_random_order(system, roster):
+    ## Random permutation where faster users tend to go first
+    ## Exponential keys / speed, sorted ascending: P(first) is proportional to speed (Efraimidis-Spirakis)
+    keys = system.np_rng.standard_exponential(len(roster)) / roster.speed
+    return np.argsort(keys, kind="stable")
+
+def priority_order(system, roster):
+    ## Higher User.priority always goes first, weighted random within each class
+    keys = system.np_rng.standard_exponential(len(roster)) / roster.speed
+    return np.lexsort((keys, -roster.priority))
+
+def front_running_order(system, roster):
+    ## MEV: searchers (User.mev) see the turn and go first, fastest wins the gas war
+    ## Everybody else in weighted random order behind them
+    keys = system.np_rng.standard_exponential(len(roster)) / roster.speed
+    keys[roster.mev] = -roster.speed[roster.mev]
+    return np.argsort(keys, kind="stable")
+
+ORDERINGS = {
+    "speed": order_by_speed,
+    "weighted": weighted_random_order,
+    "priority": priority_order,
+    "front_running": front_running_order,
+}
+DEFAULT_ORDERING = "speed"
+
+
 class Ebtc:
-    def __init__(self, logger):
+    def __init__(self, logger, rng=SEED, ordering=DEFAULT_ORDERING):
         self.MAX_LTV = 15000  ## 150%
-        self.FEE_PER_SECOND = 0  ## No fee for borrows
+        self.FEE_PER_SECOND = 0  ## No fee for borrows, compounded per second e.g. 0.02 / SECONDS_PER_YEAR
         self.ORIGINATION_FEE = 50  ## 50BPS
 
         self.total_deposits = 0
@@ -103,12 +392,124 @@ class Ebtc:
         self.feed = INITIAL_FEED
         self.time = SECONDS_SINCE_DEPLOY
         self.turn = 0
+
+        ## Cumulative interest, 1 debt at deploy is worth interest_index debt now
+        ## Only the index moves each turn, troves realise their interest when touched (see Trove.accrue)
+        self.interest_index = 1.0
+        self.total_interest = 0
         
         self.logger = logger
+        self.rng = make_random(rng)
+        ## NumPy stream for vectorized draws, seeded from rng on first use so one seed drives both
+        ## NOTE: Lazy, so runs that never use it draw exactly what they did before
+        self._np_rng = None
+        self.ordering = ORDERINGS[ordering] if isinstance(ordering, str) else ordering
+        self.roster = None
+
+        ## All trove state lives here, Trove objects are views
+        self.book = TroveBook()
+
+        ## Indexes, kept in sync by Trove open / close
+        ## user.id -> Trove, Trove.id -> Trove
+        self.troves_by_owner = {}
+        self.troves_by_id = {}
+        self.user_count = 0
+
+        ## (debt / index_snapshot / deposits, Trove.id) sorted ascending, riskiest last
+        ## NOTE: The feed and the interest_index multiply every ratio the same way, so neither a price move nor interest changes the order
+        self.troves_by_ratio = []
+
+        ## Optional InvariantChecker, attaches itself
+        self.invariants = None
+
+        ## Optional UniV2Pool the agents trade against, x is collateral, y is debt
+        self.pool = None
 
     def __repr__(self):
         return str(self.__dict__)
 
+    @property
+    def np_rng(self):
+        if self._np_rng is None:
+            self._np_rng = make_rng(self.rng.getrandbits(64))
+        return self._np_rng
+
+    def new_user_id(self):
+        ## NOTE: Names repeat (name_list is short), ids don't
+        self.user_count += 1
+        return self.user_count
+
+    def open_trove(self, trove):
+        ## One trove per user
+        assert trove.owner.id not in self.troves_by_owner
+        self.troves_by_owner[trove.owner.id] = trove
+        self.troves_by_id[trove.id] = trove
+        insort(self.troves_by_ratio, (trove.ratio_key, trove.id))
+
+        if self.invariants is not None:
+            self.invariants.on_open(trove)
+
+    def close_trove(self, trove):
+        del self.troves_by_owner[trove.owner.id]
+        del self.troves_by_id[trove.id]
+        self.remove_ratio_entry(trove)
+
+        if self.invariants is not None:
+            self.invariants.on_close(trove)
+
+    def on_trove_update(self, trove):
+        ## Called by Trove after every deposit / withdraw / borrow / repay
+        self.update_trove_ratio(trove)
+
+        if self.invariants is not None:
+            self.invariants.on_trove_update(trove)
+
+    def remove_ratio_entry(self, trove):
+        entry = (trove.ratio_key, trove.id)
+        index = bisect_left(self.troves_by_ratio, entry)
+        assert self.troves_by_ratio[index] == entry
+        del self.troves_by_ratio[index]
+
+    def update_trove_ratio(self, trove):
+        ## O(log n) search
+        new_key = trove.debt_per_collateral()
+        if new_key == trove.ratio_key:
+            return
+
+        self.remove_ratio_entry(trove)
+        trove.ratio_key = new_key
+        insort(self.troves_by_ratio, (new_key, trove.id))
+
+    def liquidatable_troves(self, price=None):
+        """
+            All troves that are not solvent at price (defaults to the feed), riskiest first
+            Same check as Trove.is_solvent, debt >= deposits * price * MAX_LTV / MAX_BPS
+            NOTE: debt includes the interest the trove has not realised yet
+        """
+        if price is None:
+            price = self.feed
+
+        threshold = price * MAX_LTV / MAX_BPS / self.interest_index
+        start = bisect_left(self.troves_by_ratio, (threshold, ""))
+
+        ## Troves with no debt are always solvent, even at a price of 0
+        while start < len(self.troves_by_ratio) and self.troves_by_ratio[start][0] == 0:
+            start += 1
+
+        return [self.troves_by_id[trove_id] for (_, trove_id) in reversed(self.troves_by_ratio[start:])]
+
+    def riskiest_trove(self):
+        if len(self.troves_by_ratio) == 0:
+            return None
+
+        return self.troves_by_id[self.troves_by_ratio[-1][1]]
+
+    def get_trove(self, owner):
+        return self.troves_by_owner.get(owner.id)
+
+    def get_trove_by_id(self, trove_id):
+        return self.troves_by_id.get(trove_id)
+
     def collateral_ratio(self):
         return self.total_debt * MAX_BPS / self.total_deposits
 
@@ -121,8 +522,13 @@ class Ebtc:
 
     def is_solvent(self):
         ## NOTE: Strictly less to avoid rounding, etc..
+        ## NOTE: Realised debt only, see accrued_total_debt
         return self.total_debt < self.max_borrow()
 
+    def accrued_total_debt(self):
+        ## O(T), includes the interest the troves have not realised yet
+        return self.book.total_accrued_debt(self.interest_index)
+
     def get_feed(self):
         return self.feed
 
@@ -141,19 +547,28 @@ class Ebtc:
         ## NOTE: Logging is done by each actor
         ## NO LOGS IN SYSTEM, only in Trove / User
         
+        self.end_turn()
+
+    def end_turn(self):
         ## Increase counter
         self.next_turn()
 
-        ## End of turn checks
+        ## End of turn checks
         if(not self.is_solvent()):
             print("INSOLVENT")
+
+        if self.invariants is not None:
+            self.invariants.end_turn()
         
     
     def sort_users(self, users):
-        def get_key(user):
-            ## TODO: Swing size (+- to impact randomness, simulate sorting, front-running etc..)
-            return user.speed * random.random()
-        users.sort(key=get_key)
+        ## In place, see ORDERINGS
+        ## TODO: Swing size (+- to impact randomness)
+        if self.roster is None or not self.roster.matches(users):
+            self.roster = Roster(users)
+
+        self.roster.take(self.ordering(self, self.roster))
+        users[:] = self.roster.users.tolist()
     
     def take_actions(self, users, troves):
         ## TODO: Add User Decisions making / given the list of all trove have user do something
@@ -161,77 +576,170 @@ class Ebtc:
             user.take_action(self.turn, troves)
 
     def next_turn(self):
-      self.time += SECONDS_PER_TURN
-      self.turn += 1
+      self.skip_turns(1)
+
+    def skip_turns(self, turns):
+      ## O(1) no matter how many troves or turns, nobody acts in between
+      self.interest_index *= (1 + self.FEE_PER_SECOND) ** (SECONDS_PER_TURN * turns)
+      self.time += SECONDS_PER_TURN * turns
+      self.turn += turns
   
     
 
 
 class Trove:
+    ## View over one row of system.book
+    __slots__ = ("owner", "system", "row", "id", "ratio_key", "actor")
+
     def __init__(self, owner, system):
-        self.deposits = 0
-        self.debt = 0
-        self.last_update_ts = system.time
         self.owner = owner
         self.system = system
-        self.id = str(random.randint(1, 10**24)) ## Although PRGN odds of clash are unlikely
+        self.row = system.book.open(owner.id, system.time, system.interest_index)
+        self.id = str(self.row) ## Unique, rows are never reused
+        self.actor = system.logger.register_actor("Trove" + self.id)
+        self.ratio_key = 0 ## debt / deposits, see Ebtc.troves_by_ratio
+
+        system.open_trove(self)
 
     def __repr__(self):
-        return str(self.__dict__)
+        return str({
+            "id": self.id,
+            "deposits": self.deposits,
+            "debt": self.debt,
+            "last_update_ts": self.last_update_ts,
+            "owner": self.owner.name
+        })
+
+    @property
+    def deposits(self):
+        return self.system.book.deposits[self.row].item()
+
+    @deposits.setter
+    def deposits(self, value):
+        self.system.book.deposits[self.row] = value
+
+    @property
+    def debt(self):
+        return self.system.book.debt[self.row].item()
+
+    @debt.setter
+    def debt(self, value):
+        self.system.book.debt[self.row] = value
+
+    @property
+    def last_update_ts(self):
+        return self.system.book.last_update[self.row].item()
+
+    @last_update_ts.setter
+    def last_update_ts(self, value):
+        self.system.book.last_update[self.row] = value
 
     def local_collateral_ratio(self):
-        return self.debt * MAX_BPS / self.deposits
+        return self.current_debt() * MAX_BPS / self.deposits
+
+    def debt_per_collateral(self):
+        ## Price and interest free, current_ltv == debt_per_collateral * interest_index / feed
+        if self.debt == 0:
+            return 0
+        if self.deposits == 0:
+            return math.inf
+
+        return self.debt / self.system.book.index_snapshot[self.row].item() / self.deposits
+
+    def current_debt(self):
+        ## Debt with the interest since the last touch, without realising it
+        index = self.system.interest_index
+        snapshot = self.system.book.index_snapshot[self.row].item()
+        if self.debt == 0 or snapshot == index:
+            return self.debt
+
+        return self.debt * index / snapshot
+
+    def accrue(self):
+        ## Realise the interest since the last touch, O(1)
+        index = self.system.interest_index
+        snapshot = self.system.book.index_snapshot[self.row].item()
+        if snapshot == index:
+            return 0
+
+        interest = self.current_debt() - self.debt
+        self.system.book.index_snapshot[self.row] = index
+        self.last_update_ts = self.system.time
+
+        if interest == 0:
+            return 0
+
+        self.debt += interest
+        self.system.total_debt += interest
+        self.system.total_interest += interest
+        self.system.on_trove_update(self)
+
+        ## Logging
+        self.system.logger.add_move(self.system.time, self.actor, Label.INTEREST, interest)
+
+        return interest
 
     def deposit(self, amount):
-        ## Internal
+        ## Internal
+        self.accrue()
         assert self.is_solvent()
         self.system.total_deposits += amount
         self.deposits += amount
+        self.system.on_trove_update(self)
 
         ## Caller
         self.owner.spend(self.id, False, amount, "Deposit")
 
         ## Logging
-        self.system.logger.add_move(self.system.time, "Trove" + self.id, "Deposit", amount)
+        self.system.logger.add_move(self.system.time, self.actor, Label.DEPOSIT, amount)
 
     def withdraw(self, amount):
-        ## Internal
+        ## Internal
+        self.accrue()
         self.deposits -= amount
         assert self.is_solvent()
+        self.system.total_deposits -= amount
+        self.system.on_trove_update(self)
         
         ## Caller
         self.owner.receive(self.id, False, amount, "Withdraw")
 
         ## Logging
-        self.system.logger.add_move(self.system.time, "Trove" + self.id, "Withdraw", amount)
+        self.system.logger.add_move(self.system.time, self.actor, Label.WITHDRAW, amount)
 
     def borrow(self, amount):
+        self.accrue()
         self.debt += amount
         assert self.is_solvent()
         self.system.total_debt += amount
         assert self.system.is_solvent()
+        self.system.on_trove_update(self)
 
         self.owner.receive(self.id, True, amount, "Borrow")
 
         ## Logging
-        self.system.logger.add_move(self.system.time, "Trove" + self.id, "Borrow", amount)
+        self.system.logger.add_move(self.system.time, self.actor, Label.BORROW, amount)
 
 
     def repay(self, amount):
+        self.accrue()
         self.debt -= amount
         assert self.is_solvent()
         self.system.total_debt -= amount
         assert self.system.is_solvent()
+        self.system.on_trove_update(self)
 
         self.owner.spend(self.id, True, amount, "Repay")
 
         ## Logging
-        self.system.logger.add_move(self.system.time, "Trove" + self.id, "Repay", amount)
+        self.system.logger.add_move(self.system.time, self.actor, Label.REPAY, amount)
 
     def liquidate(self, amount, caller):
         ## Only if not owner
         if caller == self.owner:
             return False
+
+        self.accrue()
         
         ## TODO: Incorrect / Missing piece / Math
         ## Spend Debt to repay
@@ -240,10 +748,24 @@ class Trove:
         caller.receive(self.id, False, amount, "Liquidate")
 
         ## Logging
-        self.system.logger.add_move(self.system.time, "Trove", "Liquidate", amount)
+        self.system.logger.add_move(self.system.time, self.actor, Label.LIQUIDATE, amount)
 
         return 0
 
+    def close(self):
+        ## Repay first, then we give back the collateral and drop the trove from the indexes
+        self.accrue()
+        assert self.debt == 0
+
+        if self.deposits > 0:
+            self.withdraw(self.deposits)
+
+        self.system.close_trove(self)
+        self.system.book.close(self.row)
+
+        ## Logging
+        self.system.logger.add_move(self.system.time, self.actor, Label.CLOSE, 0)
+
     ## SECURITY CHECKS
     def is_trove(self):
         return True
@@ -252,25 +774,32 @@ class Trove:
         return self.deposits * self.system.feed * MAX_LTV / MAX_BPS
 
     def is_solvent(self):
-        if self.debt == 0:
+        debt = self.current_debt()
+        if debt == 0:
             return True
-        ## Strictly less to avoid rounding or w/e
-        return self.debt < self.max_borrow()
+        ## Strictly less to avoid rounding or w/e
+        return debt < self.max_borrow()
     
     def current_ltv(self):
         if self.deposits == 0 or self.system.feed == 0:
             return 0
         
-        return self.debt / (self.deposits * self.system.feed)
+        return self.current_debt() / (self.deposits * self.system.feed)
 
 
 class User:
+    ## See priority_order / front_running_order
+    priority = 0
+    mev = False
+
     def __init__(self, system, initial_balance_collateral):
         self.system = system
         self.collateral = initial_balance_collateral
         self.debt = 0
-        self.name = random.choice(name_list)
-        self.speed = math.floor(random.random() * SPEED_RANGE) + 1
+        self.id = system.new_user_id()
+        self.name = system.rng.choice(name_list)
+        self.speed = math.floor(system.rng.random() * SPEED_RANGE) + 1
+        self.actor = system.logger.register_actor("User" + self.name)
 
     def __repr__(self):
         return str(self.__dict__)
@@ -280,14 +809,14 @@ class User:
             self.debt -= amount
 
             ## Logging
-            self.system.logger.add_move(self.system.time, "User" + self.name, "Spent Debt", amount)
+            self.system.logger.add_move(self.system.time, self.actor, Label.SPENT_DEBT, amount)
 
         
         else:
             self.collateral -= amount
 
             ## Logging
-            self.system.logger.add_move(self.system.time, "User" + self.name, "Spent Collateral", amount)
+            self.system.logger.add_move(self.system.time, self.actor, Label.SPENT_COLLATERAL, amount)
         
 
     
@@ -296,15 +825,22 @@ class User:
             self.debt += amount
 
             ## Logging
-            self.system.logger.add_move(self.system.time, "User" + self.name, "Receive Debt", amount)
+            self.system.logger.add_move(self.system.time, self.actor, Label.RECEIVE_DEBT, amount)
 
         
         else:
             self.collateral += amount
 
             ## Logging
-            self.system.logger.add_move(self.system.time, "User" + self.name, "Receive Collateral", amount)
+            self.system.logger.add_move(self.system.time, self.actor, Label.RECEIVE_COLLATERAL, amount)
+
 
+    def swap(self, pool, is_x, amount_in):
+        ## is_x -> pay collateral, receive debt
+        amount_out = pool.swap(is_x, amount_in)
+        self.spend(pool, not is_x, amount_in, "Swap")
+        self.receive(pool, is_x, amount_out, "Swap")
+        return amount_out
 
     def get_debt(self):
         return self.debt
@@ -312,20 +848,40 @@ class User:
     def get_balance(self):
         return self.collateral
 
+    def schedule(self, scheduler):
+        ## When to wake up next, by default every turn
+        scheduler.wake_in(self, SECONDS_PER_TURN)
+
     def take_action(self, turn, troves):
         print("User" , self.name, " Taking Action")
         print("turn ", turn)
 
-        self.system.logger.add_move(self.system.time, "User" + self.name, "Balance of Collateral", self.collateral)
-        self.system.logger.add_move(self.system.time, "User" + self.name, "Balance of Debt", self.debt)
+        self.system.logger.add_move(self.system.time, self.actor, Label.BALANCE_OF_COLLATERAL, self.collateral)
+        self.system.logger.add_move(self.system.time, self.actor, Label.BALANCE_OF_DEBT, self.debt)
 
 
 ## POOL For Swap
 
-## NOTE: For UniV3 we can use Solidly Math
+## NOTE: For UniV3 see lib/amm/concentrated.py (ConcentratedPool), or use Solidly Math
 ## Or alternatively just use infinite leverage at price point + .50% price impact
 
+## UniV2 fee, 0.3% of amount in, as a ratio it's lib.amm.UNIV2_FEE
+FEE_NUMERATOR = 997
+FEE_DENOMINATOR = 1000
+
+## swap_many vectorizes runs of same direction swaps when they are this long on average
+MIN_RUN_LENGTH = 32
+
+def is_integer_amount(value):
+  return isinstance(value, (int, np.integer)) and not isinstance(value, bool)
+
 class UniV2Pool():
+  """
+    Constant product pool, x * y = k with the 0.3% fee on the way in
+
+    Integer reserves -> exact UniV2 math (floor division, +1 on get_amount_in), swaps run one by one
+    Float reserves -> swap_many applies each run of same direction swaps with cumsum / cumprod
+  """
   def __init__(self, start_x, start_y, start_lp):
     ## NOTE: May or may not want to have a function to hardcode this
     self.reserve_x = start_x
@@ -333,7 +889,11 @@ class UniV2Pool():
     self.total_supply = start_lp
 
   def k(self):
-    return self.x * self.y
+    return self.reserve_x * self.reserve_y
+
+  def price_x(self):
+    ## Spot, y per x
+    return self.reserve_y / self.reserve_x
   
   def get_price_out(self, is_x, amount):
     if (is_x):
@@ -342,21 +902,112 @@ class UniV2Pool():
       return self.get_price(amount, self.reserve_y, self.reserve_x)
 
   ## UniV2 Formula, can extend the class and change this to create new pools
+  @staticmethod
   def get_price(amount_in, reserve_in, reserve_out):
-      amountInWithFee = amount_in * 997
+      amountInWithFee = amount_in * FEE_NUMERATOR
       numerator = amountInWithFee * reserve_out
-      denominator = reserve_in * 1000 + amountInWithFee
+      denominator = reserve_in * FEE_DENOMINATOR + amountInWithFee
+
+      if is_integer_amount(numerator) and is_integer_amount(denominator):
+        return numerator // denominator
+
       amountOut = numerator / denominator
 
       return amountOut
-  
-  def withdraw_lp():
-    ## TODO
-    return False
-  
-  def lp():
-    ## TODO
-    return False
+
+  @staticmethod
+  def get_amount_out(amount_in, reserve_in, reserve_out):
+    return UniV2Pool.get_price(amount_in, reserve_in, reserve_out)
+
+  @staticmethod
+  def get_amount_in(amount_out, reserve_in, reserve_out):
+    ## Min amount_in to receive amount_out
+    assert amount_out < reserve_out
+    numerator = reserve_in * amount_out * FEE_DENOMINATOR
+    denominator = (reserve_out - amount_out) * FEE_NUMERATOR
+
+    if is_integer_amount(numerator) and is_integer_amount(denominator):
+      return numerator // denominator + 1
+
+    return numerator / denominator
+
+  def swap(self, is_x, amount_in):
+    ## is_x -> we pay x and receive y
+    if is_x:
+      amount_out = self.get_amount_out(amount_in, self.reserve_x, self.reserve_y)
+      self.reserve_x += amount_in
+      self.reserve_y -= amount_out
+    else:
+      amount_out = self.get_amount_out(amount_in, self.reserve_y, self.reserve_x)
+      self.reserve_y += amount_in
+      self.reserve_x -= amount_out
+
+    return amount_out
+
+  def swap_many(self, is_x, amounts_in):
+    """
+      A block of swaps, applied in order, returns the amount out of each as an ndarray (object dtype on integer reserves)
+      is_x can be a bool (all the same direction) or one bool per swap
+    """
+    amounts_in = np.asarray(amounts_in)
+    is_x = np.broadcast_to(np.asarray(is_x, dtype=bool), amounts_in.shape)
+    assert (amounts_in >= 0).all()
+
+    if is_integer_amount(self.reserve_x) and is_integer_amount(self.reserve_y):
+      ## Exact, python ints can't go through cumprod, kept as ints in an object array
+      return np.array([self.swap(direction, amount) for (direction, amount) in zip(is_x.tolist(), amounts_in.tolist())], dtype=object)
+
+    ## One vectorized step per run of swaps in the same direction
+    boundaries = np.flatnonzero(np.diff(is_x)) + 1
+
+    ## Mostly alternating, numpy overhead per run is worse than the plain loop
+    if len(amounts_in) < MIN_RUN_LENGTH * (len(boundaries) + 1):
+      return np.array([self.swap(direction, amount) for (direction, amount) in zip(is_x.tolist(), amounts_in.astype(np.float64).tolist())])
+
+    amounts_in = amounts_in.astype(np.float64)
+    amounts_out = np.empty_like(amounts_in)
+    for (start, end) in zip(np.r_[0, boundaries], np.r_[boundaries, len(amounts_in)]):
+      if is_x[start]:
+        (self.reserve_x, self.reserve_y) = self.swap_run(amounts_in[start:end], self.reserve_x, self.reserve_y, amounts_out[start:end])
+      else:
+        (self.reserve_y, self.reserve_x) = self.swap_run(amounts_in[start:end], self.reserve_y, self.reserve_x, amounts_out[start:end])
+
+    return amounts_out
+
+  @staticmethod
+  def swap_run(amounts_in, reserve_in, reserve_out, out):
+    ## Each swap keeps reserve_out * FEE_DENOMINATOR * reserve_in / (FEE_DENOMINATOR * reserve_in + FEE_NUMERATOR * amount_in)
+    reserves_in = reserve_in + np.cumsum(amounts_in) - amounts_in
+    denominators = FEE_DENOMINATOR * reserves_in + FEE_NUMERATOR * amounts_in
+    reserves_out = reserve_out * np.cumprod(FEE_DENOMINATOR * reserves_in / denominators)
+
+    ## out = reserve_out before the swap * FEE_NUMERATOR * amount_in / denominator (no cancellation)
+    reserves_before = np.r_[reserve_out, reserves_out[:-1]]
+    out[:] = reserves_before * FEE_NUMERATOR * amounts_in / denominators
+    return (float(reserve_in + amounts_in.sum()), float(reserves_out[-1]))
+
+  def lp(self, amount_x, amount_y):
+    ## Mint, both amounts go in, LP tokens on the smaller side (same as UniV2)
+    if self.total_supply == 0:
+      minted = math.sqrt(amount_x * amount_y)
+    else:
+      minted = min(amount_x * self.total_supply / self.reserve_x, amount_y * self.total_supply / self.reserve_y)
+
+    self.reserve_x += amount_x
+    self.reserve_y += amount_y
+    self.total_supply += minted
+    return minted
+
+  def withdraw_lp(self, liquidity):
+    ## Burn, pro-rata share of both reserves
+    assert liquidity <= self.total_supply
+    amount_x = liquidity * self.reserve_x / self.total_supply
+    amount_y = liquidity * self.reserve_y / self.total_supply
+
+    self.reserve_x -= amount_x
+    self.reserve_y -= amount_y
+    self.total_supply -= liquidity
+    return (amount_x, amount_y)
   
 
 ## TODO: Add Roles ##
@@ -371,22 +1022,27 @@ class Borrower(User):
         self.system = system
         self.debt = 0
         self.collateral = initial_balance_collateral
-        self.name = random.choice(name_list)
-        self.speed = math.floor(random.random() * SPEED_RANGE) + 1
-        self.target_ltv = random.random() * MAX_LTV
+        self.id = system.new_user_id()
+        self.name = system.rng.choice(name_list)
+        self.speed = math.floor(system.rng.random() * SPEED_RANGE) + 1
+        self.actor = system.logger.register_actor("User" + self.name)
+        self.target_ltv = system.rng.random() * MAX_LTV
     
     def take_action(self, turn, troves):
         ## Deposit entire balance
         trove = self.find_trove(troves)
 
+        if(trove is None):
+            print("Cannot find trove PROBLEM")
+            assert False
+
+        ## Touching the trove, realise the interest before we look at the debt
+        trove.accrue()
+
         ## TODO: If insolvent we should do something, perhaps try to redeem as much as possible
         if not trove.is_solvent():
             print("Trove is insolvent, we run away with the money")
-            return ## Just revert
-
-        if(trove == False):
-            print("Cannot find trove PROBLEM")
-            assert False
+            return ## Just revert
         
         ## if has collateral spend it
         if(self.collateral > 0):
@@ -400,7 +1056,7 @@ class Borrower(User):
         target_borrow = trove.max_borrow() * self.target_ltv / MAX_BPS
 
         ## If below target, borrow
-        if(trove.debt < target_borrow):
+        if(trove.debt < target_borrow * (1 - BORROW_TOLERANCE)):
             print("We are below target ltv, borrow")
             ## Borrow until we get to ltv
             ## TODO: check math math
@@ -418,33 +1074,250 @@ class Borrower(User):
         
     
     def find_trove(self, troves):
-        for trove in troves:
-            if trove.owner.name == self.name:
-                return trove
+        ## O(1), troves is unused but kept so agents share the take_action signature
+        return self.system.get_trove(self)
 
-        return False
+    def schedule(self, scheduler):
+        trove = self.system.get_trove(self)
+
+        ## Ran away or nothing to borrow against, we're done
+        if trove is None or not trove.is_solvent() or trove.deposits == 0 or self.target_ltv == 0:
+            return
+
+        ## We only act again once target_borrow > debt, which only happens if the price goes up
+        ## NOTE: Ignores the interest to come, so we may wake a bit early and go back to sleep
+        price = trove.current_debt() * MAX_BPS * MAX_BPS / (trove.deposits * MAX_LTV * self.target_ltv * (1 - BORROW_TOLERANCE))
+        scheduler.wake_when_price_above(self, price)
 
 
 ## Borrow and Sells when price is higher
+## Debt token is expensive in the pool (collateral cheap): borrow, buy collateral, deposit it back
 class LongArbitrager(User):
+    mev = True
+
     def take_action(self, turn, troves):
-        pass
+        pool = self.system.pool
+        trove = self.system.get_trove(self)
+        if pool is None or trove is None:
+            return
+
+        ## O(1), see lib/arbitrage.py
+        amount = float(optimal_buy_x(pool.reserve_x, pool.reserve_y, self.system.feed, UNIV2_FEE))
+
+        ## Can't borrow past our own max
+        trove.accrue()
+        amount = min(amount, trove.max_borrow() * (1 - BORROW_TOLERANCE) - trove.debt)
+        if amount <= 0:
+            return
+
+        trove.borrow(amount)
+        self.swap(pool, False, amount)
+        trove.deposit(self.collateral)
 
 
 ## Buys when cheap and sells when higher
+## Debt token is cheap in the pool: sell collateral for it and repay our debt
 class ShortArbitrager(User):
-   def take_action(self, turn, troves):
-        pass
+    mev = True
+
+    def take_action(self, turn, troves):
+        pool = self.system.pool
+        if pool is None:
+            return
+
+        amount = min(float(optimal_sell_x(pool.reserve_x, pool.reserve_y, self.system.feed, UNIV2_FEE)), self.collateral)
+        if amount <= 0:
+            return
+
+        self.swap(pool, True, amount)
+
+        trove = self.system.get_trove(self)
+        if trove is not None:
+            trove.accrue()
+            repay = min(self.debt, trove.debt)
+            if repay > 0:
+                trove.repay(repay)
 
 
 ## Does both arbitrages
+## Wallet only, trades whichever side is mispriced with what it holds
 class Trader(User):
+    mev = True
+
     def take_action(self, turn, troves):
-        pass
+        pool = self.system.pool
+        if pool is None:
+            return
 
+        (is_x, amount, _) = optimal_arbitrage(pool.reserve_x, pool.reserve_y, self.system.feed, UNIV2_FEE)
+        is_x = bool(is_x)
+        amount = min(float(amount), self.collateral if is_x else self.debt)
+        if amount <= 0:
+            return
 
-def invariant_tests():
-    ## TODO: Please fill these in
+        self.swap(pool, is_x, amount)
+
+
+class Scheduler:
+    """
+        Event driven alternative to calling Ebtc.take_turn every block
+
+        Users ask to be woken up (User.schedule, called after each of their actions):
+        - At a time (wake_at / wake_in)
+        - When the feed goes below / above a price (wake_when_price_below / wake_when_price_above)
+        - When a trove's LTV goes above a value (wake_when_ltv_above, turned into a price)
+
+        run() jumps straight to the next block with something to do, blocks in between are skipped in O(1)
+        So the cost is proportional to the number of actions, not the number of blocks
+
+        Price moves come from set_price (now) or schedule_price (at a future time)
+        NOTE: A user sleeping on a price only wakes when the price moves through set_price / schedule_price
+    """
+    def __init__(self, system):
+        self.system = system
+        self.seq = 0
+
+        ## Heaps of (time, seq, ...)
+        self.timers = []
+        self.prices = []
+
+        ## Sorted (price, seq, user, generation)
+        self.price_below = []
+        self.price_above = []
+
+        ## user.id -> generation, a wake up cancels the other wake ups of the same user
+        self.generation = {}
+        self.due = {}
+
+        self.actions = 0
+        self.blocks = 0
+
+    def next_seq(self):
+        self.seq += 1
+        return self.seq
+
+    ## Registration
+    def wake_at(self, user, time):
+        heapq.heappush(self.timers, (time, self.next_seq(), user, self.generation.get(user.id, 0)))
+
+    def wake_in(self, user, seconds):
+        self.wake_at(user, self.system.time + seconds)
+
+    def wake_when_price_below(self, user, price):
+        if self.system.feed < price:
+            return self.wake_in(user, SECONDS_PER_TURN)
+        insort(self.price_below, (price, self.next_seq(), user, self.generation.get(user.id, 0)))
+
+    def wake_when_price_above(self, user, price):
+        if self.system.feed > price:
+            return self.wake_in(user, SECONDS_PER_TURN)
+        insort(self.price_above, (price, self.next_seq(), user, self.generation.get(user.id, 0)))
+
+    def wake_when_ltv_above(self, user, trove, ltv):
+        ## current_ltv = debt / (deposits * feed) > ltv <=> feed < debt / (deposits * ltv)
+        if trove.deposits == 0 or ltv == 0:
+            return self.wake_in(user, SECONDS_PER_TURN)
+        self.wake_when_price_below(user, trove.current_debt() / (trove.deposits * ltv))
+
+    def schedule_price(self, time, price):
+        heapq.heappush(self.prices, (time, self.next_seq(), price))
+
+    def schedule_price_path(self, path, interval=SECONDS_PER_TURN, start=None):
+        ## path[i] becomes the feed at start + (i + 1) * interval, see lib/price_paths.py
+        start = self.system.time if start is None else start
+        for (i, price) in enumerate(iterate(path)):
+            self.schedule_price(start + (i + 1) * interval, price)
+
+    ## Triggers
+    def wake(self, user, generation):
+        ## Stale entry, the user already woke up for something else
+        if generation != self.generation.get(user.id, 0):
+            return
+        self.due[user.id] = user
+
+    def set_price(self, price):
+        self.system.set_feed(price)
+
+        ## Strictly below, price_below is ascending so it's the tail
+        start = bisect_right(self.price_below, (price, math.inf))
+        for (_, _, user, generation) in self.price_below[start:]:
+            self.wake(user, generation)
+        del self.price_below[start:]
+
+        ## Strictly above, the head
+        end = bisect_left(self.price_above, (price, -math.inf))
+        for (_, _, user, generation) in self.price_above[:end]:
+            self.wake(user, generation)
+        del self.price_above[:end]
+
+    def next_event_time(self):
+        ## Woken by a set_price outside of run
+        if len(self.due) > 0:
+            return self.system.time
+
+        times = [events[0][0] for events in [self.timers, self.prices] if len(events) > 0]
+        if len(times) == 0:
+            return None
+        return min(times)
+
+    def skip_to(self, time):
+        ## To the first block at or after time
+        if time > self.system.time:
+            self.system.skip_turns(math.ceil((time - self.system.time) / SECONDS_PER_TURN))
+
+    def run(self, users, troves, until):
+        """
+            Every user acts at the current block, then only when they asked to
+            Stops at the first block after until
+        """
+        for user in users:
+            self.wake_at(user, self.system.time)
+
+        while True:
+            next_time = self.next_event_time()
+            if next_time is None or next_time > until:
+                break
+
+            self.skip_to(next_time)
+            self.take_turn(troves)
+
+        self.skip_to(until)
+
+    def take_turn(self, troves):
+        system = self.system
+
+        while len(self.prices) > 0 and self.prices[0][0] <= system.time:
+            (_, _, price) = heapq.heappop(self.prices)
+            self.set_price(price)
+
+        while len(self.timers) > 0 and self.timers[0][0] <= system.time:
+            (_, _, user, generation) = heapq.heappop(self.timers)
+            self.wake(user, generation)
+
+        users = list(self.due.values())
+        self.due = {}
+        if len(users) > 0:
+            for user in users:
+                self.generation[user.id] = self.generation.get(user.id, 0) + 1
+
+            system.sort_users(users)
+            for user in users:
+                user.take_action(system.turn, troves)
+                user.schedule(self)
+            self.actions += len(users)
+
+        self.blocks += 1
+        system.end_turn()
+
+
+## Full re-sum of every trove every AUDIT_EVERY turns
+AUDIT_EVERY = 100
+INVARIANT_TOLERANCE = 1e-9
+
+class InvariantError(AssertionError):
+    pass
+
+class InvariantChecker:
     """
         If I have X troves, then total debt is sum of each trove debt
 
@@ -455,27 +1328,129 @@ def invariant_tests():
         LTV is weighted average of each LTV = Sum LTV / $%
 
         If I take a turn, X seconds pass
-    """
 
-def main():
+        We keep our own running sums, updated from each trove's row (not from the system totals)
+        so end_turn checks them against the system in O(1)
+        Every audit_every turns we re-sum the TroveBook to catch drift in the running sums themselves
+
+        strict -> check after every trove mutation and raise InvariantError at the first break
+        Otherwise violations are collected in self.violations
+    """
+    def __init__(self, system, audit_every=AUDIT_EVERY, strict=False):
+        self.system = system
+        self.audit_every = audit_every
+        self.strict = strict
+        self.violations = []
+
+        ## Last seen (deposits, debt) per trove, so each update is a delta
+        self.seen = {trove.id: (trove.deposits, trove.debt) for trove in system.troves_by_id.values()}
+        self.sum_deposits = sum(deposits for (deposits, _) in self.seen.values())
+        self.sum_debt = sum(debt for (_, debt) in self.seen.values())
+
+        self.start_time = system.time - system.turn * SECONDS_PER_TURN
+        self.last_audit = system.turn
+        system.invariants = self
+
+    def on_open(self, trove):
+        self.seen[trove.id] = (0, 0)
+
+    def on_close(self, trove):
+        deposits, debt = self.seen.pop(trove.id)
+        self.sum_deposits -= deposits
+        self.sum_debt -= debt
+
+        if self.strict:
+            self.check()
+
+    def on_trove_update(self, trove):
+        old_deposits, old_debt = self.seen[trove.id]
+        deposits = trove.deposits
+        debt = trove.debt
+        self.seen[trove.id] = (deposits, debt)
+        self.sum_deposits += deposits - old_deposits
+        self.sum_debt += debt - old_debt
+
+        if self.strict:
+            self.expect("trove deposits >= 0", deposits >= 0, deposits, 0)
+            self.expect("trove debt >= 0", debt >= 0, debt, 0)
+            self.check()
+
+    def end_turn(self):
+        self.check()
+
+        ## If I take a turn, X seconds pass
+        expected_time = self.start_time + self.system.turn * SECONDS_PER_TURN
+        self.expect("time", self.system.time == expected_time, self.system.time, expected_time)
+
+        ## NOTE: Not turn % audit_every, the Scheduler skips turns
+        if self.audit_every and self.system.turn - self.last_audit >= self.audit_every:
+            self.audit()
+
+    def check(self):
+        ## O(1)
+        system = self.system
+        self.expect_close("total_deposits", system.total_deposits, self.sum_deposits)
+        self.expect_close("total_debt", system.total_debt, self.sum_debt)
+
+        ## Max_borrow is sum of max borrowed
+        trove_max_borrow = self.sum_deposits * system.feed * MAX_LTV / MAX_BPS
+        self.expect_close("max_borrow", system.max_borrow(), trove_max_borrow)
+
+        troves = len(self.seen)
+        self.expect("troves_by_owner", len(system.troves_by_owner) == troves, len(system.troves_by_owner), troves)
+        self.expect("troves_by_ratio", len(system.troves_by_ratio) == troves, len(system.troves_by_ratio), troves)
+
+    def audit(self):
+        ## O(T), re-sum everything from the TroveBook
+        book = self.system.book
+        deposits = float(book.total_deposits())
+        debt = float(book.total_debt())
+        self.expect_close("audit deposits", deposits, self.sum_deposits)
+        self.expect_close("audit debt", debt, self.sum_debt)
+        self.expect("audit open troves", book.open_count() == len(self.seen), book.open_count(), len(self.seen))
+        self.expect("audit ratio order", self.system.troves_by_ratio == sorted(self.system.troves_by_ratio), False, True)
+
+        ## Reset the running sums so float drift can't accumulate
+        self.sum_deposits = deposits
+        self.sum_debt = debt
+        self.last_audit = self.system.turn
+
+    def expect_close(self, name, got, expected):
+        ## Sums in a different order, allow for float rounding
+        self.expect(name, math.isclose(got, expected, rel_tol=INVARIANT_TOLERANCE, abs_tol=INVARIANT_TOLERANCE), got, expected)
+
+    def expect(self, name, ok, got, expected):
+        if ok:
+            return
+
+        violation = (self.system.turn, name, got, expected)
+        if self.strict:
+            raise InvariantError(violation)
+
+        print("INVARIANT BROKEN", violation)
+        self.violations.append(violation)
+
+def main(seed=SEED, sink=None):
     # init the system
-    logger = Logger()
-    system = Ebtc(logger)
+    ## e.g. main(sink=make_sink()) from scripts.loggers.cdp_event_sink to stream the moves to disk
+    logger = Logger(sink=sink)
+    system = Ebtc(logger, seed)
+    InvariantChecker(system, strict=True)
 
     # init a user with a balance of 100
     user_1 = Borrower(system, 100)
 
     # init a trove for this user
     trove_1 = Trove(user_1, system)
-    pprint(trove_1.__dict__)
+    pprint(trove_1)
 
     # make a deposit into the system
     trove_1.deposit(25)
-    pprint(trove_1.__dict__)
+    pprint(trove_1)
 
     # borrow against this deposit
     trove_1.borrow(12.5)
-    pprint(trove_1.__dict__)
+    pprint(trove_1)
 
     assert system.time == 0
 
@@ -528,3 +1503,4 @@ def main():
     assert not trove_1.is_solvent()
 
     pprint(logger)
+    logger.close()
@@ -0,0 +1,117 @@
+import numpy as np
+
+from scripts.drawdown_sim import MAX_BPS, MAX_LTV, LIQUIDATION_THRESHOLD, INSOLVENCY_THRESHOLD, GIVE_IN, DRAWDOWN_MAX
+
+"""
+  Solver for drawdown_sim
+
+  Instead of walking the drawdown 1 BPS at a time, solve for the first drawdown (in BPS) that breaks a threshold
+  All params broadcast, so a whole (MAX_LTV, LIQUIDATION_THRESHOLD) surface is one call
+
+  Math (same as drawdown_sim.sim):
+    max_ltv = given_in / MAX_LTV * MAX_BPS
+    new_ratio = given_in * (1 - drawdown / MAX_BPS) / max_ltv * MAX_BPS
+              = (1 - drawdown / MAX_BPS) * MAX_LTV
+
+  So new_ratio < threshold <=> drawdown > MAX_BPS * (1 - threshold / MAX_LTV)
+  NOTE: given_in cancels out, we still take it to mirror the sim
+
+  For non-linear variants (fees, curves, etc..) use bisect_first_breach with your own ratio function
+  It only needs the ratio to be decreasing in the drawdown
+"""
+
+## Returned when we never break the threshold between 1 and DRAWDOWN_MAX
+NO_BREACH = -1
+
+
+def ratio_after_drawdown(drawdown_value, max_ltv=MAX_LTV, given_in=GIVE_IN):
+  ## Vectorized drawdown_sim.sim, without the prints
+  max_debt = given_in / max_ltv * MAX_BPS
+  drawdown = given_in * drawdown_value / MAX_BPS
+  new_in = given_in - drawdown
+  return new_in / max_debt * MAX_BPS
+
+
+def first_breach(max_ltv=MAX_LTV, threshold=INSOLVENCY_THRESHOLD, given_in=GIVE_IN):
+  """
+    First integer drawdown (BPS) where ratio_after_drawdown < threshold
+    Same answer as the linear scan in drawdown_sim.main, NO_BREACH if it never happens
+  """
+  max_ltv, threshold, given_in = np.broadcast_arrays(
+    np.asarray(max_ltv, dtype=np.float64),
+    np.asarray(threshold, dtype=np.float64),
+    np.asarray(given_in, dtype=np.float64)
+  )
+
+  ## Closed form, then 1 step of correction as the scan compares floats
+  candidate = np.floor(MAX_BPS * (1 - threshold / max_ltv)) + 1
+  candidate = np.clip(candidate, 1, DRAWDOWN_MAX)
+
+  too_low = ratio_after_drawdown(candidate, max_ltv, given_in) >= threshold
+  candidate = np.where(too_low, candidate + 1, candidate)
+
+  too_high = (candidate > 1) & (ratio_after_drawdown(candidate - 1, max_ltv, given_in) < threshold)
+  candidate = np.where(too_high, candidate - 1, candidate)
+
+  return np.where(candidate < DRAWDOWN_MAX, candidate, NO_BREACH).astype(np.int64)
+
+
+def bisect_first_breach(ratio_fn, threshold, low=1, high=DRAWDOWN_MAX, **params):
+  """
+    Fallback for ratio functions without a closed form
+    ratio_fn(drawdown_value, **params) must broadcast and be decreasing in drawdown_value
+    Returns the first integer drawdown in [low, high) where ratio_fn < threshold, NO_BREACH otherwise
+    O(log(high - low)) vectorized calls
+  """
+  shape = np.broadcast_shapes(np.shape(threshold), *[np.shape(value) for value in params.values()])
+  lo = np.full(shape, low, dtype=np.int64)
+  hi = np.full(shape, high, dtype=np.int64)
+
+  ## Invariant: no breach below lo, breach at hi (or hi == high)
+  while np.any(lo < hi):
+    active = lo < hi
+    mid = (lo + hi) // 2
+    breached = ratio_fn(mid, **params) < threshold
+    hi = np.where(active & breached, mid, hi)
+    lo = np.where(active & ~breached, mid + 1, lo)
+
+  return np.where(lo < high, lo, NO_BREACH)
+
+
+def solve(max_ltv=MAX_LTV, liquidation_threshold=LIQUIDATION_THRESHOLD, given_in=GIVE_IN):
+  """
+    First drawdown at which we can liquidate, and first drawdown at which we're insolvent
+    The window in between is how much the price can move while liquidators can still save us
+  """
+  first_liquidation = first_breach(max_ltv, liquidation_threshold, given_in)
+  first_insolvency = first_breach(max_ltv, INSOLVENCY_THRESHOLD, given_in)
+
+  return {
+    "first_liquidation": first_liquidation,
+    "first_insolvency": first_insolvency,
+    "liquidation_window": np.where(
+      (first_liquidation != NO_BREACH) & (first_insolvency != NO_BREACH),
+      first_insolvency - first_liquidation,
+      NO_BREACH
+    ),
+  }
+
+
+def main():
+  print("First Insolvency at", first_breach())
+
+  ## Surface of MAX_LTV x LIQUIDATION_THRESHOLD, 1 x 10 BPS resolution
+  max_ltv = np.arange(10_001, 30_001)[:, None]
+  liquidation_threshold = np.arange(10_001, 15_001, 10)[None, :]
+  surface = solve(max_ltv, liquidation_threshold)
+
+  print("Surface shape", surface["first_liquidation"].shape)
+  print("Default Setting", solve())
+
+  ## Sanity check against the bisection
+  bisected = bisect_first_breach(ratio_after_drawdown, INSOLVENCY_THRESHOLD, max_ltv=max_ltv[:, 0])
+  assert (bisected == surface["first_insolvency"][:, 0]).all()
+
+
+if __name__ == '__main__':
+  main()
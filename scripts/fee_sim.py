@@ -29,15 +29,16 @@
 
 
 """
-import csv
 import os
 import time
-from random import random
 
 import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
 import seaborn as sns
 
+from lib.rng import make_rng
+
 sns.set_style('whitegrid')
 plt.rcParams['figure.figsize'] = 15, 30
 
@@ -65,8 +66,13 @@ MAX_STEPS = 10_000
 # 1k eth
 MAX_INITIAL_COLLAT = 1_000
 
-#  Slow down the Terminal so you can read it
-ROLEPLAY = False
+## Verbosity levels
+QUIET = 0  ## Nothing, for sweeps
+SUMMARY = 1  ## Setup and end of run summary
+PER_TURN = 2  ## Every turn
+ROLEPLAY = 3  ## Every turn, slow down the Terminal so you can read it
+
+VERBOSITY = PER_TURN
 
 ## 1 / 7 chance of someone levering to the max
 YOLO_DENOM = 7
@@ -74,109 +80,37 @@ YOLO_DENOM = 7
 ## 1 / 1 chance of a favourable price
 REDEMPTION_DENOM = 1
 
-# Output to CSV and PNG
-TO_CSV = not ROLEPLAY
-
 ## TODO: Create settings for Multiple Loop for Brute Force Sim
 SETTING_LTV_MIN = 0
 
 ## 120 CR = 1/120 * 100 = 8_333 BPS
 SETTING_LTV_MAX = 8_333
 
+## Uniform draws per path, SETUP_DRAWS once then TURN_DRAWS every turn
+## NOTE: We draw the whole block even for branches we don't take
+## So the batched engine (scripts/fee_sim_batch.py) can replay the same path from the same seed
+SETUP_DRAWS = 4
+TURN_DRAWS = 7
+
+## Index of each draw in the turn block
+DRAW_REDEMPTION = 0
+DRAW_AMM_DISCOUNT = 1
+DRAW_AMM_DISCOUNT_SIZE = 2
+DRAW_YOLO = 3
+DRAW_YOLO_COLLATERAL = 4
+DRAW_PRICE_DIRECTION = 5
+DRAW_SWING = 6
+
 ## END Goal -> 100 runs of 10_000 steps for each sim
 ## Each sim goes from XYZ to ZYX with a TODO: Step size
 
-class CsvEntry():
-    def __init__(
-            self,
-            time,
-            system_collateral,
-            system_price,
-            target_LTV,
-            target_debt,
-            system_debt,
-            liquidator_fees_paid,
-            liquidator_profit,
-            swap_collateral_fees,
-            swap_stable_fees,
-            at_risk_debt,
-            at_risk_collateral,
-            current_cr,
-            current_at_risk_cr,
-            underwater_debt,
-            underwater_collateral,
-            global_liquidation_count,
-            global_is_insolvent,
-            global_purges_count,
-
-            AMM_DISCOUNT,
-            AMM_DISCOUNT_SIZE,
-            total_debt_redeemed,
-            total_collateral_redeemed,
-            total_number_of_redemptions,
-            total_profit_from_redemptions
-    ):
-        self.time = time
-        self.system_collateral = system_collateral
-        self.system_price = system_price
-        self.target_LTV = target_LTV
-        self.target_debt = target_debt
-        self.system_debt = system_debt
-        self.liquidator_fees_paid = liquidator_fees_paid
-        self.liquidator_profit = liquidator_profit
-        self.swap_collateral_fees = swap_collateral_fees
-        self.swap_stable_fees = swap_stable_fees
-        self.at_risk_debt = at_risk_debt
-        self.at_risk_collateral = at_risk_collateral
-        self.current_cr = current_cr
-        self.current_at_risk_cr = current_at_risk_cr
-        self.underwater_debt = underwater_debt
-        self.underwater_collateral = underwater_collateral
-        self.global_liquidation_count = global_liquidation_count
-        self.global_is_insolvent = global_is_insolvent
-        self.global_purges_count = global_purges_count
-        self.AMM_DISCOUNT = AMM_DISCOUNT
-        self.AMM_DISCOUNT_SIZE = AMM_DISCOUNT_SIZE
-        self.total_debt_redeemed = total_debt_redeemed
-        self.total_collateral_redeemed = total_collateral_redeemed
-        self.total_number_of_redemptions = total_number_of_redemptions
-        self.total_profit_from_redemptions = total_profit_from_redemptions
-
-    def __repr__(self):
-        return str(self.__dict__)
-
-    def to_entry(self):
-        return [
-            self.time,
-            self.system_collateral,
-            self.system_price,
-            self.target_LTV,
-            self.target_debt,
-            self.system_debt,
-            self.liquidator_fees_paid,
-            self.liquidator_profit,
-            self.swap_collateral_fees,
-            self.swap_stable_fees,
-            self.at_risk_debt,
-            self.at_risk_collateral,
-            self.current_cr,
-            self.current_at_risk_cr,
-            self.global_liquidation_count,
-            self.global_is_insolvent,
-            self.global_purges_count,
-
-            self.AMM_DISCOUNT,
-            self.AMM_DISCOUNT_SIZE,
-            self.total_debt_redeemed,
-            self.total_collateral_redeemed,
-            self.total_number_of_redemptions,
-            self.total_profit_from_redemptions
-        ]
-
-
 class Logger:
-    def __init__(self):
-        self.entries = []
+    """
+      Columnar recorder, one preallocated array per column sized to MAX_STEPS
+      add_move writes a row in place, to_dataframe wraps the arrays without copying
+    """
+    def __init__(self, max_steps=MAX_STEPS):
+        self.length = 0
         self.headers = [
             "time",
             "system_collateral",
@@ -204,94 +138,63 @@ class Logger:
             "total_profit_from_redemptions"
             
         ]
-        os.makedirs('logs/fee_sims/', exist_ok=True)
 
-    def add_move(
-            self,
-            time,
-            system_collateral,
-            system_price,
-            target_LTV,
-            target_debt,
-            system_debt,
-            liquidator_fees_paid,
-            liquidator_profit,
-            swap_collateral_fees,
-            swap_stable_fees,
-            at_risk_debt,
-            at_risk_collateral,
-            current_cr,
-            current_at_risk_cr,
-            underwater_debt,
-            underwater_collateral,
-            global_liquidation_count,
-            global_is_insolvent,
-            global_purges_count,
+        ## Every column passed to add_move, in order
+        ## NOTE: underwater_* are recorded and plotted but not in the CSV
+        self.columns = self.headers[:14] + ["underwater_debt", "underwater_collateral"] + self.headers[14:]
 
-            AMM_DISCOUNT,
-            AMM_DISCOUNT_SIZE,
-            total_debt_redeemed,
-            total_collateral_redeemed,
-            total_number_of_redemptions,
-            total_profit_from_redemptions
-    ):
-        # Add entry
-        move = CsvEntry(
-            time,
-            system_collateral,
-            system_price,
-            target_LTV,
-            target_debt,
-            system_debt,
-            liquidator_fees_paid,
-            liquidator_profit,
-            swap_collateral_fees,
-            swap_stable_fees,
-            at_risk_debt,
-            at_risk_collateral,
-            current_cr,
-            current_at_risk_cr,
-            underwater_debt,
-            underwater_collateral,
-            global_liquidation_count,
-            global_is_insolvent,
-            global_purges_count,
+        ## Counters are ints, rest is floats
+        int_columns = [
+            "time",
+            "global_liquidation_count",
+            "global_is_insolvent",
+            "global_purges_count",
+            "total_number_of_redemptions"
+        ]
+        self.data = {
+            column: np.zeros(max_steps, dtype=np.int64 if column in int_columns else np.float64)
+            for column in self.columns
+        }
 
-            AMM_DISCOUNT,
-            AMM_DISCOUNT_SIZE,
-            total_debt_redeemed,
-            total_collateral_redeemed,
-            total_number_of_redemptions,
-            total_profit_from_redemptions
-        )
-        self.entries.append(move)
+    def add_move(self, *values):
+        ## Same positional order as self.columns
+        if self.length == len(self.data["time"]):
+            self.grow()
+
+        for column, value in zip(self.columns, values):
+            self.data[column][self.length] = value
+        self.length += 1
+
+    def grow(self):
+        ## Only if we run past max_steps, double the capacity
+        for column, values in self.data.items():
+            self.data[column] = np.concatenate([values, np.zeros_like(values)])
+
+    def __len__(self):
+        return self.length
 
     def __repr__(self):
         return str(self.__dict__)
 
+    def to_dataframe(self):
+        ## Slices are views, copy=False keeps them as the DataFrame columns
+        return pd.DataFrame(
+            {column: values[:self.length] for column, values in self.data.items()},
+            copy=False
+        )
+
     def to_csv(self):
         # Create a file with current time as name
+        os.makedirs('logs/fee_sims/', exist_ok=True)
         filename = f'logs/fee_sims/{pd.Timestamp.now()}.csv'
 
-        with open(filename, 'w', encoding='UTF8') as f:
-            writer = csv.writer(f)
-
-            # write the header
-            writer.writerow(self.headers)
-
-            # write the data
-            for entry in self.entries:
-                writer.writerow(entry.to_entry())
-
-    def plot_to_png(self, filename=f'logs/fee_sims/{pd.Timestamp.now()}.png'):
-        # convert CsvEntry objects to a single DataFrame
-        df = (pd.DataFrame(self.entries)[0]
-              .astype(str)
-              .map(eval)
-              .apply(pd.Series)
-              .set_index('time')
-              )
-        print(df.info())
+        self.to_dataframe().to_csv(filename, columns=self.headers, index=False, encoding='UTF8')
+
+    def plot_to_png(self, filename=f'logs/fee_sims/{pd.Timestamp.now()}.png', verbose=False):
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        df = self.to_dataframe().set_index('time')
+        if verbose:
+            df.info()
         df.style.set_caption("Hello World")
 
         # generate subplot for every column; save to single png
@@ -314,19 +217,46 @@ class Logger:
         fig.savefig(filename, dpi=200)
 
 
-def main():
+def main(
+        seed=None,
+        verbosity=VERBOSITY,
+        price_path=None,
+        to_csv=None,
+        max_steps=MAX_STEPS,
+        max_ltv=SETTING_LTV_MAX,
+        minting_fee=None,
+        liq_fee=None,
+        amm_fee=MAX_AMM_FEE,
+        max_swing=MAX_SWING,
+        yolo_denom=YOLO_DENOM,
+        redemption_denom=REDEMPTION_DENOM
+):
+    ## NOTE: Below PER_TURN we don't even compute the values we only print
+    ## to_csv -> Output to CSV and PNG, defaults to SUMMARY <= verbosity < ROLEPLAY, so QUIET runs never touch the disk
+    ## price_path -> price after each turn (see lib/price_paths.py), replaces the coin flip swing
+    ## NOTE: The swing draws are still consumed, so the rest of the path matches the same seed without it
+    ## max_steps ... redemption_denom -> same as scripts/fee_sim_batch.run_batch, so one swept path replays here
+    summary = verbosity >= SUMMARY
+    per_turn = verbosity >= PER_TURN
+    if to_csv is None:
+        to_csv = summary and verbosity < ROLEPLAY
+
     # Maximum Collateral Ratio
-    MAX_LTV = SETTING_LTV_MAX
+    MAX_LTV = max_ltv
+
+    LOGGER = Logger(max_steps)
 
-    LOGGER = Logger()
+    ## Same seed -> same path, see scripts/fee_sim_batch.py
+    rng = make_rng(seed)
+    setup_draws = rng.random(SETUP_DRAWS)
 
     # How risk the trove will get, MAX_BPS = Full send, 0 = We do not even mint
-    RISK_PERCENT = random() * MAX_BPS
+    RISK_PERCENT = setup_draws[0] * MAX_BPS
 
-    MINTING_FEE = random() * MAX_MINT_FEE
-    LIQ_FEE = random() * MAX_LIQ_FEE
+    MINTING_FEE = setup_draws[1] * MAX_MINT_FEE if minting_fee is None else minting_fee
+    LIQ_FEE = setup_draws[2] * MAX_LIQ_FEE if liq_fee is None else liq_fee
 
-    AMM_FEE = MAX_AMM_FEE
+    AMM_FEE = amm_fee
     ## Positive = Cheaper
     ## TODO: Add to rest of sim
     ## NOTE: For now, we just set once per turn and re-set back
@@ -338,18 +268,20 @@ def main():
     total_number_of_redemptions = 0
     total_profit_from_redemptions = 0
 
-    system_collateral = MAX_INITIAL_COLLAT * random()
+    system_collateral = MAX_INITIAL_COLLAT * setup_draws[3]
     system_price = INITIAL_PRICE
 
-    print("Initial Setup")
-    print("Price", system_price)
-    print("Collateral", system_collateral)
+    if summary:
+        print("Initial Setup")
+        print("Price", system_price)
+        print("Collateral", system_collateral)
 
     # Lever to target
     target_LTV = MAX_LTV * RISK_PERCENT / MAX_BPS / MAX_BPS
     target_debt = system_collateral * system_price * target_LTV
-    print("Intitial Debt", target_debt)
-    print("Initial LTV", target_LTV)
+    if summary:
+        print("Intitial Debt", target_debt)
+        print("Initial LTV", target_LTV)
     system_debt = target_debt
 
     # To avoid exponentianting later
@@ -361,6 +293,9 @@ def main():
     ### How many time did we liquidate everything
     global_purges_count = 0
 
+    ### How many turns did we end insolvent
+    global_insolvent_turns = 0
+
     # We assume it's a portion of the debt, but we don't need to add
     system_minting_fee = system_debt * MINTING_FEE / MAX_BPS
 
@@ -399,27 +334,34 @@ def main():
 
     turn = 0
     # Main Loop
-    while (turn < MAX_STEPS):
-        print("")
-        print("")
-        print("")
-        print("--------------- Turn", turn, "---------------")
-
-        print("Total Debt", system_debt)
-        print("Total Collateral", system_collateral)
-        print("Collateral Ratio",
-              calculate_collateral_ratio(system_collateral, system_price, system_debt))
+    while (turn < max_steps):
+        if per_turn:
+            print("")
+            print("")
+            print("")
+            print("--------------- Turn", turn, "---------------")
+
+        draws = rng.random(TURN_DRAWS)
+
+        if per_turn:
+            print("Total Debt", system_debt)
+            print("Total Collateral", system_collateral)
+            print("Collateral Ratio",
+                  calculate_collateral_ratio(system_collateral, system_price, system_debt))
 
         #  Check insolvency for At Risk
         if (calculate_max_debt(at_risk_collateral, system_price, MAX_LTV) < at_risk_debt):
-            print("Debt is insolvent")
+            if per_turn:
+                print("Debt is insolvent")
 
             if (at_risk_collateral * system_price > at_risk_debt):
-                print("Economically worth saving")
+                if per_turn:
+                    print("Economically worth saving")
 
                 #  TODO: Add check for proper liquidation threshold
-                print("New CR Before Liquidation",
-                    calculate_collateral_ratio(system_collateral, system_price, system_debt))
+                if per_turn:
+                    print("New CR Before Liquidation",
+                        calculate_collateral_ratio(system_collateral, system_price, system_debt))
 
 
                 #  Cost of swapping from Stable to collateral
@@ -460,17 +402,20 @@ def main():
 
                 global_liquidation_count += 1
 
-                print("New CR After Liquidation",
-                      calculate_collateral_ratio(system_collateral, system_price, system_debt))
+                if per_turn:
+                    print("New CR After Liquidation",
+                          calculate_collateral_ratio(system_collateral, system_price, system_debt))
             else:
-                print("Risky debt is insolvent, but not worth saving, skip")
+                if per_turn:
+                    print("Risky debt is insolvent, but not worth saving, skip")
 
                 # Compute underwater values for the risky part of the sym
                 underwater_debt = at_risk_debt - calculate_max_debt(at_risk_collateral,
                                                                     system_price, MAX_LTV)
                 underwater_collateral = at_risk_collateral
         else:
-            print("Risky debt is solvent, skip")
+            if per_turn:
+                print("Risky debt is solvent, skip")
         
         global_is_insolvent = 0
 
@@ -478,7 +423,7 @@ def main():
         ## Create a arb for AMM size
         ## Arb is on the swap (buy cheaper, liquidate)
         ## Track them, and track life of CRs
-        if int(random() * 100) % REDEMPTION_DENOM == 0:
+        if int(draws[DRAW_REDEMPTION] * 100) % redemption_denom == 0:
             """
                 Redemptions
 
@@ -487,26 +432,31 @@ def main():
                 But haven't figured out the math yet
             """
             ## Add AMM Arb
-            AMM_DISCOUNT = random() * MAX_AMM_ARB / MAX_BPS
-            AMM_DISCOUNT_SIZE = system_collateral * random() * MAX_AMM_ARB_SIZE / MAX_BPS
+            AMM_DISCOUNT = draws[DRAW_AMM_DISCOUNT] * MAX_AMM_ARB / MAX_BPS
+            AMM_DISCOUNT_SIZE = system_collateral * draws[DRAW_AMM_DISCOUNT_SIZE] * MAX_AMM_ARB_SIZE / MAX_BPS
             
 
             discounted_price = system_price * (MAX_BPS - AMM_DISCOUNT) / MAX_BPS
-            print("discounted_price", discounted_price)
+            if per_turn:
+                print("discounted_price", discounted_price)
 
             profit_from_discount_per_token = system_price - discounted_price
-            print("profit_from_discount_per_token", profit_from_discount_per_token)
+            if per_turn:
+                print("profit_from_discount_per_token", profit_from_discount_per_token)
 
             total_profit = profit_from_discount_per_token * AMM_DISCOUNT_SIZE
-            print("total_profit", total_profit)
+            if per_turn:
+                print("total_profit", total_profit)
 
             ## Reduce Collateral at Price
-            print("CR Before Redemptions",
-                      calculate_collateral_ratio(system_collateral, system_price, system_debt))
+            if per_turn:
+                print("CR Before Redemptions",
+                          calculate_collateral_ratio(system_collateral, system_price, system_debt))
 
             
             collateral_redemed = AMM_DISCOUNT_SIZE / system_price
-            print("collateral_redemed", collateral_redemed)
+            if per_turn:
+                print("collateral_redemed", collateral_redemed)
 
             ## Reduce Debit at AMM SIZE
             system_debt -= AMM_DISCOUNT_SIZE
@@ -517,8 +467,9 @@ def main():
             total_number_of_redemptions += 1
             total_profit_from_redemptions += total_profit
 
-            print("CR After Redemptions",
-                calculate_collateral_ratio(system_collateral, system_price, system_debt))
+            if per_turn:
+                print("CR After Redemptions",
+                    calculate_collateral_ratio(system_collateral, system_price, system_debt))
         else:
             AMM_DISCOUNT = 0
             AMM_DISCOUNT_SIZE = 0
@@ -533,8 +484,9 @@ def main():
         ## NOTE: Not sure
         if (calculate_max_debt(system_collateral, system_price, MAX_LTV) < system_debt):
             if (system_collateral * system_price > system_debt):
-                print("Economically worth saving")
-                print("Global Liquidation, MUST INVESTIGATE")
+                if per_turn:
+                    print("Economically worth saving")
+                    print("Global Liquidation, MUST INVESTIGATE")
                 cost_to_liquidate = calculate_swap_fee(system_debt, AMM_FEE)
 
                 ## TODO: Figure out if profitable to purge
@@ -575,6 +527,7 @@ def main():
                 global_purges_count += 1
             else:
                 global_is_insolvent = 1
+                global_insolvent_turns += 1
 
                 underwater_debt = system_debt - calculate_max_debt(system_collateral, system_price,
                                                                MAX_LTV)
@@ -586,11 +539,12 @@ def main():
 
         # If random check passes we create more debt at the
         # maximum LTV possible to simulate risk taking behaviour
-        if int(random() * 100) % YOLO_DENOM == 0:
-            print("Simulate Degenerate Borrowing")
+        if int(draws[DRAW_YOLO] * 100) % yolo_denom == 0:
+            if per_turn:
+                print("Simulate Degenerate Borrowing")
 
             # Insolvency basic, figure out random debt
-            at_risk_collateral = random() * start_collateral
+            at_risk_collateral = draws[DRAW_YOLO_COLLATERAL] * start_collateral
 
             max_at_risk_debt = calculate_max_debt(at_risk_collateral, system_price, MAX_LTV)
 
@@ -602,38 +556,51 @@ def main():
             system_collateral += at_risk_collateral
             system_debt += at_risk_debt
 
+        if price_path is not None:
+            system_price = price_path[turn]
+            if per_turn:
+                print("New Price (from path)", system_price)
+
         # 50% Chance of price going down and 90% up
-        if int(random() * 100) % 2 == 0:
-            print("Price goes down")
+        elif int(draws[DRAW_PRICE_DIRECTION] * 100) % 2 == 0:
+            if per_turn:
+                print("Price goes down")
 
-            drawdown_value = random() * MAX_SWING
+            drawdown_value = draws[DRAW_SWING] * max_swing
 
-            print("Drawdown of (absolute)", drawdown_value)
+            if per_turn:
+                print("Drawdown of (absolute)", drawdown_value)
 
             # Bring Price Down
             system_price = system_price - drawdown_value
-            print("New Price", system_price)
+            if per_turn:
+                print("New Price", system_price)
 
-            print("Drawdown Collateral Ratio of At Risk Debt",
-                  calculate_collateral_ratio(at_risk_collateral, system_price, at_risk_debt))
-            print("Drawdown Collateral Ratio of System Including At Risk Debt",
-                  calculate_collateral_ratio(system_collateral, system_price, system_debt))
+            if per_turn:
+                print("Drawdown Collateral Ratio of At Risk Debt",
+                      calculate_collateral_ratio(at_risk_collateral, system_price, at_risk_debt))
+                print("Drawdown Collateral Ratio of System Including At Risk Debt",
+                      calculate_collateral_ratio(system_collateral, system_price, system_debt))
 
         else:
-            print("No Bad News Today, simulate price going up")
+            if per_turn:
+                print("No Bad News Today, simulate price going up")
 
-            pamp_value = random() * MAX_SWING
+            pamp_value = draws[DRAW_SWING] * max_swing
 
-            print("Pamp of (absolute)", pamp_value)
+            if per_turn:
+                print("Pamp of (absolute)", pamp_value)
             # Bring Price Up
             # NOTE: We do this as it may make some liquidations profitable
             system_price = system_price + pamp_value
-            print("New Price", system_price)
+            if per_turn:
+                print("New Price", system_price)
 
-            print("Pamp Collateral Ratio of At Risk Debt",
-                  calculate_collateral_ratio(at_risk_collateral, system_price, at_risk_debt))
-            print("Pamp Collateral Ratio of System Including At Risk Debt",
-                  calculate_collateral_ratio(system_collateral, system_price, system_debt))
+            if per_turn:
+                print("Pamp Collateral Ratio of At Risk Debt",
+                      calculate_collateral_ratio(at_risk_collateral, system_price, at_risk_debt))
+                print("Pamp Collateral Ratio of System Including At Risk Debt",
+                      calculate_collateral_ratio(system_collateral, system_price, system_debt))
 
         # TODO: Figure out if we want it here or somewhere else
         current_cr = calculate_collateral_ratio(system_collateral, system_price, system_debt)
@@ -672,16 +639,33 @@ def main():
         )
 
         # NOTE: Indentation, we're still in the while
-        if ROLEPLAY:
+        if verbosity >= ROLEPLAY:
             time.sleep(2)
 
         # Next turn
         turn += 1
 
-    #  NOTE: No longer in while, save to file
-    if TO_CSV:
+    #  NOTE: No longer in while, print summary and save to file
+    if summary:
+        print("")
+        print("--------------- Summary ---------------")
+        print("Turns", turn)
+        print("Final Price", system_price)
+        print("Final Debt", system_debt)
+        print("Final Collateral", system_collateral)
+        print("Final Collateral Ratio", current_cr)
+        print("Liquidations", global_liquidation_count)
+        print("Purges", global_purges_count)
+        print("Insolvent Turns", global_insolvent_turns)
+        print("Redemptions", total_number_of_redemptions)
+        print("Liquidator Profit", liquidator_profit)
+        print("Liquidator Fees Paid", liquidator_fees_paid)
+
+    if to_csv:
         LOGGER.to_csv()
-        LOGGER.plot_to_png()
+        LOGGER.plot_to_png(verbose=per_turn)
+
+    return LOGGER
 
 
 def calculate_swap_fee(amount_in, fee_bps):
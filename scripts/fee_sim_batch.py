@@ -0,0 +1,314 @@
+"""
+  Batched Fee Sim
+
+  Same sim as scripts/fee_sim.py, but advances N independent paths at once
+  Every piece of state is a NumPy array with one slot per path
+  Each branch of the scalar loop (Liquidation, Redemption, Global Purge, YOLO Borrow, Price Swing)
+  is a masked update, so a turn costs a handful of array ops instead of N python loops
+
+  Path i consumes the same draws as fee_sim.main(seed=seeds[i])
+  Which means the final state of each path matches the scalar loop bit for bit
+
+  NOTE: No logging per turn, only the final state is returned
+"""
+import time
+
+import numpy as np
+
+from lib.rng import make_rng
+from scripts.fee_sim import (
+    MAX_BPS,
+    MAX_SWING,
+    MAX_MINT_FEE,
+    MAX_LIQ_FEE,
+    MAX_AMM_FEE,
+    MAX_AMM_ARB,
+    MAX_AMM_ARB_SIZE,
+    INITIAL_PRICE,
+    MAX_STEPS,
+    MAX_INITIAL_COLLAT,
+    YOLO_DENOM,
+    REDEMPTION_DENOM,
+    SETTING_LTV_MAX,
+    SETUP_DRAWS,
+    TURN_DRAWS,
+    DRAW_REDEMPTION,
+    DRAW_AMM_DISCOUNT,
+    DRAW_AMM_DISCOUNT_SIZE,
+    DRAW_YOLO,
+    DRAW_YOLO_COLLATERAL,
+    DRAW_PRICE_DIRECTION,
+    DRAW_SWING,
+)
+
+## Paths for main()
+N_PATHS = 1_000
+
+## Turns of draws we hold in memory at once
+## N_PATHS * CHUNK_SIZE * TURN_DRAWS floats -> 1k paths = 28 MB
+CHUNK_SIZE = 500
+
+
+def calculate_swap_fee(amount_in, fee_bps):
+    return amount_in * fee_bps / MAX_BPS
+
+
+def calculate_collateral_ratio(collateral, price, debt):
+    ## Same as fee_sim, 0 when there's no collateral
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = debt / (collateral * price)
+    return np.where(collateral == 0, 0, ratio)
+
+
+def calculate_max_debt(collateral, price, max_ltv):
+    return collateral * price * max_ltv / MAX_BPS
+
+
+def roll(denom, draw):
+    ## Vectorized `int(random() * 100) % denom == 0`
+    return (draw * 100).astype(np.int64) % denom == 0
+
+
+def run_batch(
+        seeds,
+        max_steps=MAX_STEPS,
+        max_ltv=SETTING_LTV_MAX,
+        minting_fee=None,
+        liq_fee=None,
+        amm_fee=MAX_AMM_FEE,
+        max_swing=MAX_SWING,
+        yolo_denom=YOLO_DENOM,
+        redemption_denom=REDEMPTION_DENOM,
+        chunk_size=CHUNK_SIZE,
+        price_paths=None
+):
+    """
+      Run one path per seed, returns a dict of per-path arrays
+      Keys match fee_sim.Logger.headers (plus underwater_*, global_insolvent_turns, system_minting_fee and system_liquidation_fee)
+
+      minting_fee and liq_fee are drawn per path like fee_sim.main() unless set
+      NOTE: No step charges liq_fee (fee_sim doesn't either), system_liquidation_fee is what it would have collected
+      on the debt of every liquidation and purge, so the liq_fee axis of a sweep is an output, not a change of path
+      NOTE: The setup draws are consumed either way, so paths stay aligned with the scalar loop
+
+      price_paths -> shape (len(seeds), max_steps), replaces the price swing like fee_sim.main(price_path=)
+    """
+    rngs = [make_rng(seed) for seed in seeds]
+    n = len(rngs)
+
+    setup_draws = np.stack([rng.random(SETUP_DRAWS) for rng in rngs])
+
+    RISK_PERCENT = setup_draws[:, 0] * MAX_BPS
+    MINTING_FEE = setup_draws[:, 1] * MAX_MINT_FEE if minting_fee is None else np.full(n, minting_fee, dtype=np.float64)
+    LIQ_FEE = setup_draws[:, 2] * MAX_LIQ_FEE if liq_fee is None else np.full(n, liq_fee, dtype=np.float64)
+
+    AMM_FEE = amm_fee
+    AMM_DISCOUNT = np.zeros(n)
+    AMM_DISCOUNT_SIZE = np.zeros(n)
+
+    total_debt_redeemed = np.zeros(n)
+    total_collateral_redeemed = np.zeros(n)
+    total_number_of_redemptions = np.zeros(n, dtype=np.int64)
+    total_profit_from_redemptions = np.zeros(n)
+
+    system_collateral = MAX_INITIAL_COLLAT * setup_draws[:, 3]
+    system_price = np.full(n, INITIAL_PRICE, dtype=np.float64)
+
+    target_LTV = max_ltv * RISK_PERCENT / MAX_BPS / MAX_BPS
+    target_debt = system_collateral * system_price * target_LTV
+    system_debt = target_debt.copy()
+
+    start_collateral = system_collateral.copy()
+
+    # We assume it's a portion of the debt, but we don't need to add
+    system_minting_fee = system_debt * MINTING_FEE / MAX_BPS
+    system_liquidation_fee = np.zeros(n)
+
+    global_liquidation_count = np.zeros(n, dtype=np.int64)
+    global_is_insolvent = np.zeros(n, dtype=np.int64)
+    global_purges_count = np.zeros(n, dtype=np.int64)
+
+    ## NOTE: Not in the scalar loop, how many turns did we end insolvent
+    global_insolvent_turns = np.zeros(n, dtype=np.int64)
+
+    liquidator_fees_paid = np.zeros(n)
+    liquidator_profit = np.zeros(n)
+    swap_collateral_fees = np.zeros(n)
+    swap_stable_fees = np.zeros(n)
+
+    at_risk_debt = np.zeros(n)
+    at_risk_collateral = np.zeros(n)
+
+    underwater_debt = np.zeros(n)
+    underwater_collateral = np.zeros(n)
+
+    turn = 0
+    while turn < max_steps:
+        ## Pull the next chunk of draws for each path, shape (turns, paths, draws)
+        steps = min(chunk_size, max_steps - turn)
+        chunk = np.stack([rng.random((steps, TURN_DRAWS)) for rng in rngs], axis=1)
+
+        for step, draws in enumerate(chunk):
+            ## === Liquidation of At Risk === ##
+            at_risk_max_debt = calculate_max_debt(at_risk_collateral, system_price, max_ltv)
+            at_risk_insolvent = at_risk_max_debt < at_risk_debt
+            worth_saving = at_risk_collateral * system_price > at_risk_debt
+
+            liquidate = at_risk_insolvent & worth_saving
+            skip = at_risk_insolvent & ~worth_saving
+
+            cost_to_liquidate = calculate_swap_fee(at_risk_debt, AMM_FEE)
+            liquidation_premium = at_risk_collateral * system_price - cost_to_liquidate - at_risk_debt
+            second_swap_fees = calculate_swap_fee(liquidation_premium, AMM_FEE)
+
+            system_collateral = np.where(liquidate, system_collateral - at_risk_collateral, system_collateral)
+            system_debt = np.where(liquidate, system_debt - at_risk_debt, system_debt)
+
+            swap_collateral_fees = np.where(liquidate, swap_collateral_fees + cost_to_liquidate, swap_collateral_fees)
+            swap_stable_fees = np.where(liquidate, swap_stable_fees + second_swap_fees, swap_stable_fees)
+
+            liquidator_fees_paid = np.where(liquidate, liquidator_fees_paid + (cost_to_liquidate + second_swap_fees), liquidator_fees_paid)
+            liquidator_profit = np.where(liquidate, liquidator_profit + (liquidation_premium - second_swap_fees), liquidator_profit)
+            system_liquidation_fee = np.where(liquidate, system_liquidation_fee + at_risk_debt * LIQ_FEE / MAX_BPS, system_liquidation_fee)
+
+            ## Not worth saving, compute underwater values before we reset the At Risk
+            underwater_debt = np.where(skip, at_risk_debt - at_risk_max_debt, underwater_debt)
+            underwater_collateral = np.where(skip, at_risk_collateral, underwater_collateral)
+
+            at_risk_collateral = np.where(liquidate, 0.0, at_risk_collateral)
+            at_risk_debt = np.where(liquidate, 0.0, at_risk_debt)
+            underwater_debt = np.where(liquidate, 0.0, underwater_debt)
+            underwater_collateral = np.where(liquidate, 0.0, underwater_collateral)
+
+            global_liquidation_count += liquidate
+
+            global_is_insolvent = np.zeros(n, dtype=np.int64)
+
+            ## === Redemptions === ##
+            redeem = roll(redemption_denom, draws[:, DRAW_REDEMPTION])
+
+            discount = draws[:, DRAW_AMM_DISCOUNT] * MAX_AMM_ARB / MAX_BPS
+            discount_size = system_collateral * draws[:, DRAW_AMM_DISCOUNT_SIZE] * MAX_AMM_ARB_SIZE / MAX_BPS
+            AMM_DISCOUNT = np.where(redeem, discount, 0.0)
+            AMM_DISCOUNT_SIZE = np.where(redeem, discount_size, 0.0)
+
+            discounted_price = system_price * (MAX_BPS - AMM_DISCOUNT) / MAX_BPS
+            profit_from_discount_per_token = system_price - discounted_price
+            total_profit = profit_from_discount_per_token * AMM_DISCOUNT_SIZE
+            collateral_redemed = AMM_DISCOUNT_SIZE / system_price
+
+            system_debt = np.where(redeem, system_debt - AMM_DISCOUNT_SIZE, system_debt)
+            system_collateral = np.where(redeem, system_collateral - collateral_redemed, system_collateral)
+
+            total_debt_redeemed = np.where(redeem, total_debt_redeemed + AMM_DISCOUNT_SIZE, total_debt_redeemed)
+            total_collateral_redeemed = np.where(redeem, total_collateral_redeemed + collateral_redemed, total_collateral_redeemed)
+            total_number_of_redemptions += redeem
+            total_profit_from_redemptions = np.where(redeem, total_profit_from_redemptions + total_profit, total_profit_from_redemptions)
+
+            ## === Global Purge === ##
+            system_max_debt = calculate_max_debt(system_collateral, system_price, max_ltv)
+            system_insolvent = system_max_debt < system_debt
+            worth_purging = system_collateral * system_price > system_debt
+
+            purge = system_insolvent & worth_purging
+            insolvent = system_insolvent & ~worth_purging
+
+            cost_to_liquidate = calculate_swap_fee(system_debt, AMM_FEE)
+            liquidation_premium = system_collateral * system_price - cost_to_liquidate - system_debt
+            second_swap_fees = calculate_swap_fee(liquidation_premium, AMM_FEE)
+
+            swap_collateral_fees = np.where(purge, swap_collateral_fees + cost_to_liquidate, swap_collateral_fees)
+            swap_stable_fees = np.where(purge, swap_stable_fees + second_swap_fees, swap_stable_fees)
+
+            liquidator_fees_paid = np.where(purge, liquidator_fees_paid + (cost_to_liquidate + second_swap_fees), liquidator_fees_paid)
+            liquidator_profit = np.where(purge, liquidator_profit + (liquidation_premium - second_swap_fees), liquidator_profit)
+            system_liquidation_fee = np.where(purge, system_liquidation_fee + system_debt * LIQ_FEE / MAX_BPS, system_liquidation_fee)
+
+            global_is_insolvent = insolvent.astype(np.int64)
+            global_insolvent_turns += insolvent
+
+            ## NOTE: All collateral is underwater as liquidations can take all assets
+            underwater_debt = np.where(insolvent, system_debt - system_max_debt, underwater_debt)
+            underwater_collateral = np.where(insolvent, system_collateral, underwater_collateral)
+
+            system_collateral = np.where(purge, 0.0, system_collateral)
+            system_debt = np.where(purge, 0.0, system_debt)
+            at_risk_collateral = np.where(purge, 0.0, at_risk_collateral)
+            at_risk_debt = np.where(purge, 0.0, at_risk_debt)
+            underwater_debt = np.where(purge, 0.0, underwater_debt)
+            underwater_collateral = np.where(purge, 0.0, underwater_collateral)
+
+            global_purges_count += purge
+
+            ## === Degenerate Borrowing === ##
+            yolo = roll(yolo_denom, draws[:, DRAW_YOLO])
+
+            yolo_collateral = draws[:, DRAW_YOLO_COLLATERAL] * start_collateral
+            yolo_debt = calculate_max_debt(yolo_collateral, system_price, max_ltv)
+
+            at_risk_collateral = np.where(yolo, yolo_collateral, at_risk_collateral)
+            at_risk_debt = np.where(yolo, yolo_debt, at_risk_debt)
+
+            system_collateral = np.where(yolo, system_collateral + at_risk_collateral, system_collateral)
+            system_debt = np.where(yolo, system_debt + at_risk_debt, system_debt)
+
+            ## === Price Swing === ##
+            if price_paths is not None:
+                system_price = np.asarray(price_paths[:, turn + step], dtype=np.float64)
+            else:
+                goes_down = roll(2, draws[:, DRAW_PRICE_DIRECTION])
+                swing = draws[:, DRAW_SWING] * max_swing
+                system_price = np.where(goes_down, system_price - swing, system_price + swing)
+
+        turn += steps
+
+    return {
+        "time": np.full(n, max_steps - 1),
+        "system_collateral": system_collateral,
+        "system_price": system_price,
+        "target_LTV": target_LTV,
+        "target_debt": target_debt,
+        "system_debt": system_debt,
+        "liquidator_fees_paid": liquidator_fees_paid,
+        "liquidator_profit": liquidator_profit,
+        "swap_collateral_fees": swap_collateral_fees,
+        "swap_stable_fees": swap_stable_fees,
+        "at_risk_debt": at_risk_debt,
+        "at_risk_collateral": at_risk_collateral,
+        "current_cr": calculate_collateral_ratio(system_collateral, system_price, system_debt),
+        "current_at_risk_cr": calculate_collateral_ratio(at_risk_collateral, system_price, at_risk_debt),
+        "underwater_debt": underwater_debt,
+        "underwater_collateral": underwater_collateral,
+        "global_liquidation_count": global_liquidation_count,
+        "global_is_insolvent": global_is_insolvent,
+        "global_purges_count": global_purges_count,
+        "global_insolvent_turns": global_insolvent_turns,
+        "system_minting_fee": system_minting_fee,
+        "system_liquidation_fee": system_liquidation_fee,
+
+        "AMM_DISCOUNT": AMM_DISCOUNT,
+        "AMM_DISCOUNT_SIZE": AMM_DISCOUNT_SIZE,
+        "total_debt_redeemed": total_debt_redeemed,
+        "total_collateral_redeemed": total_collateral_redeemed,
+        "total_number_of_redemptions": total_number_of_redemptions,
+        "total_profit_from_redemptions": total_profit_from_redemptions,
+    }
+
+
+def main():
+    seeds = range(N_PATHS)
+
+    start = time.time()
+    result = run_batch(seeds)
+    elapsed = time.time() - start
+
+    print("Paths", N_PATHS, "Steps", MAX_STEPS, "in", elapsed, "seconds")
+    print("Avg Final CR", result["current_cr"].mean())
+    print("Avg Purges", result["global_purges_count"].mean())
+    print("Avg Liquidations", result["global_liquidation_count"].mean())
+    print("Avg Insolvent Turns", result["global_insolvent_turns"].mean())
+    print("Avg Liquidator Profit", result["liquidator_profit"].mean())
+
+
+if __name__ == '__main__':
+    main()
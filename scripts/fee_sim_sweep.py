@@ -0,0 +1,168 @@
+"""
+  Parameter Sweep for the Fee Sim
+
+  Explore the fee / LTV space without editing constants by hand
+  Takes a grid or a random sample over:
+  - max_ltv
+  - minting_fee
+  - liq_fee (reported as liquidation_fees, no step charges it, see fee_sim_batch.run_batch)
+  - amm_fee
+  - max_swing
+  - yolo_denom
+  - redemption_denom
+
+  Each configuration runs PATHS_PER_CONFIG paths through scripts/fee_sim_batch.py
+  Configurations are fanned out over a ProcessPoolExecutor, one summary row per configuration
+
+  Usage:
+    python -m scripts.fee_sim_sweep --mode grid --paths 100 --workers 8
+    python -m scripts.fee_sim_sweep --mode random --samples 500 --seed 42
+"""
+import argparse
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from scripts.fee_sim import (
+    MAX_MINT_FEE,
+    MAX_LIQ_FEE,
+    MAX_AMM_FEE,
+    MAX_STEPS,
+    SETTING_LTV_MIN,
+    SETTING_LTV_MAX,
+)
+from scripts.fee_sim_batch import run_batch
+from lib.rng import make_rng, spawn_seeds
+
+PATHS_PER_CONFIG = 100
+
+## Root seed, each configuration gets its own child stream
+SEED = 123
+
+## Default grid, anything not listed uses the fee_sim constant
+SWEEP_GRID = {
+    "max_ltv": [5_000, 6_500, 7_500, SETTING_LTV_MAX],
+    "amm_fee": [30, 100, MAX_AMM_FEE],
+    "max_swing": [5, 10, 25],
+    "yolo_denom": [3, 7],
+    "redemption_denom": [1, 5],
+}
+
+## Default ranges for random sampling, (low, high)
+## NOTE: Denoms are integers, sampled in [low, high]
+SWEEP_RANGES = {
+    "max_ltv": (SETTING_LTV_MIN, SETTING_LTV_MAX),
+    "minting_fee": (0, MAX_MINT_FEE),
+    "liq_fee": (0, MAX_LIQ_FEE),
+    "amm_fee": (0, MAX_AMM_FEE),
+    "max_swing": (1, 50),
+    "yolo_denom": (1, 20),
+    "redemption_denom": (1, 10),
+}
+
+INTEGER_PARAMS = ["yolo_denom", "redemption_denom"]
+
+
+def grid(**axes):
+    """
+      Cartesian product of the given axes
+      grid(max_ltv=[5_000, 8_333], amm_fee=[30, 300]) -> 4 configs
+    """
+    names = list(axes.keys())
+    return [dict(zip(names, values)) for values in itertools.product(*axes.values())]
+
+
+def random_sample(samples, seed=SEED, **ranges):
+    """
+      Uniform sample of `samples` configs within the given (low, high) ranges
+    """
+    rng = make_rng(seed)
+    configs = [{} for _ in range(samples)]
+    for name, (low, high) in ranges.items():
+        if name in INTEGER_PARAMS:
+            values = rng.integers(low, high, endpoint=True, size=samples)
+        else:
+            values = rng.uniform(low, high, size=samples)
+        for config, value in zip(configs, values):
+            config[name] = value.item()
+
+    return configs
+
+
+def summarize(config, result):
+    ## One row per configuration, averaged over its paths
+    row = dict(config)
+    row["paths"] = len(result["current_cr"])
+    row["final_cr"] = result["current_cr"].mean()
+    row["final_debt"] = result["system_debt"].mean()
+    row["final_collateral"] = result["system_collateral"].mean()
+    row["purges"] = result["global_purges_count"].mean()
+    row["liquidations"] = result["global_liquidation_count"].mean()
+    row["insolvent_turns"] = result["global_insolvent_turns"].mean()
+    row["ended_insolvent"] = result["global_is_insolvent"].mean()
+    row["liquidator_profit"] = result["liquidator_profit"].mean()
+    row["liquidator_fees_paid"] = result["liquidator_fees_paid"].mean()
+    row["minting_fees"] = result["system_minting_fee"].mean()
+    row["liquidation_fees"] = result["system_liquidation_fee"].mean()
+    row["profit_from_redemptions"] = result["total_profit_from_redemptions"].mean()
+    return row
+
+
+def run_config(job):
+    ## Worker, must stay at module level so the pool can pickle it
+    config, seed_sequence, paths, max_steps = job
+    seeds = spawn_seeds(seed_sequence, paths)
+    result = run_batch(seeds, max_steps=max_steps, **config)
+    return summarize(config, result)
+
+
+def sweep(configs, paths=PATHS_PER_CONFIG, max_steps=MAX_STEPS, seed=SEED, max_workers=None):
+    """
+      Run every config over a process pool, returns a DataFrame with one row per config
+      Same seed -> same table, regardless of max_workers
+      Path j of config i can be replayed alone, with the same config and max_steps:
+        fee_sim.main(seed=path_seed(seed, i, j), max_steps=max_steps, **configs[i])
+        run_batch([path_seed(seed, i, j)], max_steps=max_steps, **configs[i])
+    """
+    seed_sequences = spawn_seeds(seed, len(configs))
+    jobs = [(config, seed_sequence, paths, max_steps) for config, seed_sequence in zip(configs, seed_sequences)]
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        rows = list(executor.map(run_config, jobs))
+
+    return pd.DataFrame(rows)
+
+
+def to_csv(df):
+    path = 'logs/fee_sims/sweeps/'
+    os.makedirs(path, exist_ok=True)
+    filename = f'{path}{pd.Timestamp.now()}.csv'
+    df.to_csv(filename, index=False)
+    return filename
+
+
+def main(mode="grid", samples=100, paths=PATHS_PER_CONFIG, max_steps=MAX_STEPS, seed=SEED, max_workers=None):
+    if mode == "grid":
+        configs = grid(**SWEEP_GRID)
+    else:
+        configs = random_sample(samples, seed, **SWEEP_RANGES)
+
+    print("Running", len(configs), "configs of", paths, "paths")
+    df = sweep(configs, paths=paths, max_steps=max_steps, seed=seed, max_workers=max_workers)
+    print(df)
+    print("Saved to", to_csv(df))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Parameter sweep for the fee sim")
+    parser.add_argument("--mode", choices=["grid", "random"], default="grid")
+    parser.add_argument("--samples", type=int, default=100, help="Configs to draw in random mode")
+    parser.add_argument("--paths", type=int, default=PATHS_PER_CONFIG, help="Paths per config")
+    parser.add_argument("--steps", type=int, default=MAX_STEPS)
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--workers", type=int, default=None, help="Defaults to all cores")
+    args = parser.parse_args()
+
+    main(args.mode, args.samples, args.paths, args.steps, args.seed, args.workers)
@@ -1,4 +1,4 @@
-from random import random
+from lib.rng import make_random
 
 """
   Basic Hedging Math Sim based on:
@@ -130,11 +130,12 @@ def sim(volatility_bps):
 ROUNDS = 10_000
 
 
-def main():
+def main(seed=None):
+  rng = make_random(seed)
   max = 0
   for i in range(ROUNDS):
     try:
-      vol = round(random() * MAX_VOLATILITY) + 1
+      vol = round(rng.random() * MAX_VOLATILITY) + 1
       sim(vol)
 
       if vol > max:
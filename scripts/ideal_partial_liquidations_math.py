@@ -1,10 +1,9 @@
-from random import random
-
 import matplotlib.pyplot as plt
 import pandas as pd
 import seaborn as sns
-from math import sqrt
 
+from lib.amm import price_given_in, amount_out_given_in, amount_in_give_out, max_in_before_price_limit, max_in_before_price_limit_sqrt
+from lib.rng import make_random
 from scripts.loggers.amm_price_impact_logger import AmmPriceImpactLogger, AmmPriceImpactEntry, AmmBruteForceLogger, AMMBruteForceEntry
 
 sns.set_style('whitegrid')
@@ -23,29 +22,6 @@ plt.rcParams['figure.figsize'] = 15, 30
   Modelling of fees and profit profile based on the value
 """
 
-def price_given_in(amount_in, reserve_in, reserve_out):
-  out = amount_out_given_in(amount_in, reserve_in, reserve_out)
-  return amount_in / out
-
-def amount_out_given_in(amount_in, reserve_in, reserve_out):
-  amount_out = reserve_out * amount_in / (reserve_in + amount_in)
-  return amount_out
-
-
-"""
-  Derived by the above
-"""
-def amount_in_give_out(amount_out, reserve_in, reserve_out):
-  amount_in = reserve_in * amount_out / (reserve_out - amount_out)
-  return amount_in
-
-def max_in_before_price_limit(price_limit, reserve_in, reserve_out):
-  return reserve_out * price_limit - reserve_in
-
-def max_in_before_price_limit_sqrt(price_limit, reserve_in, reserve_out):
-  return sqrt(reserve_out * reserve_in * price_limit) - reserve_in
-
-
 
 MAX_LTV = 8_500 ## 85% / 117.647058824% CR
 
@@ -69,7 +45,9 @@ MIN_PROFIT = 0
 MAX_PROFIT = MAX_BPS - MAX_LTV
 
 
-def main():
+def main(seed=None):
+  rng = make_random(seed)
+
   ## TODO: RANGE FOR INSOLVENCY
 
   ## 1k ETH as base value
@@ -79,7 +57,7 @@ def main():
   ## TODO: Prob need to change
 
   ## Add 10% just in case
-  AVG_LTV = random() * MINT_LTV + MIN_LTV
+  AVG_LTV = rng.random() * MINT_LTV + MIN_LTV
   ## Take it back if too much
   if(AVG_LTV > MINT_LTV):
     AVG_LTV -= MIN_LTV
@@ -91,7 +69,7 @@ def main():
   print("TOTAL_BTC_DEBT", TOTAL_BTC_DEBT)
 
   ## Between 50 and 99.999999999%
-  liquidation_percent = random() * 5_000 + 5_000
+  liquidation_percent = rng.random() * 5_000 + 5_000
   print("Assuming CDP Whale is", liquidation_percent / MAX_BPS * 100, "percent of all debt")
 
   liquidation_collateral_amount = TOTAL_ETH_COLL * liquidation_percent / MAX_BPS
@@ -0,0 +1,163 @@
+import os
+from abc import ABC, abstractmethod
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+"""
+  Streaming sinks for cdp_sim.Logger
+
+  The Logger hands over each full batch of events as NumPy columns and forgets them
+  So memory stays at one batch no matter how long the sim runs
+
+  - ArrowSink -> Arrow IPC file, read back memory-mapped (needs pyarrow)
+  - ParquetSink -> Parquet, one row group per batch (needs pyarrow)
+  - CsvSink -> CSV, appended batch by batch, fallback when pyarrow is missing
+
+  Actor names are written next to the events on close, as {path}.actors.csv
+  pyarrow is optional, see requirements-optional.txt
+
+  Usage:
+    sink = make_sink()
+    logger = Logger(sink=sink)
+    ... run the sim ...
+    logger.close()
+    events = read_events(sink.path)  ## pa.Table for arrow, see read_events
+"""
+
+COLUMNS = ["time", "actor", "label", "value"]
+
+if pa is not None:
+    SCHEMA = pa.schema([
+        ("time", pa.int64()),
+        ("actor", pa.int32()),
+        ("label", pa.int8()),
+        ("value", pa.float64()),
+    ])
+
+
+def actors_path(path):
+    return f'{path}.actors.csv'
+
+
+class EventSink(ABC):
+    """
+      Interface, write() gets a dict of equal length columns (see COLUMNS)
+      Every sink starts a fresh file at path, an existing one is overwritten
+    """
+    def __init__(self, path):
+        self.path = path
+        self.rows = 0
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    @abstractmethod
+    def write(self, columns):
+        pass
+
+    def close(self, actor_names):
+        pd.DataFrame({"actor": np.arange(len(actor_names)), "name": actor_names}).to_csv(
+            actors_path(self.path), index=False
+        )
+
+
+class CsvSink(EventSink):
+    def __init__(self, path):
+        super().__init__(path)
+        ## Truncate and write the header now, so a rerun on the same path never mixes with the old rows
+        pd.DataFrame(columns=COLUMNS).to_csv(path, index=False)
+
+    def write(self, columns):
+        pd.DataFrame(columns, columns=COLUMNS).to_csv(self.path, mode='a', header=False, index=False)
+        self.rows += len(columns["time"])
+
+
+class ArrowSink(EventSink):
+    def __init__(self, path):
+        super().__init__(path)
+        self.writer = pa.ipc.new_file(path, SCHEMA)
+
+    def write(self, columns):
+        self.writer.write_batch(pa.record_batch([columns[name] for name in COLUMNS], schema=SCHEMA))
+        self.rows += len(columns["time"])
+
+    def close(self, actor_names):
+        self.writer.close()
+        super().close(actor_names)
+
+
+class ParquetSink(EventSink):
+    def __init__(self, path):
+        super().__init__(path)
+        self.writer = pq.ParquetWriter(path, SCHEMA)
+
+    def write(self, columns):
+        self.writer.write_table(pa.table([columns[name] for name in COLUMNS], schema=SCHEMA))
+        self.rows += len(columns["time"])
+
+    def close(self, actor_names):
+        self.writer.close()
+        super().close(actor_names)
+
+
+def make_sink(path=None, format=None):
+    """
+      format: "arrow", "parquet" or "csv", defaults to arrow if pyarrow is installed, csv otherwise
+    """
+    if format is None:
+        format = "arrow" if pa is not None else "csv"
+
+    if format in ["arrow", "parquet"] and pa is None:
+        raise ImportError(f"{format} output needs pyarrow, use format='csv' or pip install -r requirements-optional.txt")
+
+    if path is None:
+        path = f'logs/cdp_sims/{pd.Timestamp.now()}.{format}'
+
+    return {"arrow": ArrowSink, "parquet": ParquetSink, "csv": CsvSink}[format](path)
+
+
+def read_table(path):
+    """
+      An Arrow sink's output as a pa.Table over the memory map, nothing is copied into memory
+      The buffers keep the mapping alive after the file is closed
+    """
+    with pa.memory_map(path, 'r') as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+def read_events(path, with_names=True):
+    """
+      Load a sink's output
+      Arrow -> pa.Table, memory-mapped (see read_table), actor_name is a dictionary column on the actor ids
+               .to_pandas() when you want a DataFrame, that copies every column
+      Parquet -> DataFrame, memory-mapped while decoding
+      CSV -> DataFrame, read normally (use pd.read_csv(path, chunksize=...) for huge files)
+    """
+    if path.endswith(".arrow"):
+        table = read_table(path)
+        if with_names and os.path.exists(actors_path(path)):
+            names = pa.array(pd.read_csv(actors_path(path))["name"].to_numpy(dtype=str))
+            actor_names = pa.chunked_array(
+                [pa.DictionaryArray.from_arrays(chunk, names) for chunk in table["actor"].chunks],
+                type=pa.dictionary(pa.int32(), pa.string())
+            )
+            table = table.append_column("actor_name", actor_names)
+        return table
+
+    if path.endswith(".parquet"):
+        df = pq.read_table(path, memory_map=True).to_pandas()
+    else:
+        df = pd.read_csv(path)
+
+    if with_names and os.path.exists(actors_path(path)):
+        names = pd.read_csv(actors_path(path))["name"].to_numpy()
+        ## int64, a CSV without events reads back as object columns
+        df["actor_name"] = names[df["actor"].to_numpy(dtype=np.int64)]
+
+    return df
@@ -1,13 +1,22 @@
-from random import random
+import os
+
+import numpy as np
+import pandas as pd
+
+from lib.rng import make_rng
 
 """
   Demonstrates the number of partial liquidations based on the minimum liquidatable size
 
   NOTE: Ignores requirement for CR
   NOTE: Also ignores if the depositor were to re-collateralize, which we can imagine would make this even more complex
+
+  Each round cuts cut_percent of what's left, so after k rounds we have start * (1 - cut) ** k
+  Rounds until we're at or below MIN_VALUE = ceil(log(MIN_VALUE / start) / log(1 - cut))
+  We compute that for all RUNS at once, so we can afford a 10 BPS CUT_STEP_SIZE
 """
 
-## 1k eth
+## 1k eth
 MAX_VALUE = 1000e18
 
 ## 2e18 is insta liquidated
@@ -21,35 +30,72 @@ MAX_BUT_PERCENT_BPS = 10_000
 
 CUT_STEP_SIZE = 1_000
 
+## e.g. main(cut_step_size=FINE_CUT_STEP_SIZE)
+FINE_CUT_STEP_SIZE = 10
+
 RUNS = 100_000
 
-def main():
-  ranges = reversed(range(MIN_CUT_PERCENT_BPS, MAX_BUT_PERCENT_BPS, CUT_STEP_SIZE))
+
+def rounds_closed_form(start_values, cut_percent):
+  """
+    Rounds of `remaining -= remaining * cut_percent / MAX_BPS` until remaining <= MIN_VALUE
+    NOTE: Exact math, the while loop compounds float rounding so at an exact boundary it can be 1 round off
+  """
+  start_values = np.asarray(start_values, dtype=np.float64)
+  keep = 1 - cut_percent / MAX_BPS
+
+  with np.errstate(divide='ignore'):
+    rounds = np.ceil(np.log(MIN_VALUE / start_values) / np.log(keep))
+
+  ## Anything above MIN takes at least a round (cut_percent == MAX_BPS -> log(0))
+  rounds = np.where(start_values > MIN_VALUE, np.maximum(rounds, 1), 0)
+  return rounds.astype(np.int64)
+
+
+def rounds_iterative(start_values, cut_percent):
+  """
+    The original while loop, run for every sample at once
+    Same floats as the scalar loop but O(max rounds), use to check rounds_closed_form
+  """
+  remaining = np.array(start_values, dtype=np.float64)
+  rounds = np.zeros(remaining.shape, dtype=np.int64)
+
+  active = remaining > MIN_VALUE
+  while active.any():
+    remaining = np.where(active, remaining - (remaining * cut_percent / MAX_BPS), remaining)
+    rounds += active
+    active = remaining > MIN_VALUE
+
+  return rounds
+
+
+def main(cut_step_size=CUT_STEP_SIZE, runs=RUNS, seed=None):
+  rng = make_rng(seed)
+
+  ## NOTE: Same samples for every cut, so the cuts are compared on the same CDPs
+  start_values = MAX_VALUE * rng.random(runs) + MIN_VALUE
+
+  ranges = reversed(range(MIN_CUT_PERCENT_BPS, MAX_BUT_PERCENT_BPS, cut_step_size))
+  histograms = []
   for cut_percent in ranges:
-    print("cut_percent", cut_percent)
-    max = 0
-    min = 9e99
-    sum = 0
-    for run in range(RUNS):
-      start_value = MAX_VALUE * random() + MIN_VALUE
-      remaining = start_value
-      rounds = 0
-
-      while (remaining > MIN_VALUE) :
-        remaining = remaining - (remaining * cut_percent / MAX_BPS)
-
-        rounds += 1
-      
-      if rounds > max:
-        max = rounds
-      
-      if rounds < min:
-        min = rounds
-      
-      sum += rounds
-  
+    rounds = rounds_closed_form(start_values, cut_percent)
+
     print("range", cut_percent)
-    print("max", max)
-    print("min", min)
-    print("avg", sum / RUNS)
-      
+    print("max", rounds.max())
+    print("min", rounds.min())
+    print("avg", rounds.mean())
+
+    ## Full histogram, count of samples for each number of rounds
+    counts = np.bincount(rounds)
+    observed = np.nonzero(counts)[0]
+    histograms.append(pd.DataFrame({
+      "cut_percent": cut_percent,
+      "rounds": observed,
+      "count": counts[observed]
+    }))
+
+  path = 'logs/partial_liquidations/'
+  os.makedirs(path, exist_ok=True)
+  filename = f'{path}{pd.Timestamp.now()}.csv'
+  pd.concat(histograms).to_csv(filename, index=False)
+  print("Histograms saved to", filename)
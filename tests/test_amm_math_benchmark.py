@@ -0,0 +1,10 @@
+import pytest
+
+from lib.amm import UNIV2_FEE
+from scripts.amm_math_benchmark import CASES, check_case
+
+
+@pytest.mark.parametrize("fee", [1, UNIV2_FEE])
+@pytest.mark.parametrize("name,fn,first", CASES, ids=[case[0] for case in CASES])
+def test_array_matches_scalar_loop(name, fn, first, fee):
+    check_case(fn, first, fee)
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from scripts.loggers.cdp_event_sink import EventSink, make_sink, read_events
+
+NAMES = ["UserA", "Trove0", "Pool"]
+
+
+def events(n, offset=0):
+    return {
+        "time": np.arange(offset, offset + n, dtype=np.int64),
+        "actor": (np.arange(n) % len(NAMES)).astype(np.int32),
+        "label": np.ones(n, dtype=np.int8),
+        "value": np.linspace(0, 1, n),
+    }
+
+
+def write_run(path, format, batches):
+    sink = make_sink(str(path), format)
+    for (i, n) in enumerate(batches):
+        sink.write(events(n, offset=100 * i))
+    sink.close(NAMES)
+    return sink
+
+
+def test_event_sink_is_abstract():
+    with pytest.raises(TypeError):
+        EventSink("logs/never.csv")
+
+
+def test_csv_sink_starts_a_fresh_file(tmp_path):
+    path = tmp_path / "events.csv"
+    write_run(path, "csv", [5, 3])
+    write_run(path, "csv", [2])
+
+    df = read_events(str(path))
+    assert df["time"].tolist() == [0, 1]
+    assert df["actor_name"].tolist() == NAMES[:2]
+
+
+def test_csv_sink_without_events(tmp_path):
+    path = tmp_path / "empty.csv"
+    write_run(path, "csv", [])
+
+    assert len(read_events(str(path))) == 0
+
+
+def test_arrow_sink_reads_back_memory_mapped(tmp_path):
+    pa = pytest.importorskip("pyarrow")
+    path = tmp_path / "events.arrow"
+    write_run(path, "arrow", [5, 3])
+
+    table = read_events(str(path))
+    assert isinstance(table, pa.Table)
+    assert table.num_rows == 8
+    assert table["time"].to_pylist() == list(range(5)) + list(range(100, 103))
+    ## One chunk per batch, straight from the file
+    assert table["value"].num_chunks == 2
+    assert table["actor_name"].to_pylist() == [NAMES[i % len(NAMES)] for i in list(range(5)) + list(range(3))]
+
+
+def test_parquet_sink_round_trip(tmp_path):
+    pytest.importorskip("pyarrow")
+    path = tmp_path / "events.parquet"
+    write_run(path, "parquet", [4, 4])
+
+    df = read_events(str(path))
+    assert len(df) == 8
+    assert df["actor_name"].tolist()[:3] == NAMES